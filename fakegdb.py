@@ -0,0 +1,904 @@
+"""In-process stand-in for the gdb module
+
+Lets sacdebug be imported, tested and profiled in plain CPython:
+
+    import fakegdb
+    fakegdb.install()
+    import sacdebug
+
+The inferior is a FakeProgram driven by a script of calls, variable writes
+and returns. Each step fires the stop events GDB would for the breakpoints,
+finish breakpoints and watchpoints that have been placed.
+"""
+import bisect
+import itertools
+import re
+import shlex
+import struct
+import sys
+import types
+
+BP_BREAKPOINT = 1
+BP_WATCHPOINT = 6
+BP_HARDWARE_WATCHPOINT = 7
+BP_READ_WATCHPOINT = 8
+BP_ACCESS_WATCHPOINT = 9
+WP_READ = 1
+WP_WRITE = 2
+WP_ACCESS = 3
+
+COMMAND_NONE = -1
+COMMAND_RUNNING = 0
+COMMAND_DATA = 1
+COMMAND_STACK = 2
+COMMAND_FILES = 3
+COMMAND_SUPPORT = 4
+COMMAND_STATUS = 5
+COMMAND_BREAKPOINTS = 6
+COMMAND_TRACEPOINTS = 7
+COMMAND_OBSCURE = 8
+COMMAND_MAINTENANCE = 9
+COMMAND_USER = 13
+COMPLETE_NONE = 0
+COMPLETE_FILENAME = 1
+COMPLETE_SYMBOL = 3
+
+PARAM_BOOLEAN = 0
+PARAM_UINTEGER = 2
+PARAM_INTEGER = 3
+PARAM_STRING = 4
+PARAM_ZUINTEGER = 10
+
+TYPE_CODE_PTR = 1
+TYPE_CODE_ARRAY = 2
+TYPE_CODE_STRUCT = 3
+TYPE_CODE_INT = 8
+TYPE_CODE_FLT = 9
+TYPE_CODE_VOID = 10
+TYPE_CODE_BOOL = 20
+TYPE_CODE_CHAR = 19
+
+VERSION = "fake"
+
+
+class error(RuntimeError):
+    pass
+
+
+class GdbError(Exception):
+    pass
+
+
+class MemoryError(error):
+    pass
+
+
+class EventRegistry(object):
+    def __init__(self):
+        self.handlers = list()
+
+    def connect(self, handler):
+        self.handlers.append(handler)
+
+    def disconnect(self, handler):
+        self.handlers.remove(handler)
+
+    def fire(self, event):
+        for handler in list(self.handlers):
+            handler(event)
+
+
+EVENT_NAMES = ["stop", "cont", "exited", "memory_changed", "register_changed", "breakpoint_created",
+               "breakpoint_modified", "breakpoint_deleted", "new_objfile", "clear_objfiles", "new_thread",
+               "inferior_call", "before_prompt"]
+events = types.SimpleNamespace(**dict((name, EventRegistry()) for name in EVENT_NAMES))
+
+
+class StopEvent(object):
+    def __init__(self, inferior_thread=None):
+        self.inferior_thread = inferior_thread
+
+
+class BreakpointEvent(StopEvent):
+    def __init__(self, breakpoints, inferior_thread=None):
+        super(BreakpointEvent, self).__init__(inferior_thread)
+        self.breakpoints = breakpoints
+        self.breakpoint = breakpoints[0]
+
+
+class SignalEvent(StopEvent):
+    def __init__(self, stop_signal, inferior_thread=None):
+        super(SignalEvent, self).__init__(inferior_thread)
+        self.stop_signal = stop_signal
+
+
+class ContinueEvent(object):
+    def __init__(self, inferior_thread=None):
+        self.inferior_thread = inferior_thread
+
+
+class NewObjFileEvent(object):
+    def __init__(self, new_objfile):
+        self.new_objfile = new_objfile
+
+
+class ClearObjFilesEvent(object):
+    def __init__(self, progspace):
+        self.progspace = progspace
+
+
+class Type(object):
+    def __init__(self, name, code, sizeof, target=None, is_signed=True):
+        self.name = name
+        self.code = code
+        self.sizeof = sizeof
+        self.is_signed = is_signed
+        self._target = target
+
+    def target(self):
+        if self._target is None:
+            raise RuntimeError("Type does not have a target.")
+        return self._target
+
+    def pointer(self):
+        return Type(None, TYPE_CODE_PTR, 8, self)
+
+    def strip_typedefs(self):
+        return self
+
+    def __str__(self):
+        if self.code == TYPE_CODE_PTR:
+            return str(self._target) + " *"
+        return self.name
+
+    def __eq__(self, other):
+        return isinstance(other, Type) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+TYPES = dict((t.name, t) for t in [
+    Type("char", TYPE_CODE_INT, 1), Type("int", TYPE_CODE_INT, 4), Type("long", TYPE_CODE_INT, 8),
+    Type("unsigned long", TYPE_CODE_INT, 8, is_signed=False), Type("float", TYPE_CODE_FLT, 4),
+    Type("double", TYPE_CODE_FLT, 8), Type("bool", TYPE_CODE_BOOL, 1, is_signed=False)])
+TYPE_FORMATS = {("char", 1): "b", ("int", 4): "i", ("long", 8): "q", ("unsigned long", 8): "Q",
+                ("float", 4): "f", ("double", 8): "d", ("bool", 1): "?"}
+
+
+def lookup_type(name):
+    if name.endswith("*"):
+        return lookup_type(name[:-1].strip()).pointer()
+    try:
+        return TYPES[name]
+    except KeyError:
+        raise error("No type named %s." % name)
+
+
+class Value(object):
+    """A typed value, either held directly or read from program memory at an address"""
+
+    def __init__(self, value, value_type=None, address=None):
+        if isinstance(value, Value):
+            value_type = value_type or value.type
+            value = value.value
+        if value_type is None:
+            value_type = TYPES["double"] if isinstance(value, float) else TYPES["long"]
+        self.value = value
+        self.type = value_type
+        self.address = address
+        self.is_optimized_out = False
+        self.is_lazy = False
+
+    def cast(self, value_type):
+        return Value(self.value, value_type)
+
+    def dereference(self):
+        target = self.type.target()
+        return Value(program.load(int(self), target), target, Value(int(self), self.type))
+
+    def __getitem__(self, index):
+        target = self.type.target()
+        address = int(self) + index * target.sizeof
+        return Value(program.load(address, target), target, Value(address, self.type))
+
+    def __int__(self):
+        return int(self.value)
+
+    def __index__(self):
+        return int(self.value)
+
+    def __float__(self):
+        return float(self.value)
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def __eq__(self, other):
+        return self.value == (other.value if isinstance(other, Value) else other)
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __lt__(self, other):
+        return self.value < (other.value if isinstance(other, Value) else other)
+
+    def __gt__(self, other):
+        return self.value > (other.value if isinstance(other, Value) else other)
+
+    def __str__(self):
+        if self.type.code == TYPE_CODE_PTR:
+            return "0x%x" % int(self.value)
+        return str(self.value)
+
+
+class Symtab(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+    def fullname(self):
+        return self.filename
+
+
+class Symtab_and_line(object):
+    def __init__(self, line, pc, symtab=None):
+        self.line = line
+        self.pc = pc
+        self.symtab = symtab
+
+
+class Symbol(object):
+    def __init__(self, name, line=0, is_argument=False, is_function=False):
+        self.name = name
+        self.print_name = name
+        self.linkage_name = name
+        self.line = line
+        self.is_argument = is_argument
+        self.is_variable = not is_argument and not is_function
+        self.is_function = is_function
+        self.needs_frame = not is_function
+
+    def value(self, frame=None):
+        if frame is None:
+            raise error("symbol requires a frame to compute its value")
+        value = frame.read_var(self.name)
+        if self.name in frame.optimized_out:
+            value = Value(0, value.type)
+            value.is_optimized_out = True
+        return value
+
+    def is_valid(self):
+        return True
+
+
+class Block(object):
+    def __init__(self, symbols, superblock=None, function=None, start=0, end=0):
+        self.symbols = symbols
+        self.superblock = superblock
+        self.function = function
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        return iter(self.symbols)
+
+    def is_valid(self):
+        return True
+
+
+class Frame(object):
+    """A function activation with its variables kept in program memory"""
+
+    def __init__(self, function, variables=(), pc=0x1000, line=0, decl_lines=None, optimized_out=(),
+                 blocks=None):
+        self.function_name = function
+        self.pc_value = pc
+        self.line = line
+        self.optimized_out = set(optimized_out)
+        self.addresses = dict()
+        self.types = dict()
+        self.older_frame = None
+        self.newer_frame = None
+        self.valid = True
+        # Stack holding the frame and its position in it, set once it is called
+        self.stack = None
+        self.index = 0
+        decl_lines = decl_lines or dict()
+
+        for name in variables:
+            value = variables[name] if isinstance(variables, dict) else 0
+            value_type = value.type if isinstance(value, Value) else TYPES["long"]
+            self.types[name] = value_type
+            self.addresses[name] = program.allocate(value_type.sizeof)
+            program.store(self.addresses[name], value_type, value.value if isinstance(value, Value) else value)
+
+        # One function block unless nested blocks are given as lists of names, outermost first
+        function_symbol = Symbol(function, is_function=True)
+        if blocks is None:
+            blocks = [list(variables)]
+        block = None
+        for i, names in enumerate(blocks):
+            symbols = [Symbol(name, decl_lines.get(name, 0)) for name in names]
+            block = Block(symbols, block, function_symbol if i == 0 else None)
+        self.innermost_block = block
+
+    def name(self):
+        return self.function_name
+
+    def function(self):
+        return Symbol(self.function_name, is_function=True)
+
+    def pc(self):
+        return self.pc_value
+
+    def block(self):
+        if self.innermost_block is None:
+            raise RuntimeError("Cannot locate block for frame.")
+        return self.innermost_block
+
+    def find_sal(self):
+        return Symtab_and_line(self.line, self.pc_value, Symtab("prog.c"))
+
+    def read_var(self, name):
+        if name not in self.addresses:
+            raise ValueError("Variable '%s' not found." % name)
+        address = self.addresses[name]
+        return Value(program.load(address, self.types[name]), self.types[name], Value(address, self.types[name].pointer()))
+
+    def read_register(self, name):
+        return Value(self.pc_value if name in ("pc", "rip") else 0)
+
+    def older(self):
+        return self.older_frame
+
+    def newer(self):
+        return self.newer_frame
+
+    def level(self):
+        if self.stack is not None:
+            return len(self.stack) - 1 - self.index
+        level = 0
+        frame = self.newer_frame
+        while frame is not None:
+            level += 1
+            frame = frame.newer_frame
+        return level
+
+    def is_valid(self):
+        return self.valid
+
+    def select(self):
+        program.selected = self
+
+    def __eq__(self, other):
+        return self is other
+
+    __hash__ = None
+
+
+class InferiorThread(object):
+    def __init__(self, num, inferior):
+        self.num = num
+        self.global_num = num
+        self.ptid = (inferior.pid, inferior.pid + num - 1, 0)
+        self.name = None
+        self.inferior = inferior
+        self.stack = list()
+
+    def is_valid(self):
+        return True
+
+    def switch(self):
+        program.switch_thread(self)
+
+
+class Inferior(object):
+    def __init__(self, pid=1000):
+        self.num = 1
+        self.pid = pid
+        self.was_attached = False
+        self.thread_list = list()
+
+    def threads(self):
+        return tuple(self.thread_list)
+
+    def read_memory(self, address, length):
+        return memoryview(program.read(address, length))
+
+    def write_memory(self, address, buffer, length=None):
+        data = bytes(buffer)
+        if length is not None:
+            data = data[:length]
+        program.write(address, data)
+
+    def is_valid(self):
+        return True
+
+
+class Objfile(object):
+    def __init__(self, filename, build_id=None):
+        self.filename = filename
+        self.username = filename
+        self.build_id = build_id
+        self.valid = True
+
+    def is_valid(self):
+        return self.valid
+
+
+class Breakpoint(object):
+    def __init__(self, spec, type=BP_BREAKPOINT, wp_class=WP_WRITE, internal=False, temporary=False):
+        if type == BP_WATCHPOINT and program.can_use_hw_watchpoints:
+            type = BP_HARDWARE_WATCHPOINT
+        self.type = type
+        self.location = spec if type == BP_BREAKPOINT else None
+        self.expression = spec if type != BP_BREAKPOINT else None
+        self.wp_class = wp_class
+        self.visible = not internal
+        self.temporary = temporary
+        self.silent = False
+        self.enabled = True
+        self.hit_count = 0
+        self.ignore_count = 0
+        self.condition = None
+        self.thread = None
+        self.task = None
+        self.number = next(program.internal_numbers if internal else program.user_numbers)
+        self.valid = True
+        program.add_breakpoint(self)
+        events.breakpoint_created.fire(self)
+
+    def stop(self):
+        return True
+
+    def is_valid(self):
+        return self.valid
+
+    def delete(self):
+        if not self.valid:
+            raise RuntimeError("Breakpoint %d is invalid." % self.number)
+        self.valid = False
+        program.remove_breakpoint(self)
+        events.breakpoint_deleted.fire(self)
+
+
+class FinishBreakpoint(Breakpoint):
+    def __init__(self, frame=None, internal=False):
+        self.frame = frame if frame is not None else selected_frame()
+        self.return_value = None
+        super(FinishBreakpoint, self).__init__("*0x%x" % self.frame.pc(), BP_BREAKPOINT, internal=internal,
+                                               temporary=True)
+        self.location = None
+
+    def out_of_scope(self):
+        pass
+
+
+def breakpoints():
+    return tuple(bp for bp in program.breakpoints.values() if bp.visible)
+
+
+class Command(object):
+    def __init__(self, name, command_class=COMMAND_NONE, completer_class=COMPLETE_NONE, prefix=False):
+        self.command_name = name
+        program.commands[name] = self
+
+    def dont_repeat(self):
+        pass
+
+    def invoke(self, argument, from_tty):
+        raise NotImplementedError
+
+
+class Parameter(object):
+    def __init__(self, name, command_class, parameter_class, enum_sequence=None):
+        self.parameter_name = name
+        self.parameter_class = parameter_class
+        self.value = None
+        program.parameters[name] = self
+
+    def parse(self, text):
+        """Converts the argument of set to the parameter's value like GDB does"""
+        if self.parameter_class == PARAM_BOOLEAN:
+            if text not in ("on", "off"):
+                raise error('"on" or "off" expected.')
+            return text == "on"
+        if self.parameter_class in (PARAM_UINTEGER, PARAM_INTEGER, PARAM_ZUINTEGER):
+            try:
+                value = int(text, 0)
+            except ValueError:
+                raise error("Invalid number \"%s\"." % text)
+            if value < 0 and self.parameter_class != PARAM_INTEGER:
+                raise error("integer %d out of range" % value)
+            return value
+        return text
+
+
+class Function(object):
+    def __init__(self, name):
+        program.functions[name] = self
+
+
+WATCH_ADDRESS = re.compile(r"^\*\(.*\) (\d+)$")
+
+
+class FakeProgram(object):
+    """State of the fake inferior and the scripted execution driving it"""
+
+    def __init__(self):
+        self.commands = dict()
+        self.parameters = dict()
+        self.functions = dict()
+        self.breakpoints = dict()
+        # Breakpoints by location, watchpoints and finish breakpoints by number
+        self.locations = dict()
+        self.watchpoints = dict()
+        self.finish_breakpoints = dict()
+        # Finish breakpoints by the id of their frame, so returns don't scan all of them
+        self.frame_finish_breakpoints = dict()
+        self.user_numbers = itertools.count(1)
+        self.internal_numbers = itertools.count(-1, -1)
+        self.can_use_hw_watchpoints = 1
+        self.executed = list()
+        self.execute_handlers = dict()
+        self.objfiles = list()
+        self.memory = dict()
+        self.region_starts = list()
+        self.next_address = 0x10000
+        self.inferior = Inferior()
+        self.thread = InferiorThread(1, self.inferior)
+        self.inferior.thread_list.append(self.thread)
+        self.selected = None
+        self.stops = 0
+
+    # Memory
+
+    def allocate(self, size):
+        address = self.next_address
+        self.next_address += (size + 15) & ~15
+        self.memory[address] = bytearray(size)
+        self.region_starts.append(address)
+        return address
+
+    def allocate_array(self, fmt, values):
+        """Stores values in a new block of memory and returns its address"""
+        data = struct.pack("<%d%s" % (len(values), fmt), *values)
+        address = self.allocate(len(data))
+        self.memory[address][:] = data
+        return address
+
+    def region(self, address, length):
+        i = bisect.bisect_right(self.region_starts, address) - 1
+        if i >= 0:
+            start = self.region_starts[i]
+            data = self.memory[start]
+            if address + length <= start + len(data):
+                return data, address - start
+        raise MemoryError("Cannot access memory at address 0x%x" % address)
+
+    def read(self, address, length):
+        data, offset = self.region(address, length)
+        return bytes(data[offset:offset + length])
+
+    def write(self, address, data):
+        region, offset = self.region(address, len(data))
+        region[offset:offset + len(data)] = data
+
+    def load(self, address, value_type):
+        if value_type.code == TYPE_CODE_PTR:
+            return struct.unpack("<Q", self.read(address, 8))[0]
+        fmt = TYPE_FORMATS[(value_type.name, value_type.sizeof)]
+        return struct.unpack("<" + fmt, self.read(address, value_type.sizeof))[0]
+
+    def store(self, address, value_type, value):
+        if value_type.code == TYPE_CODE_PTR:
+            self.write(address, struct.pack("<Q", value))
+        else:
+            self.write(address, struct.pack("<" + TYPE_FORMATS[(value_type.name, value_type.sizeof)], value))
+
+    # Breakpoints
+
+    def add_breakpoint(self, bp):
+        self.breakpoints[bp.number] = bp
+        if isinstance(bp, FinishBreakpoint):
+            self.finish_breakpoints[bp.number] = bp
+            self.frame_finish_breakpoints.setdefault(id(bp.frame), dict())[bp.number] = bp
+        elif bp.expression is not None:
+            self.watchpoints[bp.number] = bp
+        else:
+            self.locations.setdefault(bp.location, dict())[bp.number] = bp
+
+    def remove_breakpoint(self, bp):
+        del self.breakpoints[bp.number]
+        if self.finish_breakpoints.pop(bp.number, None) is not None:
+            self.frame_finish_breakpoints.get(id(bp.frame), dict()).pop(bp.number, None)
+        self.watchpoints.pop(bp.number, None)
+        if bp.location in self.locations:
+            self.locations[bp.location].pop(bp.number, None)
+
+    # Frames and threads
+
+    def newest_frame(self):
+        return self.thread.stack[-1] if self.thread.stack else None
+
+    def switch_thread(self, thread):
+        self.thread = thread
+        self.selected = None
+
+    def load_objfile(self, filename, build_id=None):
+        """Loads a binary, like the program or a shared library being loaded"""
+        objfile = Objfile(filename, build_id)
+        self.objfiles.append(objfile)
+        events.new_objfile.fire(NewObjFileEvent(objfile))
+        return objfile
+
+    def clear_objfiles(self):
+        """Unloads every binary, like GDB does when the program is replaced"""
+        for objfile in self.objfiles:
+            objfile.valid = False
+        self.objfiles = list()
+        events.clear_objfiles.fire(ClearObjFilesEvent(None))
+
+    def add_thread(self):
+        thread = InferiorThread(len(self.inferior.thread_list) + 1, self.inferior)
+        self.inferior.thread_list.append(thread)
+        return thread
+
+    # Scripted execution
+
+    def resume(self):
+        self.selected = None
+        events.cont.fire(ContinueEvent(self.thread))
+
+    def report(self, hit):
+        """Fires a stop event for the breakpoints hit if any of them wants to stop"""
+        hit = [bp for bp in hit if bp.valid and bp.enabled]
+        for bp in hit:
+            bp.hit_count += 1
+        stopping = [bp for bp in hit if bp.stop()]
+        if not stopping:
+            return False
+
+        self.stops += 1
+        events.stop.fire(BreakpointEvent(stopping, self.thread))
+        for bp in stopping:
+            if bp.temporary and bp.valid:
+                bp.delete()
+        return True
+
+    def call(self, function, variables=(), **frame_args):
+        """Enters a function, stopping at breakpoints placed on it"""
+        self.resume()
+        frame = Frame(function, variables, **frame_args)
+        stack = self.thread.stack
+        if stack:
+            frame.older_frame = stack[-1]
+            stack[-1].newer_frame = frame
+        frame.stack = stack
+        frame.index = len(stack)
+        stack.append(frame)
+        return self.report(list(self.locations.get(function, dict()).values()))
+
+    def assign(self, name, value):
+        """Writes a variable of the newest frame, stopping at watchpoints on it"""
+        self.resume()
+        frame = self.newest_frame()
+        self.store(frame.addresses[name], frame.types[name], value)
+        events.memory_changed.fire(types.SimpleNamespace(address=frame.addresses[name],
+                                                         length=frame.types[name].sizeof))
+        return self.report([bp for bp in list(self.watchpoints.values()) if self.watches(bp.expression, frame, name)])
+
+    def watches(self, expression, frame, name):
+        match = WATCH_ADDRESS.match(expression)
+        if match is not None:
+            return int(match.group(1)) == frame.addresses[name]
+        return expression == name
+
+    def ret(self):
+        """Returns from the newest function, stopping at its finish breakpoints and the return address"""
+        self.resume()
+        frame = self.thread.stack.pop()
+        hit = list(self.frame_finish_breakpoints.pop(id(frame), dict()).values())
+        if self.thread.stack:
+            # Execution continues at the return address in the caller
+            caller = self.thread.stack[-1]
+            caller.newer_frame = None
+            hit += list(self.locations.get("*0x%x" % caller.pc(), dict()).values())
+        stopped = self.report(hit)
+        frame.valid = False
+        frame.stack = None
+        return stopped
+
+    def interrupt(self, stop_signal="SIGINT"):
+        """Stops the program with a signal, as Ctrl-C does"""
+        self.stops += 1
+        events.stop.fire(SignalEvent(stop_signal, self.thread))
+
+    def run(self, script):
+        """Replays a script of ("call", function, variables[, frame arguments]), ("assign", name, value)
+        and ("ret",) steps"""
+        for step in script:
+            if step[0] == "call" and len(step) == 4:
+                self.call(step[1], step[2], **step[3])
+            else:
+                getattr(self, step[0])(*step[1:])
+
+
+program = FakeProgram()
+
+
+def reset():
+    """Forgets every command, breakpoint, handler and frame"""
+    global program
+    program = FakeProgram()
+    for registry in vars(events).values():
+        registry.handlers = list()
+    frame_filters.clear()
+    del pretty_printers[:]
+
+
+def execute(command, from_tty=False, to_string=False):
+    program.executed.append(command)
+    words = command.split()
+    output = ""
+    if words[:2] == ["set", "can-use-hw-watchpoints"]:
+        program.can_use_hw_watchpoints = int(words[2])
+    elif words[:1] in (["set"], ["show"]) and len(words) > 1 and words[1] in program.parameters:
+        parameter = program.parameters[words[1]]
+        if words[0] == "set":
+            parameter.value = parameter.parse(" ".join(words[2:]))
+            output = parameter.get_set_string() if hasattr(parameter, "get_set_string") else ""
+        elif hasattr(parameter, "get_show_string"):
+            output = parameter.get_show_string(str(parameter.value)) + "\n"
+        else:
+            output = "%s\n" % parameter.value
+    elif words and words[0] in program.commands:
+        program.commands[words[0]].invoke(command[len(words[0]):].strip(), from_tty)
+    elif words and words[0] in program.execute_handlers:
+        output = program.execute_handlers[words[0]](command)
+        if not isinstance(output, str):
+            output = ""
+    if to_string:
+        return output
+    if output:
+        write(output)
+
+
+def parameter(name):
+    if name == "can-use-hw-watchpoints":
+        return program.can_use_hw_watchpoints
+    if name not in program.parameters:
+        raise RuntimeError("Could not find parameter `%s'." % name)
+    return program.parameters[name].value
+
+
+def write(string, stream=None):
+    sys.stdout.write(string)
+
+
+def flush(stream=None):
+    sys.stdout.flush()
+
+
+def string_to_argv(argument):
+    return shlex.split(argument)
+
+
+def selected_frame():
+    if program.selected is not None:
+        return program.selected
+    frame = program.newest_frame()
+    if frame is None:
+        raise error("No frame selected.")
+    return frame
+
+
+def newest_frame():
+    frame = program.newest_frame()
+    if frame is None:
+        raise error("No stack.")
+    return frame
+
+
+def selected_thread():
+    return program.thread
+
+
+def selected_inferior():
+    return program.inferior
+
+
+def inferiors():
+    return (program.inferior,)
+
+
+def objfiles():
+    return list(program.objfiles)
+
+
+def post_event(event):
+    event()
+
+
+def parse_and_eval(expression):
+    expression = expression.strip()
+    if re.match(r"^-?\d+$", expression):
+        return Value(int(expression), TYPES["long"])
+    if expression.startswith("&"):
+        value = selected_frame().read_var(expression[1:].strip())
+        return value.address
+    try:
+        return selected_frame().read_var(expression)
+    except (ValueError, error):
+        raise error("No symbol \"%s\" in current context." % expression)
+
+
+frame_filters = dict()
+pretty_printers = list()
+
+
+class FrameDecorator(object):
+    def __init__(self, base):
+        self._base = base
+
+    def elided(self):
+        return None
+
+    def function(self):
+        frame = self.inferior_frame()
+        return frame.name() or frame.pc()
+
+    def address(self):
+        return self.inferior_frame().pc()
+
+    def filename(self):
+        return "prog.c"
+
+    def frame_args(self):
+        return None
+
+    def frame_locals(self):
+        return None
+
+    def line(self):
+        return self.inferior_frame().find_sal().line
+
+    def inferior_frame(self):
+        if isinstance(self._base, FrameDecorator):
+            return self._base.inferior_frame()
+        return self._base
+
+
+class PrettyPrinter(object):
+    def __init__(self, name, subprinters=None):
+        self.name = name
+        self.subprinters = subprinters
+        self.enabled = True
+
+
+def register_pretty_printer(obj, printer, replace=False):
+    pretty_printers.insert(0, printer)
+
+
+def default_visualizer(value):
+    for printer in pretty_printers:
+        if printer.enabled:
+            visualizer = printer(value)
+            if visualizer is not None:
+                return visualizer
+    return None
+
+
+def install():
+    """Makes import gdb (and gdb.FrameDecorator, gdb.printing) return this module"""
+    module = sys.modules[__name__]
+    frame_decorator = types.ModuleType("gdb.FrameDecorator")
+    frame_decorator.FrameDecorator = FrameDecorator
+    printing = types.ModuleType("gdb.printing")
+    printing.PrettyPrinter = PrettyPrinter
+    printing.register_pretty_printer = register_pretty_printer
+    module.printing = printing
+    sys.modules["gdb"] = module
+    sys.modules["gdb.FrameDecorator"] = frame_decorator
+    sys.modules["gdb.printing"] = printing
+    return module
@@ -7,4 +7,18 @@ sac_array_exclude = {"__sz", "__dim", "__desc", "__shp"}
 # User defined types are mapped to SACt__NAMESPACE__typename
 sac_types = {"int": "i", "float": "f", "double": "d", "bool": "b"}
 
+# User defined types that may be used without their namespace, typename -> NAMESPACE
+sac_user_types = dict()
+
+# Codes of array axes whose extent or rank isn't known
+# Fixed extents are written as _n, e.g. int[.,6] is i_P_6
+sac_shape_codes = {"": "P", ".": "P", "*": "X", "+": "XP"}
+
+# Layout of the SaC runtime array descriptor, as indexes of its long words
+# The low bits of descriptor pointers are used as tags and have to be masked
+sac_desc_dim = 3
+sac_desc_size = 4
+sac_desc_shape = 5
+sac_desc_tag_mask = 0x3
+
 debugging = True
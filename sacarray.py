@@ -0,0 +1,231 @@
+import collections
+import math
+import re
+import struct
+
+# Elements read from the inferior in one go
+CHUNK_ELEMENTS = 1 << 17
+# Chunks kept around for random access while formatting
+CACHED_CHUNKS = 16
+# Elements printed at each end of an elided axis
+EDGE_ITEMS = 3
+# Arrays with more elements than this are printed elided
+ELIDE_THRESHOLD = 1000
+
+# memoryview formats of the element types, (kind, size, signed) -> format
+ELEMENT_FORMATS = {("int", 1, True): "b", ("int", 1, False): "B",
+                   ("int", 2, True): "h", ("int", 2, False): "H",
+                   ("int", 4, True): "i", ("int", 4, False): "I",
+                   ("int", 8, True): "q", ("int", 8, False): "Q",
+                   ("float", 4, True): "f", ("float", 8, True): "d",
+                   ("bool", 1, False): "?", ("bool", 1, True): "?"}
+
+
+# A variable with an optional selection, e.g. x[10:20, ::4]
+ARRAY_EXPRESSION = re.compile(r"\s*([A-Za-z_]\w*)\s*(?:\[(.*)\])?\s*$")
+
+
+def parse_array_expression(text):
+    """Splits an expression such as x[10:20, ::4] into the variable and its selection"""
+    match = ARRAY_EXPRESSION.match(text)
+    if match is None:
+        raise ValueError("Invalid array expression: %s" % text.strip())
+    return match.group(1), match.group(2) or ""
+
+
+def element_format(kind, size, signed=True):
+    """Returns the memoryview format of an element type, None if it can't be read in bulk"""
+    return ELEMENT_FORMATS.get((kind, size, signed))
+
+
+def parse_selection(text, shape):
+    """Parses a selection such as 10:20, ::4 into one (range, keep axis) pair per axis"""
+    axes = [axis.strip() for axis in text.split(",")] if text.strip() else list()
+    if len(axes) > len(shape):
+        raise ValueError("Too many indices for an array of rank %d" % len(shape))
+
+    selection = list()
+    for axis, extent in zip(axes + [":"] * (len(shape) - len(axes)), shape):
+        try:
+            if ":" in axis:
+                bounds = [int(b) if b.strip() else None for b in axis.split(":")]
+                if len(bounds) > 3:
+                    raise ValueError
+                if len(bounds) == 3 and bounds[2] == 0:
+                    raise ValueError("Slice step cannot be zero")
+                selection.append((range(*slice(*bounds).indices(extent)), True))
+            else:
+                index = int(axis)
+                if index < 0:
+                    index += extent
+                if not 0 <= index < extent:
+                    raise ValueError("Index %s is out of bounds for an axis of %d" % (axis, extent))
+                selection.append((range(index, index + 1), False))
+        except ValueError as e:
+            raise ValueError(str(e) or "Invalid index: %s" % axis)
+
+    return selection
+
+
+def selected_shape(selection):
+    """Returns the shape of the array left by a selection"""
+    return tuple(len(axis) for axis, keep in selection if keep)
+
+
+def strides(shape):
+    """Returns the row major element strides of a shape"""
+    result = [1] * len(shape)
+    for i in range(len(shape) - 2, -1, -1):
+        result[i] = result[i + 1] * shape[i + 1]
+    return result
+
+
+def is_full_selection(shape, selection):
+    """Returns True if a selection covers the whole array in order"""
+    return all(keep and axis == range(extent) for (axis, keep), extent in zip(selection, shape))
+
+
+def selection_mapper(shape, selection):
+    """Returns a function mapping flat indexes of the selected array to flat indexes of the array"""
+    axis_strides = strides(shape)
+    kept = [(axis, stride) for (axis, keep), stride in zip(selection, axis_strides) if keep]
+    base = sum(axis.start * stride for (axis, keep), stride in zip(selection, axis_strides) if not keep)
+    kept_strides = strides([len(axis) for axis, stride in kept])
+
+    def source_index(index):
+        offset = base
+        for (axis, stride), kept_stride in zip(kept, kept_strides):
+            i, index = divmod(index, kept_stride)
+            offset += axis[i] * stride
+        return offset
+
+    return source_index
+
+
+class ChunkedBuffer(object):
+    """Typed view of an inferior buffer that is read in large chunks on demand
+
+    read(byte_offset, byte_count) must return a buffer such as the memoryview
+    from Inferior.read_memory; it is never called for more than one chunk.
+    """
+
+    def __init__(self, read, count, fmt, chunk_elements=CHUNK_ELEMENTS):
+        self.read = read
+        self.count = count
+        self.format = fmt
+        self.itemsize = struct.calcsize(fmt)
+        self.chunk_elements = chunk_elements
+        self.cache = collections.OrderedDict()
+
+    def __len__(self):
+        return self.count
+
+    def read_chunk(self, index):
+        start = index * self.chunk_elements
+        stop = min(start + self.chunk_elements, self.count)
+        data = self.read(start * self.itemsize, (stop - start) * self.itemsize)
+        return memoryview(data).cast("B").cast(self.format)
+
+    def chunk(self, index):
+        data = self.cache.get(index)
+        if data is None:
+            data = self.read_chunk(index)
+            self.cache[index] = data
+            if len(self.cache) > CACHED_CHUNKS:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(index)
+        return data
+
+    def __getitem__(self, index):
+        return self.chunk(index // self.chunk_elements)[index % self.chunk_elements]
+
+    def chunks(self):
+        """Yields every chunk in order without keeping them cached"""
+        for index in range((self.count + self.chunk_elements - 1) // self.chunk_elements):
+            yield self.read_chunk(index)
+
+
+def selected_chunks(buffer, shape, selection, chunk_elements=CHUNK_ELEMENTS):
+    """Yields the selected elements of a ChunkedBuffer as a stream of chunks"""
+    if is_full_selection(shape, selection):
+        for chunk in buffer.chunks():
+            yield chunk
+        return
+
+    source_index = selection_mapper(shape, selection)
+    size = 1
+    for extent in selected_shape(selection):
+        size *= extent
+    for start in range(0, size, chunk_elements):
+        yield [buffer[source_index(i)] for i in range(start, min(start + chunk_elements, size))]
+
+
+def summarize(chunks, fmt):
+    """Returns the count, min, max, mean and NaN count of the values in a stream of chunks"""
+    is_float = fmt in ("f", "d")
+    count = 0
+    nan_count = 0
+    total = 0.0
+    minimum = None
+    maximum = None
+
+    for chunk in chunks:
+        if is_float:
+            chunk_nans = sum(map(math.isnan, chunk))
+            if chunk_nans:
+                nan_count += chunk_nans
+                chunk = [v for v in chunk if v == v]
+        if not len(chunk):
+            continue
+
+        count += len(chunk)
+        total += math.fsum(chunk) if is_float else sum(chunk)
+        chunk_min = min(chunk)
+        chunk_max = max(chunk)
+        minimum = chunk_min if minimum is None else min(minimum, chunk_min)
+        maximum = chunk_max if maximum is None else max(maximum, chunk_max)
+
+    return {"count": count, "min": minimum, "max": maximum,
+            "mean": total / count if count else None, "nan": nan_count}
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return repr(value)
+
+
+def format_array(get, shape, edge_items=EDGE_ITEMS, threshold=ELIDE_THRESHOLD):
+    """Formats an array as nested brackets, get(flat_index) returns its elements
+
+    Arrays with more than threshold elements only show edge_items elements at
+    each end of every axis, so only those elements are ever read.
+    """
+    if not shape:
+        return format_value(get(0))
+
+    size = 1
+    for extent in shape:
+        size *= extent
+    elide = size > threshold
+    axis_strides = strides(shape)
+
+    def shown(extent):
+        if elide and extent > 2 * edge_items:
+            return list(range(edge_items)) + [None] + list(range(extent - edge_items, extent))
+        return list(range(extent))
+
+    def format_axis(axis, offset):
+        items = list()
+        for i in shown(shape[axis]):
+            if i is None:
+                items.append("...")
+            elif axis == len(shape) - 1:
+                items.append(format_value(get(offset + i)))
+            else:
+                items.append(format_axis(axis + 1, offset + i * axis_strides[axis]))
+        separator = ", " if axis == len(shape) - 1 else ",\n" + " " * (axis + 1)
+        return "[" + separator.join(items) + "]"
+
+    return format_axis(0, 0)
@@ -0,0 +1,369 @@
+"""Offline benchmarks of the saclib hot paths and the sacdebug stop handler
+
+Runs without GDB against generated info locals / info functions corpora,
+and drives sacdebug through scripted sessions on the fakegdb stand-in:
+
+    python sacbench.py                      # run every benchmark
+    python sacbench.py --quick              # smaller corpora
+    python sacbench.py --save baseline.json
+    python sacbench.py --compare baseline.json
+"""
+import argparse
+import array
+import contextlib
+import importlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import fakegdb
+import globals
+import saceval
+import sacindex
+import saclib
+import sacsearch
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+QUICK_SIZES = [100, 1000]
+# Largest corpus the scripted sacdebug sessions run with unless asked for more
+GDB_MAX_SIZE = 10000
+# Slowdown against the baseline that counts as a regression
+REGRESSION_RATIO = 1.25
+
+SCALAR_TYPES = sorted(globals.sac_types)
+NAMESPACES = ["MAIN", "ARRAY", "MATH", "STDIO", "STRUCTURES"]
+# sacinfo functions queries: substring, namespace, argument filter, fuzzy and a namespace listing
+SEARCH_QUERIES = ["f", "f12", "MATH::f1", "f1(int[.])", "f1(*)", "f9x", "ARRAY::"]
+
+
+def generate_names(count):
+    return ["v%d" % i for i in range(count)]
+
+
+def generate_locals(count, ssa_depth=8, seed=0):
+    """Generates info locals text with count SaC variables spread over SSA chains"""
+    rng = random.Random(seed)
+    lines = list()
+    emal = 0
+    bases = generate_names(max(1, count // ssa_depth))
+    for i in range(count):
+        base = bases[i % len(bases)]
+        version = i // len(bases)
+        emal += 1
+        if i % 5 == 0:
+            name = "SACl_%s" % base if version == 0 else "SACl_%s__SSA0_%d" % (base, version)
+        else:
+            name = "SACp_emal_%d_%s" % (emal, base)
+            if version:
+                name += "__SSA0_%d" % version
+        lines.append("%s = %d" % (name, rng.randint(0, 1 << 30)))
+        # Arrays bring their descriptor variables along
+        if i % 3 == 0:
+            lines.append("%s__desc = 0x%x" % (name, rng.randint(0, 1 << 40)))
+            lines.append("%s__dim = 1" % name)
+        lines.append("i_%d = 0" % i)
+    return "\n".join(lines), bases
+
+
+def generate_type(rng):
+    base = rng.choice(SCALAR_TYPES)
+    rank = rng.randint(0, 3)
+    if rank == 0:
+        return base
+    if rank == 3 and rng.random() < 0.3:
+        return base + rng.choice(["[*]", "[+]"])
+    return base + "[" + ",".join(rng.choice([".", str(rng.randint(1, 64))]) for _ in range(rank)) + "]"
+
+
+def generate_signatures(count, seed=0):
+    """Generates count SaC function signatures as (name, argument types)"""
+    rng = random.Random(seed)
+    signatures = list()
+    for i in range(count):
+        name = "%s::f%d" % (rng.choice(NAMESPACES), i)
+        signatures.append((name, [generate_type(rng) for _ in range(rng.randint(0, 4))]))
+    return signatures
+
+
+def generate_functions(count, seed=0):
+    """Generates info functions text with count SACf__ symbols among runtime functions"""
+    lines = ["All defined functions:", "", "File prog.c:"]
+    for name, args in generate_signatures(count, seed):
+        c_name = saclib.sacfunc_to_c(name, args)
+        lines.append("%d:\tint %s(int, int);" % (len(lines), c_name))
+        lines.append("%d:\tstatic void SAC_runtime_%d(void);" % (len(lines), len(lines)))
+    return "\n".join(lines)
+
+
+def generate_command(blocks, bases, seed=0):
+    """Generates a command with blocks *sac() blocks alternating variables and functions"""
+    rng = random.Random(seed)
+    parts = ["print"]
+    for i in range(blocks):
+        if i % 4 == 3:
+            name, args = generate_signatures(1, seed + i)[0]
+            parts.append("*sac(%s(%s))" % (name, ", ".join(args)))
+        else:
+            parts.append("*sac(%s)" % rng.choice(bases))
+        parts.append("+")
+    return " ".join(parts[:-1])
+
+
+def load_sacdebug():
+    """Imports a fresh sacdebug against a reset fake gdb"""
+    fakegdb.install()
+    fakegdb.reset()
+    if "sacdebug" in sys.modules:
+        return importlib.reload(sys.modules["sacdebug"])
+    return importlib.import_module("sacdebug")
+
+
+def debug_state(sacdebug):
+    """Returns the size of the sacdebug breakpoint maps and variable stack after a session"""
+    return {"sac_func_bps": len(sacdebug.sac_func_bps), "sac_return_bps": len(sacdebug.sac_return_bps),
+            "sac_var_bps": len(sacdebug.sac_var_bps), "variable_stack": sum(len(state.variable_stack) for state in sacdebug.thread_states.values()),
+            "sac_trace_bps": len(sacdebug.sac_trace_bps) + len(sacdebug.sac_trace_return_bps),
+            "stops": fakegdb.program.stops}
+
+
+def session(script, functions, watch_ssa=False, trace=False, commands=()):
+    """Returns a function that replays script on a fresh sacdebug with functions armed or traced
+    and commands run"""
+    def replay():
+        sacdebug = load_sacdebug()
+        sacdebug.sac_watch_ssa = watch_ssa
+        for func in functions:
+            if trace:
+                sacdebug.symbol_index.add(func)
+            else:
+                sacdebug.arm_function(func)
+        # The commands and sactrace write to stdout, keep it out of the timings
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            if trace:
+                fakegdb.execute("sactrace start --size %d" % (2 * len(script)))
+            for command in commands:
+                fakegdb.execute(command)
+            fakegdb.program.run(script)
+        return debug_state(sacdebug)
+    return replay
+
+
+def dashboard(func, variables, commands, batch):
+    """Returns a function running the commands of a hook-stop dashboard at a stop, one by one or as a batch"""
+    def replay():
+        sacdebug = load_sacdebug()
+        sacdebug.arm_function(func)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            fakegdb.program.call(func, variables)
+            if batch:
+                fakegdb.execute("sac batch " + "; ".join(commands))
+            else:
+                for command in commands:
+                    fakegdb.execute("sac " + command)
+        return debug_state(sacdebug)
+    return replay
+
+
+def startup(module):
+    """Returns a function importing a module afresh against a reset fake gdb, as GDB does at startup"""
+    def load():
+        fakegdb.install()
+        fakegdb.reset()
+        sys.modules.pop(module, None)
+        importlib.import_module(module)
+    return load
+
+
+def stop_script(calls, func, variables):
+    """Generates calls of a single function, each stopping on entry and return"""
+    script = list()
+    for i in range(calls):
+        script += [("call", func, variables), ("ret",)]
+    return script
+
+
+def recursion_script(depth, functions):
+    """Generates a chain of depth nested calls through distinct functions and their returns"""
+    return [("call", func, ("SACl_x",)) for func in functions[:depth]] + [("ret",)] * depth
+
+
+def self_recursion_script(depth, func):
+    """Generates depth nested calls of a single function from one call site"""
+    return [("call", "SACf__MAIN__main", (), {"pc": 0x100})] + \
+        [("call", func, ("SACl_x",), {"pc": 0x200})] * depth + [("ret",)] * (depth + 1)
+
+
+def watch_script(calls, func, variables):
+    """Generates calls of a function writing every SSA version of its locals"""
+    script = list()
+    for i in range(calls):
+        script.append(("call", func, variables))
+        script += [("assign", name, i) for name in variables]
+        script.append(("ret",))
+    return script
+
+
+def gdb_benchmarks(sizes):
+    """Yields (name, size, function, items) for the scripted sacdebug sessions"""
+    func = "SACf__MAIN__foo__i"
+    locals_text, bases = generate_locals(8)
+    variables = saclib.sac_vars(locals_text)
+    # What every GDB session pays, sacload alone until a SaC binary is loaded
+    yield "startup.sacload", 1, startup("sacload"), 1
+    yield "startup.sacdebug", 1, startup("sacdebug"), 1
+    for size in sizes:
+        functions = ["SACf__MAIN__f%d__i" % i for i in range(size)]
+        yield "gdb.stop_handler", size, session(stop_script(size, func, variables), [func]), 2 * size
+        yield "gdb.push_pop", size, session(recursion_script(size, functions), functions), 2 * size
+        yield "gdb.sactrace", size, session(self_recursion_script(size, func), [func], trace=True), 2 * size
+        yield "gdb.conditional_break", size, \
+            session(stop_script(size, "SACf__MAIN__bar__i", {"SACl_x": 1}), [],
+                    commands=["sac break bar(int) if x > 100 && x % 7 == 0"]), size
+        commands = ["print *sac(%s)" % bases[i % len(bases)] for i in range(size)]
+        yield "gdb.dashboard", size, dashboard(func, variables, commands, False), size
+        yield "gdb.dashboard_batch", size, dashboard(func, variables, commands, True), size
+        watch_calls = max(1, size // len(variables))
+        yield "gdb.watch_ssa", size, session(watch_script(watch_calls, func, variables), [func], True), \
+            watch_calls * (len(variables) + 2)
+
+
+def clear_caches():
+    for cached in (saclib.sacvar_parse, saclib.cvar_to_sac, saclib.sactype_to_c, saclib.ctype_to_sac,
+                   saclib.sacfunc_to_c_cached, saclib.cfunc_to_sac, saclib.compile_command):
+        cached.cache_clear()
+
+
+def percentile(sorted_samples, fraction):
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def measure(function, items, min_time=0.2, max_runs=1000):
+    """Runs a benchmark repeatedly and returns its latency, throughput and peak memory"""
+    clear_caches()
+
+    # Peak memory is taken from a separate traced run as tracing slows everything down
+    tracemalloc.start()
+    state = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    samples = list()
+    deadline = time.perf_counter() + min_time
+    while len(samples) < 3 or (time.perf_counter() < deadline and len(samples) < max_runs):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+
+    samples.sort()
+    result = {"runs": len(samples), "p50": percentile(samples, 0.5), "p90": percentile(samples, 0.9),
+              "p99": percentile(samples, 0.99), "throughput": items / percentile(samples, 0.5),
+              "peak_bytes": peak}
+    # Sessions report what they leave behind, e.g. breakpoint map sizes
+    if isinstance(state, dict):
+        result["state"] = state
+    return result
+
+
+def benchmarks(sizes, gdb_max_size=GDB_MAX_SIZE):
+    """Yields (name, size, function, items) for every benchmark case"""
+    for size in sizes:
+        locals_text, bases = generate_locals(size)
+        names = saclib.sac_vars(locals_text)
+        lookups = bases[:100]
+        functions_text = generate_functions(size)
+        signatures = generate_signatures(min(size, 10000))
+        c_names = [saclib.sacfunc_to_c(name, args) for name, args in signatures]
+        command = generate_command(min(size // 10, 1000) or 1, bases)
+        blocks = saclib.extract_sacblocks(command)
+        vector = array.array("d", [float(i % 97) for i in range(size)])
+        vectors = {"a": ((size,), "d", vector), "b": ((size,), "d", vector)}
+        function_search = sacsearch.FunctionSearch(sacindex.SacSymbolIndex(
+            saclib.sacfunc_to_c(name, args) for name, args in generate_signatures(size)))
+
+        yield "sac_vars", size, lambda: saclib.sac_vars(locals_text), size
+        # sacvar_to_c indexes the whole list on every call, keep the number of calls down
+        yield "sacvar_to_c", size, lambda: [saclib.sacvar_to_c(b, names) for b in lookups[:10]], len(lookups[:10])
+        yield "SacVariableFrame.lookup", size, \
+            lambda: [frame.lookup(b) for frame in [saclib.SacVariableFrame(names)] for b in lookups], len(lookups)
+        yield "sacfunc_to_c", size, lambda: [saclib.sacfunc_to_c(n, a) for n, a in signatures], len(signatures)
+        yield "cfunc_to_sac", size, lambda: [saclib.cfunc_to_sac(c) for c in c_names], len(c_names)
+        yield "info_functions_scan", size, \
+            lambda: [l for l in functions_text.split("\n") if "SACf__" in l], size
+        yield "FunctionSearch.search", size, \
+            lambda: [function_search.search_uncached(q) for q in SEARCH_QUERIES], len(SEARCH_QUERIES)
+        yield "saceval.%s" % saceval.default_backend().name, size, \
+            lambda: saceval.evaluate("sum(a * b)", vectors.__getitem__), size
+        yield "extract_sacblocks", size, lambda: saclib.extract_sacblocks(command), len(blocks)
+        yield "replace_sacblocks", size, lambda: saclib.replace_sacblocks(command, blocks, names), len(blocks)
+        yield "compile_command.bind", size, lambda: saclib.compile_command(command).bind(names), len(blocks)
+
+    for benchmark in gdb_benchmarks([size for size in sizes if size <= gdb_max_size]):
+        yield benchmark
+
+
+def run(sizes, only=None, gdb_max_size=GDB_MAX_SIZE, out=sys.stdout):
+    results = dict()
+    for name, size, function, items in benchmarks(sizes, gdb_max_size):
+        if only and name not in only:
+            continue
+        result = measure(function, items)
+        results["%s/%d" % (name, size)] = result
+        out.write("%-26s %8d  p50 %10.3f ms  p99 %10.3f ms  %12.0f items/s  peak %8.1f KiB\n" % (
+            name, size, result["p50"] * 1e3, result["p99"] * 1e3, result["throughput"], result["peak_bytes"] / 1024.0))
+        if "state" in result:
+            out.write("%-26s %8s  %s\n" % ("", "", "  ".join("%s %d" % item for item in sorted(result["state"].items()))))
+        out.flush()
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION_RATIO, out=sys.stdout):
+    """Writes a comparison report against a baseline, returns the number of regressions"""
+    regressions = 0
+    out.write("\n%-36s %12s %12s %8s\n" % ("benchmark", "baseline", "current", "ratio"))
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        ratio = results[key]["p50"] / baseline[key]["p50"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        out.write("%-36s %9.3f ms %9.3f ms %7.2fx%s\n" % (
+            key, baseline[key]["p50"] * 1e3, results[key]["p50"] * 1e3, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the saclib hot paths")
+    parser.add_argument("--quick", action="store_true", help="use small corpora only")
+    parser.add_argument("--sizes", type=int, nargs="+", help="corpus sizes to run")
+    parser.add_argument("--only", nargs="+", help="benchmarks to run")
+    parser.add_argument("--gdb-max", type=int, default=GDB_MAX_SIZE, metavar="SIZE",
+                        help="largest size of the scripted gdb sessions (default %(default)s)")
+    parser.add_argument("--save", metavar="FILE", help="store the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results against a baseline")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_RATIO,
+                        help="slowdown ratio reported as a regression (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    results = run(sizes, args.only, args.gdb_max)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(), "results": results}, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        return 1 if compare(results, baseline, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
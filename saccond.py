@@ -0,0 +1,198 @@
+import functools
+import re
+
+import saceval
+import saclib
+
+# A number, a name or an operator of a condition
+CONDITION_TOKEN = re.compile(r"\s*(?:(\d+\.\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?|\d+(?:[eE][-+]?\d+)?)"
+                             r"|([A-Za-z_]\w*)|(&&|\|\||==|!=|<=|>=|[-+*/%<>!()\[\],]))")
+# Token kinds, the groups of CONDITION_TOKEN
+NUMBER = 1
+NAME = 2
+OPERATOR = 3
+# SaC operators that are spelt differently in Python
+OPERATORS = {"&&": "and", "||": "or"}
+# Operators that divide like C, emitted as calls of saceval's functions
+C_OPERATORS = {"/": "c_div", "%": "c_mod"}
+LITERALS = {"true": "True", "false": "False"}
+# Functions on arrays, name -> argument of the predicate
+CONDITION_FUNCTIONS = {"shape": "shape", "dim": "dim"}
+
+
+class SacCondition(object):
+    """A breakpoint condition on SaC variables compiled into a Python predicate
+
+    The predicate is called with functions reading a variable's value, an
+    element of an array variable and an array's shape and rank:
+
+        predicate(value, element, shape, dim)
+
+    They take SaC variable names, the caller maps them to C variables.
+    Division and remainder follow C, integers truncate towards zero.
+    """
+
+    def __init__(self, text, source, names):
+        self.text = text
+        self.source = source
+        # SaC variables the condition reads
+        self.names = names
+        self.predicate = eval("lambda value, element, shape, dim: " + source,
+                              {"__builtins__": {}, "c_div": saceval.c_div, "c_mod": saceval.c_mod})
+
+    def __call__(self, value, element, shape, dim):
+        return bool(self.predicate(value, element, shape, dim))
+
+
+def tokenize_condition(text):
+    """Splits a condition into (kind, token) pairs, kind being NUMBER, NAME or OPERATOR"""
+    tokens = list()
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = CONDITION_TOKEN.match(text, position)
+        if match is None:
+            raise ValueError("Invalid condition at: %s" % text[position:].strip())
+        tokens.append((match.lastindex, match.group(match.lastindex)))
+        position = match.end()
+    return tokens
+
+
+class ConditionParser(object):
+    """Parses a condition with C's precedence into the source of a Python expression
+
+    Every operator is bracketed, so Python's chained comparisons and its
+    loosely binding not never apply, e.g. !x == 1 -> ((not value("x")) == 1).
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize_condition(text)
+        self.position = 0
+        # SaC variables the condition reads
+        self.names = set()
+
+    def peek(self):
+        return self.tokens[self.position][1] if self.position < len(self.tokens) else None
+
+    def peek_operator(self):
+        return self.peek() if self.position < len(self.tokens) and self.tokens[self.position][0] == OPERATOR else None
+
+    def next(self):
+        if self.position >= len(self.tokens):
+            raise ValueError("Unexpected end of condition: %s" % self.text.strip())
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def expect(self, token):
+        kind, found = self.next()
+        if found != token or kind != OPERATOR:
+            raise ValueError("Expected %s but found %s" % (token, found))
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty condition")
+        source = self.binary(0)
+        if self.position < len(self.tokens):
+            raise ValueError("Unexpected %s in condition" % self.peek())
+        return source
+
+    def binary(self, level):
+        if level == len(saceval.PRECEDENCE):
+            return self.unary()
+        left = self.binary(level + 1)
+        while self.peek_operator() in saceval.PRECEDENCE[level]:
+            op = self.next()[1]
+            right = self.binary(level + 1)
+            if op in C_OPERATORS:
+                left = "%s(%s, %s)" % (C_OPERATORS[op], left, right)
+            else:
+                left = "(%s %s %s)" % (left, OPERATORS.get(op, op), right)
+        return left
+
+    def unary(self):
+        op = self.peek_operator()
+        if op in ("-", "+", "!"):
+            self.next()
+            return "(not %s)" % self.unary() if op == "!" else "(%s%s)" % (op, self.unary())
+        return self.postfix()
+
+    def postfix(self):
+        source = self.primary()
+        while self.peek_operator() == "[":
+            self.next()
+            source = "%s[%s]" % (source, self.binary(0))
+            self.expect("]")
+        return source
+
+    def primary(self):
+        kind, token = self.next()
+        if kind == NUMBER:
+            return token
+        if kind == NAME and token in CONDITION_FUNCTIONS:
+            if self.peek_operator() != "(":
+                raise ValueError("%s() takes a SaC variable" % token)
+            self.next()
+            kind, name = self.next()
+            if kind != NAME or self.peek_operator() != ")":
+                raise ValueError("%s() takes a SaC variable" % token)
+            self.next()
+            self.names.add(name)
+            return '%s("%s")' % (CONDITION_FUNCTIONS[token], name)
+        if kind == NAME and token in LITERALS:
+            return LITERALS[token]
+        if kind == NAME and self.peek_operator() == "[":
+            # Elements are read with their indices as a tuple, a[i, j] -> element("a", (i, j,))
+            self.next()
+            indices = [self.binary(0)]
+            while self.peek_operator() == ",":
+                self.next()
+                indices.append(self.binary(0))
+            self.expect("]")
+            self.names.add(token)
+            return 'element("%s", (%s,))' % (token, ", ".join(indices))
+        if kind == NAME:
+            self.names.add(token)
+            return 'value("%s")' % token
+        if token == "(":
+            source = self.binary(0)
+            self.expect(")")
+            return source
+        raise ValueError("Unexpected %s in condition" % token)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_condition(text):
+    """Compiles a condition written with SaC variable names, e.g. x > 100 && shape(a)[0] == 512"""
+    parser = ConditionParser(text)
+    source = parser.parse()
+    return SacCondition(text.strip(), source, frozenset(parser.names))
+
+
+def parse_break_args(text):
+    """Splits the argument of sac break into the function, its argument types or None, and the condition"""
+    text = text.strip()
+
+    # The signature runs to the end of its argument list, or to the first space without one
+    open_index = text.find("(")
+    space_index = text.find(" ")
+    if open_index != -1 and (space_index == -1 or open_index < space_index):
+        signature_end = text.find(")", open_index) + 1
+        if not signature_end:
+            raise ValueError("Unclosed argument list: %s" % text)
+    else:
+        signature_end = len(text) if space_index == -1 else space_index
+
+    condition = None
+    rest = text[signature_end:].strip()
+    if rest:
+        if rest[:2] != "if" or rest[2:3] not in (" ", "("):
+            raise ValueError("Expected 'if' after the function: %s" % rest)
+        condition = rest[2:].strip()
+        if not condition:
+            raise ValueError("Missing condition after 'if'")
+
+    parsed = saclib.parse_sacblock(text[:signature_end])
+    if parsed is None:
+        raise ValueError("Invalid function: %s" % text[:signature_end])
+    return parsed[0], parsed[1], condition
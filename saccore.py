@@ -0,0 +1,78 @@
+import bisect
+import mmap
+import re
+
+import sacindex
+
+# ELF constants used when reading core files
+ET_CORE = 4
+PT_LOAD = 1
+
+# Where GDB's info target names the core file, e.g. Local core dump file:\n\t`/tmp/core', file type elf64-x86-64.
+CORE_TARGET = re.compile(r"core dump file:\s*[`'\"]([^`'\"]+)[`'\"]")
+
+
+class CoreMemory(object):
+    """Inferior memory read straight out of a read only mapping of a core file
+
+    Only the pages a read touches are paged in, so a core can be far larger
+    than memory. Addresses the core has no contents for, such as the
+    read only segments of the executable it leaves out or the part of a
+    segment past its file size, raise ValueError.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            elf = sacindex.ElfFile(self.data)
+            if elf.type != ET_CORE:
+                raise ValueError("%s is not a core file" % path)
+        except (ValueError, IndexError) as e:
+            self.data.close()
+            raise ValueError(str(e) if "core file" in str(e) else "%s is not a core file" % path)
+
+        # Loaded segments the core holds contents for by address, each (address, file size, offset)
+        segments = sorted((s[2], s[3], s[1]) for s in elf.segments if s[0] == PT_LOAD and s[3])
+        self.addresses = [segment[0] for segment in segments]
+        self.segments = segments
+
+    def __len__(self):
+        return len(self.segments)
+
+    def read(self, address, length):
+        """Returns length bytes of memory at address, all of which the core must hold"""
+        pieces = list()
+        while length > 0:
+            i = bisect.bisect_right(self.addresses, address) - 1
+            if i < 0 or address >= self.addresses[i] + self.segments[i][1]:
+                raise ValueError("Cannot access memory at address 0x%x in the core" % address)
+            start, size, offset = self.segments[i]
+            count = min(length, start + size - address)
+            position = offset + address - start
+            pieces.append(self.data[position:position + count])
+            address += count
+            length -= count
+        return pieces[0] if len(pieces) == 1 else b"".join(pieces)
+
+    def close(self):
+        self.data.close()
+
+
+def core_target_path(info_target):
+    """Returns the core file named by the output of GDB's info target, None without one"""
+    match = CORE_TARGET.search(info_target)
+    return match.group(1) if match else None
+
+
+def parse_core_args(argv):
+    """Parses the options of saccore into a dict"""
+    options = {"command": argv[0] if argv else "open", "file": None}
+    if options["command"] not in ("open", "frames", "close"):
+        raise ValueError("Usage: saccore open [CORE] | frames | close")
+    if options["command"] == "open" and len(argv) == 2:
+        options["file"] = argv[1]
+    elif len(argv) > 1:
+        raise ValueError("Unknown argument: %s" % argv[-1])
+    return options
@@ -0,0 +1,14 @@
+# GDB auto-load script for SaC programs, symlinked as <program>-gdb.py next to a
+# program or under GDB's auto-load directory. GDB only runs it for the program
+# it is named after, so the sacdebug commands are registered straight away.
+# The link is resolved to find the other modules, which a copy would lose.
+import os
+import sys
+
+sacdebug_directory = os.path.dirname(os.path.realpath(__file__))
+if sacdebug_directory not in sys.path:
+    sys.path.insert(0, sacdebug_directory)
+
+import sacload
+
+sacload.activate()
@@ -1,46 +1,643 @@
+import json
+import os
+import signal
+import threading
+import time
+
 import gdb
+from gdb.FrameDecorator import FrameDecorator
+import gdb.printing
+import globals
+import sacarray
+import saccond
+import saccore
+import saceval
+import sachistory
+import sacindex
 import saclib
+import sacprof
+import sacsearch
+import sacsnap
+import sacstats
+import sactrace
+import sacwatch
 
-# A list of lists that represents the local variables of
-# the current executed functions
-variable_stack = list()
+# Debugging state of each inferior thread, thread ptid -> SacThreadState
+thread_states = dict()
 # Breakpoint maps of BP Number -> Function/Variable name
 sac_func_bps = dict()  # SACf__ function breakpoints
 sac_return_bps = dict()  # SACf__ return breakpoints
 sac_var_bps = dict()  # SaC variable watchpoints
 
+# Cached frame variables, (thread, frame level, PC, live) -> SacVariableFrame
+frame_var_cache = dict()
+
+# Index of the SaC functions in the program, built by sacinit
+symbol_index = sacindex.SacSymbolIndex()
+# Search over symbol_index for sacinfo functions, built on first use
+function_search = None
+# Objfile filename -> its SacSymbolIndex, for the objfiles merged into symbol_index
+indexed_objfiles = dict()
+# sac break patterns that functions loaded later are matched against, (pattern, condition, C names placed)
+sac_pending_breaks = list()
+# Functions that currently have an entry breakpoint
+sac_armed_funcs = set()
+# Patterns given to sacinit --only and --exclude
+sac_scope_only = list()
+sac_scope_exclude = list()
+# Track SSA writes with watchpoints (sacinit --watch-ssa)
+sac_watch_ssa = False
+
+# Hardware watchpoint budget shared by the SaC variable watches
+watch_scheduler = sacwatch.WatchScheduler()
+# Watch key -> watch expression / current GDB watchpoint
+# Keys are (thread ptid, frame depth, variable) or ("user", expression)
+sac_watch_specs = dict()
+sac_watch_bps = dict()
+sac_watch_keys = dict()  # Watchpoint number -> watch key
+
+# Call tracer of sactrace, created by sactrace start
+call_tracer = None
+# Persistent sactrace breakpoints, BP number -> entry BP / return address -> return BP
+sac_trace_bps = dict()
+sac_trace_return_bps = dict()
+# Return addresses seen on entry that don't have a breakpoint yet
+sac_trace_pending = set()
+
+# Stack samples collected by sacprof
+profile_trie = sacprof.StackTrie()
+
 # Execution state tracking is required because I couldn't find a method
-# of determining it programatically
+# of determining it programatically. It is shared by every thread, as in
+# all-stop mode sac step and sac continue resume them all
 # 0 = Stopped
 # 1 = Stepping
 # 2 = Running
 old_execution_state = 0
 execution_state = 0
 
+# Counters and timings of sacdebug's own work, reported by sacinfo stats
+stats = sacstats.Stats()
+# Memory of the core file being debugged post-mortem, and the SaC variables of
+# the frames of every thread in it, (thread key, frame level) -> (function, SacVariableFrame)
+core_memory = None
+core_frames = dict()
+# Array snapshots taken with sac snapshot, name -> ArraySnapshot
+array_snapshots = dict()
+# Stops are only handled once there are sacdebug breakpoints, other sessions don't pay for it
+stop_handler_connected = False
+# Value history of the SSA writes seen, recorded while history_recording is set
+value_history = None
+history_recording = False
+
+
+
+class SacThreadState(object):
+    """SaC debugging state of one inferior thread"""
+
+    def __init__(self):
+        # A list of SacVariableFrames that represents the local variables of
+        # the functions the thread is executing
+        self.variable_stack = list()
+        # Functions with a frame on the variable stack, recursive calls aren't tracked
+        self.active_funcs = set()
+
+
+def thread_key(thread=None):
+    """ Returns the key of a thread, by default the selected one, in the per thread state"""
+    if thread is None:
+        thread = gdb.selected_thread()
+    return thread.ptid if thread is not None else None
+
+
+def thread_state(key=None):
+    """ Returns the state of a thread, by default the selected one"""
+    if key is None:
+        key = thread_key()
+    state = thread_states.get(key)
+    if state is None:
+        state = SacThreadState()
+        thread_states[key] = state
+    return state
+
+
+def event_thread_key(event):
+    """ Returns the key of the thread that stopped, only non-stop mode names it in the event"""
+    return thread_key(getattr(event, "inferior_thread", None))
+
+
+def debug(level, message, *args):
+    """ Writes a debug message if set sac-verbose is at least level
+
+    The arguments are built before the call, callers check sac_verbose first when that is costly.
+    """
+    if sac_verbose.value >= level:
+        gdb.write(message % args + "\n")
+
 
-def local_vars():
-    """ Wrapper around the GDB info locals command"""
+def forget_threads(event):
+    """ Drops the state of every thread once the inferior exits"""
+    thread_states.clear()
+
+
+def frame_level(frame):
+    """ Returns the level of a frame, 0 being the innermost"""
+    if hasattr(frame, "level"):
+        return frame.level()
+    level = 0
+    frame = frame.newer()
+    while frame is not None:
+        level += 1
+        frame = frame.newer()
+    return level
+
+
+def local_vars(frame=None, live=True):
+    """ Returns the SaC variables of a frame, by default the selected one, as a SacVariableFrame
+
+    Symbols are read from the frame's blocks without formatting any values
+    and cached until the inferior resumes or its memory changes.
+    """
+    if frame is None:
+        frame = gdb.selected_frame()
+
+    key = (thread_key(), frame_level(frame), frame.pc(), live)
+    frame_vars = frame_var_cache.get(key)
+    if frame_vars is None:
+        start = stats.clock()
+        frame_vars = saclib.SacVariableFrame(scope_vars(frame, live))
+        frame_var_cache[key] = frame_vars
+        stats.observe("local_vars", stats.clock() - start)
+    return frame_vars
+
+
+def invalidate_local_vars(event):
+    """ Drops the cached frame variables once they may be stale"""
+    frame_var_cache.clear()
+
+
+def scope_vars(frame, live=True):
+    """ Returns the SaC variables in scope at the PC of a frame, by default only the live ones"""
     try:
-        return_text = gdb.execute("info locals", False, True)
-        return return_text
+        block = frame.block()
+    except RuntimeError:
+        return list()
+
+    seen = set()
+    names = list()
+
+    # Walk outwards through the lexical blocks up to the function body,
+    # inner declarations shadow outer ones
+    while block is not None:
+        for symbol in block:
+            if not (symbol.is_variable or symbol.is_argument) or symbol.name in seen:
+                continue
+            seen.add(symbol.name)
+
+            if not saclib.is_sac_var(symbol.name):
+                continue
+            if live:
+                # Outside its location list ranges a variable is optimized out
+                try:
+                    if symbol.value(frame).is_optimized_out:
+                        continue
+                except gdb.error:
+                    continue
+            names.append(symbol.name)
+
+        if block.function is not None:
+            break
+        block = block.superblock
+
+    return names
+
+
+def resolve_var(name, frame=None):
+    """ Returns the C variable of a SaC variable in a frame, C names are passed through"""
+    c_name = local_vars(frame).lookup(name)
+    return c_name if c_name is not None else name
+
+
+def resolve_version(name, frame=None):
+    """ Returns the C variable of a SaC variable in a frame, x@N naming SSA version N and x@-1 the newest"""
+    if "@" not in name:
+        return resolve_var(name, frame)
+    base = name.split("@", 1)[0].strip()
+    rows = [row for row in sacsearch.search_variables(local_vars(frame), name) if row[0] == base]
+    if not rows:
+        raise ValueError("No SSA version %s" % name.strip())
+    return rows[0][2]
+
+
+def array_shape(c_name, frame):
+    """ Reads the shape of a SaC array from its shape variables or its descriptor"""
+    try:
+        dim = int(frame.read_var(c_name + "__dim"))
+        return tuple(int(frame.read_var("%s__shp%d" % (c_name, i))) for i in range(dim))
+    except ValueError:
+        pass
+
+    try:
+        desc = int(frame.read_var(c_name + "__desc")) & ~globals.sac_desc_tag_mask
+    except ValueError:
+        raise gdb.GdbError("No shape information for %s" % c_name)
+
+    words = gdb.Value(desc).cast(gdb.lookup_type("long").pointer())
+    dim = int(words[globals.sac_desc_dim])
+    return tuple(int(words[globals.sac_desc_shape + i]) for i in range(dim))
+
+
+def python_value(value):
+    """ Converts a scalar gdb.Value to a Python number"""
+    code = value.type.strip_typedefs().code
+    if code == gdb.TYPE_CODE_FLT:
+        return float(value)
+    if code == gdb.TYPE_CODE_BOOL:
+        return bool(value)
+    return int(value)
+
+
+def condition_readers(frame, c_names):
+    """ Returns the value, element, shape and dim functions a SacCondition reads a frame with"""
+    def value(name):
+        return python_value(frame.read_var(c_names[name]))
+
+    def shape(name):
+        return array_shape(c_names[name], frame)
+
+    def dim(name):
+        return len(shape(name))
+
+    def element(name, index):
+        array_extents = shape(name)
+        if len(index) != len(array_extents):
+            raise IndexError("%d indices for an array of rank %d" % (len(index), len(array_extents)))
+        offset = 0
+        for i, extent, stride in zip(index, array_extents, sacarray.strides(array_extents)):
+            if not 0 <= i < extent:
+                raise IndexError("Index %d is out of bounds for an axis of %d" % (i, extent))
+            offset += i * stride
+        return python_value(frame.read_var(c_names[name])[offset])
+
+    return value, element, shape, dim
+
+
+def element_format(element_type):
+    """ Returns the memoryview format to read elements of a GDB type in bulk"""
+    element_type = element_type.strip_typedefs()
+    if element_type.code == gdb.TYPE_CODE_FLT:
+        kind = "float"
+    elif element_type.code == gdb.TYPE_CODE_BOOL:
+        kind = "bool"
+    elif element_type.code in (gdb.TYPE_CODE_INT, gdb.TYPE_CODE_CHAR):
+        kind = "int"
+    else:
+        return None
+
+    if hasattr(element_type, "is_signed"):
+        signed = element_type.is_signed
+    else:
+        signed = not str(element_type).startswith("unsigned")
+    return sacarray.element_format(kind, element_type.sizeof, signed)
+
+
+def sac_array(c_name, frame=None):
+    """ Returns the shape of the SaC array held in a C variable and a ChunkedBuffer over its data"""
+    if frame is None:
+        frame = gdb.selected_frame()
+
+    try:
+        value = frame.read_var(c_name)
+    except ValueError:
+        raise gdb.GdbError("No variable named %s" % c_name)
+
+    value_type = value.type.strip_typedefs()
+    if value_type.code == gdb.TYPE_CODE_PTR:
+        shape = array_shape(c_name, frame)
+        element_type = value_type.target()
+        address = int(value)
+    elif value.address is not None:
+        shape = ()
+        element_type = value_type
+        address = int(value.address)
+    else:
+        raise gdb.GdbError("%s is not in memory" % c_name)
+
+    fmt = element_format(element_type)
+    if fmt is None:
+        raise gdb.GdbError("Unsupported element type %s" % element_type)
+
+    count = 1
+    for extent in shape:
+        count *= extent
+
+    return shape, sacarray.ChunkedBuffer(lambda offset, size: read_memory(address + offset, size), count, fmt)
+
+
+def read_memory(address, length):
+    """ Reads inferior memory, from the mapped core file when debugging one post-mortem"""
+    if core_memory is not None:
+        try:
+            return core_memory.read(address, length)
+        except ValueError:
+            pass
+    return gdb.selected_inferior().read_memory(address, length)
+
+
+def rebuild_core_frames():
+    """ Rebuilds the SaC frames and variables of every thread from the stack alone, as nothing was watched
+
+    Returns the number of threads and of SaC frames found.
+    """
+    core_frames.clear()
+    thread_states.clear()
+    selected_thread = gdb.selected_thread()
+    try:
+        selected_frame = gdb.selected_frame()
     except gdb.error:
-        return ""
+        selected_frame = None
+
+    threads = frames = 0
+    try:
+        for thread in gdb.selected_inferior().threads():
+            thread.switch()
+            key = thread_key(thread)
+            state = thread_state(key)
+            try:
+                frame = gdb.newest_frame()
+            except gdb.error:
+                continue
+            threads += 1
+            level = 0
+            while frame is not None:
+                func_name = frame.name()
+                if func_name and saclib.cfunc_to_sac(func_name):
+                    # Nothing was executed, so every variable in scope counts if none are known to be live
+                    frame_vars = saclib.SacVariableFrame(scope_vars(frame) or scope_vars(frame, live=False))
+                    core_frames[(key, level)] = (func_name, frame_vars)
+                    state.variable_stack.insert(0, frame_vars)
+                    state.active_funcs.add(func_name)
+                    frames += 1
+                frame = frame.older()
+                level += 1
+    finally:
+        if selected_thread is not None:
+            selected_thread.switch()
+        if selected_frame is not None and selected_frame.is_valid():
+            selected_frame.select()
+    return threads, frames
+
+
+def sac_symbol_index():
+    """ Builds an index of the SaC functions in every loaded objfile, reusing those already indexed"""
+    index = sacindex.SacSymbolIndex()
+    unreadable = False
+
+    for objfile in gdb.objfiles():
+        if not on_disk(objfile):
+            continue
+        objfile_index = indexed_objfiles.get(objfile.filename)
+        if objfile_index is None:
+            try:
+                objfile_index = sacindex.load_index(objfile.filename, getattr(objfile, "build_id", None))
+            except (IOError, OSError, ValueError):
+                unreadable = True
+                continue
+            indexed_objfiles[objfile.filename] = objfile_index
+        index.update(objfile_index)
+
+    # A file that can't be read as ELF might still hold SaC functions, let GDB find the symbols instead
+    if unreadable:
+        index.update(info_functions_index())
+
+    return index
+
+
+def info_functions_index():
+    """ Builds an index of the SaC functions GDB knows about from info functions"""
+    index = sacindex.SacSymbolIndex()
+    functions_text = gdb.execute("info functions ^SACf__", False, True)
+    for line in functions_text.split("\n"):
+        if "SACf__" in line and "(" in line:
+            index.add(line[line.index("SACf__"):line.index("(")])
+    return index
+
+
+def objfile_loaded(event):
+    """ Queues a newly loaded objfile, such as a SaC module library, for indexing in the background"""
+    index_objfile(event.new_objfile)
+
+
+def on_disk(objfile):
+    """ Tells if an objfile was loaded from a file, the vDSO and other objfiles read from memory weren't"""
+    return objfile.is_valid() and bool(objfile.filename) and os.path.isfile(objfile.filename)
+
+
+def index_objfile(objfile):
+    """ Queues an objfile for indexing unless it has been indexed already"""
+    if not on_disk(objfile) or objfile.filename in indexed_objfiles:
+        return
+    stats.count("objfiles_queued")
+    indexer.submit(objfile.filename, getattr(objfile, "build_id", None))
+
+
+def objfile_indexed(path, index):
+    """ Merges the index of an objfile once the indexer is done with it, called on GDB's thread"""
+    if path in indexed_objfiles:
+        return
+    start = stats.clock()
+    if index is None:
+        index = info_functions_index()
+    indexed_objfiles[path] = index
+    merge_symbols(index)
+    stats.observe("merge_index", stats.clock() - start)
+
+
+def objfiles_cleared(event):
+    """ Forgets every indexed function once GDB unloads the objfiles, pending results included"""
+    global symbol_index
+    global function_search
+    indexer.clear()
+    indexed_objfiles.clear()
+    symbol_index = sacindex.SacSymbolIndex()
+    function_search = None
+
+
+def merge_symbols(index):
+    """ Adds functions to the symbol index, arming those in the sacinit scope or waited for by sac break"""
+    global function_search
+    new_symbols = [symbol for symbol in index if symbol.c_name not in symbol_index]
+    if not new_symbols:
+        return
+    symbol_index.update(index)
+    function_search = None
+    saclib.register_user_types(arg for symbol in new_symbols for arg in symbol.args)
+    symbols_added(new_symbols)
+
+
+def symbols_added(symbols):
+    """ Arms the new functions in the sacinit scope and places the pending sac breaks they match
+
+    Whichever indexes a library first, the background indexer or sac_functions, calls this for its functions.
+    """
+    for symbol in symbols:
+        if sac_scope_only and saclib.sacfunc_in_scope(symbol.namespace, symbol.name, sac_scope_only,
+                                                      sac_scope_exclude):
+            arm_function(symbol.c_name)
+        for pattern, condition, placed in sac_pending_breaks:
+            if symbol.c_name not in placed and saclib.sacfunc_match(symbol.namespace, symbol.name, [pattern]):
+                placed.add(symbol.c_name)
+                write_breakpoint(SacBreakpoint(symbol.c_name, condition))
 
 
 def sac_functions():
-    """ Returns a list of user defined and overloaded SaC functions"""
-    functions_text = gdb.execute("info functions", False, True)
+    """ Returns a list of user defined and overloaded SaC functions, indexing every loaded objfile now"""
+    global symbol_index
+    global function_search
+    previous_index = symbol_index
+    symbol_index = sac_symbol_index()
+    function_search = None
+    saclib.register_user_types(arg for symbol in symbol_index for arg in symbol.args)
+    # Libraries indexed here before the indexer got to them are skipped once it does
+    symbols_added([symbol for symbol in symbol_index if symbol.c_name not in previous_index])
+    return [symbol.c_name for symbol in symbol_index]
+
+
+def arm_function(func):
+    """ Places an entry breakpoint on a SaC function unless it already has one"""
+    if func in sac_armed_funcs:
+        return False
+
+    symbol = symbol_index.lookup(func)
+    if symbol is not None and saclib.sacfunc_match(symbol.namespace, symbol.name, sac_scope_exclude):
+        return False
+
+    connect_stop_handler()
+    new_bp = SacFunctionBreakpoint(func)
+    sac_func_bps[new_bp.number] = func
+    sac_armed_funcs.add(func)
+    return True
+
+
+def connect_stop_handler():
+    """ Starts handling stops, once sacinit runs or sacdebug places breakpoints of its own"""
+    global stop_handler_connected
+
+    if not stop_handler_connected:
+        gdb.events.stop.connect(breakpoint_handle)
+        stop_handler_connected = True
+
+
+def arm_selected_function():
+    """ Arms the SaC function of the selected frame the first time it is inspected, when SSA writes are watched"""
+    if not sac_watch_ssa:
+        return
+    try:
+        func = gdb.selected_frame().name()
+    except gdb.error:
+        return
+    if func in symbol_index:
+        arm_function(func)
+
+
+def watch_spec(var):
+    """ Returns a frame independent watch expression for a variable and its size"""
+    address = gdb.parse_and_eval("&" + var)
+    return "*(%s) %d" % (address.type, int(address)), address.type.target().sizeof
+
+
+def create_watchpoint(key, hardware):
+    """ Places the watchpoint for a watch key, forcing GDB onto the software path if needed
+
+    The user's own can-use-hw-watchpoints setting is put back afterwards.
+    """
+    can_use_hw = gdb.parameter("can-use-hw-watchpoints")
+    if not hardware and can_use_hw:
+        gdb.execute("set can-use-hw-watchpoints 0")
+    try:
+        new_wp = SacVariableWatchpoint(sac_watch_specs[key], user=key[0] == "user")
+    finally:
+        if not hardware and can_use_hw:
+            gdb.execute("set can-use-hw-watchpoints %d" % can_use_hw)
+
+    sac_watch_bps[key] = new_wp
+    sac_watch_keys[new_wp.number] = key
+    stats.count("hw_watchpoints_created" if hardware else "sw_watchpoints_created")
+    if key[0] != "user":
+        sac_var_bps[new_wp.number] = key[2]
+
+
+def delete_watchpoint(key):
+    """ Removes the watchpoint of a watch key if it still exists"""
+    old_wp = sac_watch_bps.pop(key, None)
+    if old_wp is None:
+        return
+    sac_watch_keys.pop(old_wp.number, None)
+    sac_var_bps.pop(old_wp.number, None)
+    stats.count("watchpoints_deleted")
+    if old_wp.is_valid():
+        old_wp.delete()
+
+
+def rebalance_watches():
+    """ Moves watches between hardware and software as the scheduler decides"""
+    for key, hardware in watch_scheduler.rebalance():
+        delete_watchpoint(key)
+        create_watchpoint(key, hardware)
+
+
+def add_watch(key, spec, size, depth=0, owner=None):
+    """ Registers a watch with the scheduler, user watches are never rotated out"""
+    sac_watch_specs[key] = spec
+    watch_scheduler.add(key, depth, key[0] == "user", sacwatch.hw_slots(size), owner)
+
+
+def forget_watch(key):
+    """ Drops a watch from the scheduler and deletes its watchpoint"""
+    watch_scheduler.remove(key)
+    sac_watch_specs.pop(key, None)
+    delete_watchpoint(key)
 
-    func_list = [f for f in functions_text.split("\n") if "SACf__" in f]
-    func_sigs = [f[f.index(" "):f.index("(")] for f in func_list]
-    return func_sigs
+
+def record_write(watch_key, c_name):
+    """ Appends the value a watched variable has just been written to the value history
+
+    Arrays are recorded as a hash of their contents, anything unreadable as a hash of how GDB prints it.
+    """
+    start = stats.clock()
+    frame = gdb.selected_frame()
+    try:
+        value = frame.read_var(c_name)
+    except ValueError:
+        return
+    try:
+        if value.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
+            shape, buffer = sac_array(c_name, frame)
+            value = buffer.read(0, len(buffer) * buffer.itemsize)
+        else:
+            value = python_value(value)
+    except (gdb.error, gdb.GdbError, TypeError, ValueError):
+        value = str(value)
+    value_history.append(watch_key[0], frame.name() or "??", c_name, watch_key[1], frame.pc(), value)
+    stats.count("history_records")
+    stats.observe("history_record", stats.clock() - start)
+
+
+def watch_deleted(bp):
+    """ Keeps the scheduler in step when the user deletes a watchpoint"""
+    key = sac_watch_keys.get(bp.number)
+    if key is not None and sac_watch_bps.get(key) is bp:
+        sac_watch_bps.pop(key)
+        forget_watch(key)
+        rebalance_watches()
 
 
 class SacVariableWatchpoint(gdb.Breakpoint):
-    def __init__(self, spec):
-        super(SacVariableWatchpoint, self).__init__(spec, gdb.BP_WATCHPOINT, wp_class=gdb.WP_WRITE, internal=True,
-                                                    temporary=True)
-        self.silent = True
+    def __init__(self, spec, user=False):
+        # Internal watchpoints record a single SSA write, user ones behave like GDB's watch
+        super(SacVariableWatchpoint, self).__init__(spec, gdb.BP_WATCHPOINT, wp_class=gdb.WP_WRITE,
+                                                    internal=not user, temporary=not user)
+        self.silent = not user
 
     @staticmethod
     def stop():
@@ -50,17 +647,55 @@ class SacVariableWatchpoint(gdb.Breakpoint):
 class SacFunctionBreakpoint(gdb.Breakpoint):
     def __init__(self, spec):
         self.func_name = spec
-        super(SacFunctionBreakpoint, self).__init__(spec, gdb.BP_BREAKPOINT, internal=True, temporary=True)
+        super(SacFunctionBreakpoint, self).__init__(spec, gdb.BP_BREAKPOINT, internal=True)
         self.silent = True
 
-    @staticmethod
-    def stop():
-        return True
+    def stop(self):
+        # Every thread stops on its outermost call of the function only
+        return self.func_name not in thread_state().active_funcs
+
+
+class SacBreakpoint(gdb.Breakpoint):
+    """User breakpoint on a SaC function, stopping only when its SaC condition holds"""
+
+    def __init__(self, spec, condition=None):
+        self.func_name = spec
+        self.sac_condition = condition
+        # PC -> SaC variable -> C variable, for the variables the condition reads
+        self.c_names = dict()
+        super(SacBreakpoint, self).__init__(spec, gdb.BP_BREAKPOINT)
+
+    def stop(self):
+        if self.sac_condition is None:
+            return True
+
+        frame = gdb.newest_frame()
+        c_names = self.c_names.get(frame.pc())
+        if c_names is None:
+            c_names = dict((name, resolve_var(name, frame)) for name in self.sac_condition.names)
+            self.c_names[frame.pc()] = c_names
+
+        try:
+            return self.sac_condition(*condition_readers(frame, c_names))
+        except (gdb.error, ValueError, ArithmeticError, IndexError, TypeError) as e:
+            # Stop so the broken condition gets noticed
+            gdb.write("Error in condition of breakpoint %d: %s\n" % (self.number, e))
+            return True
+
+
+def write_breakpoint(bp):
+    """ Announces a SaC breakpoint the way GDB announces its own"""
+    condition = bp.sac_condition
+    gdb.write("Breakpoint %d at %s%s\n" % (bp.number, saclib.cfunc_to_sac(bp.func_name) or bp.func_name,
+                                          " if " + condition.text if condition else ""))
 
 
 class SacFunctionReturnBreakpoint(gdb.FinishBreakpoint):
-    def __init__(self, spec):
+    def __init__(self, spec, thread, depth):
         self.func_name = spec
+        # Thread and variable stack depth of the frame being finished
+        self.thread_key = thread
+        self.depth = depth
         super(SacFunctionReturnBreakpoint, self).__init__(internal=True)
         self.silent = True
 
@@ -68,6 +703,223 @@ class SacFunctionReturnBreakpoint(gdb.FinishBreakpoint):
     def stop():
         return True
 
+    def out_of_scope(self):
+        # The frame was unwound without returning (longjmp)
+        if sac_return_bps.pop(self.number, None) is not None:
+            stats.count("finish_breakpoints_out_of_scope")
+            stats.count("finish_breakpoints_deleted")
+            leave_function(self.thread_key, self.func_name, self.depth)
+
+
+class SacTraceEntryBreakpoint(gdb.Breakpoint):
+    """Persistent entry breakpoint recording calls without stopping"""
+
+    def __init__(self, spec):
+        self.func_name = spec
+        super(SacTraceEntryBreakpoint, self).__init__(spec, gdb.BP_BREAKPOINT, internal=True)
+        self.silent = True
+
+    def stop(self):
+        caller = gdb.newest_frame().older()
+        if caller is None:
+            return False
+        return_address = caller.pc()
+        call_tracer.enter(thread_key(), self.func_name, return_address)
+
+        # Breakpoints can't be placed from stop, only stop for return addresses
+        # that haven't been seen before
+        if return_address in sac_trace_return_bps:
+            return False
+        sac_trace_pending.add(return_address)
+        return True
+
+
+class SacTraceReturnBreakpoint(gdb.Breakpoint):
+    """Persistent breakpoint on a return address recording the returns to it"""
+
+    def __init__(self, address):
+        self.return_address = address
+        super(SacTraceReturnBreakpoint, self).__init__("*0x%x" % address, gdb.BP_BREAKPOINT, internal=True)
+        self.silent = True
+
+    def stop(self):
+        call_tracer.leave(thread_key(), self.return_address)
+        return False
+
+
+def enter_function(key, func_name):
+    """ Pushes a variable frame for a SaC function entered by a thread and watches its SSA writes"""
+    state = thread_state(key)
+    var_names = local_vars(live=False)
+    state.active_funcs.add(func_name)
+
+    # Push a new variable frame onto the thread's stack as it's entered a new function
+    state.variable_stack.append(saclib.SacVariableFrame())
+    depth = len(state.variable_stack)
+    # Place watchpoints on all local variables if SSA writes are tracked,
+    # the new frame's variables take the hardware watchpoints
+    if sac_watch_ssa:
+        for var in var_names:
+            spec, size = watch_spec(var)
+            add_watch((key, depth, var), spec, size, depth, key)
+        rebalance_watches()
+
+    # Place a breakpoint on the func return statement
+    new_finish_bp = SacFunctionReturnBreakpoint(func_name, key, depth)
+    sac_return_bps[new_finish_bp.number] = func_name
+    stats.count("finish_breakpoints_created")
+
+
+def leave_function(key, func_name, depth):
+    """ Pops the variable frame at depth of a thread and hands its watches to the frames below"""
+    state = thread_state(key)
+    state.active_funcs.discard(func_name)
+    for watch_key in watch_scheduler.pop_depth(depth, key):
+        sac_watch_specs.pop(watch_key, None)
+        delete_watchpoint(watch_key)
+    rebalance_watches()
+    del state.variable_stack[depth - 1:]
+
+
+def place_trace_returns():
+    """ Places the return address breakpoints requested by sactrace entry breakpoints"""
+    for address in sac_trace_pending:
+        if address not in sac_trace_return_bps:
+            sac_trace_return_bps[address] = SacTraceReturnBreakpoint(address)
+    sac_trace_pending.clear()
+
+
+def stop_trace():
+    """ Deletes every sactrace breakpoint, the recorded events are kept"""
+    for bp in list(sac_trace_bps.values()) + list(sac_trace_return_bps.values()):
+        if bp.is_valid():
+            bp.delete()
+    sac_trace_bps.clear()
+    sac_trace_return_bps.clear()
+    sac_trace_pending.clear()
+
+
+def interrupt_inferior(pid):
+    """ Stops the inferior the same way Ctrl-C does"""
+    os.kill(pid, signal.SIGINT)
+
+
+def is_interrupt(events):
+    """ Returns True if the inferior stopped for the SIGINT of interrupt_inferior"""
+    return any(isinstance(event, gdb.SignalEvent) and event.stop_signal == "SIGINT" for event in events)
+
+
+def sample_stacks(sac_only=False):
+    """ Adds the stack of every thread of the inferior to the profile"""
+    selected = gdb.selected_thread()
+    for thread in gdb.selected_inferior().threads():
+        thread.switch()
+        names = list()
+        try:
+            frame = gdb.newest_frame()
+            while frame is not None:
+                names.append(frame.name() or "0x%x" % frame.pc())
+                frame = frame.older()
+        except gdb.error:
+            # Keep what could be unwound of a corrupt stack
+            pass
+        profile_trie.add(sacprof.stack_labels(names, sac_only))
+    if selected is not None:
+        selected.switch()
+
+
+class SacSymValueWrapper(object):
+    """Shows a SaC variable under its SaC name in frame filter output"""
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+
+    def symbol(self):
+        symbol = self.wrapped.symbol()
+        name = symbol if isinstance(symbol, str) else symbol.print_name
+        return saclib.cvar_to_sac(name) or symbol
+
+    def value(self):
+        return self.wrapped.value()
+
+
+class SacFrameDecorator(FrameDecorator):
+    """Frame decorator that demangles SaC function and variable names"""
+
+    def function(self):
+        name = super(SacFrameDecorator, self).function()
+        if isinstance(name, str):
+            return saclib.cfunc_to_sac(name) or name
+        return name
+
+    def frame_args(self):
+        args = super(SacFrameDecorator, self).frame_args()
+        return None if args is None else [SacSymValueWrapper(arg) for arg in args]
+
+    def frame_locals(self):
+        local_symbols = super(SacFrameDecorator, self).frame_locals()
+        return None if local_symbols is None else [SacSymValueWrapper(local) for local in local_symbols]
+
+
+class SacFrameFilter(object):
+    """Frame filter that shows SaC names in backtraces"""
+
+    def __init__(self):
+        self.name = "sac"
+        self.priority = 100
+        self.enabled = True
+        gdb.frame_filters[self.name] = self
+
+    def filter(self, frame_iter):
+        return map(SacFrameDecorator, frame_iter)
+
+
+class SacArrayPrinter(object):
+    """Prints the elements of a SaC array instead of the address of its data"""
+
+    def __init__(self, c_name, frame, value):
+        self.c_name = c_name
+        self.frame = frame
+        self.value = value
+
+    def to_string(self):
+        try:
+            shape, buffer = sac_array(self.c_name, self.frame)
+        except gdb.GdbError:
+            # Without a shape only the pointer can be shown
+            return "0x%x" % int(self.value)
+        return sacarray.format_array(lambda i: buffer[i], shape)
+
+
+class SacArrayPrettyPrinter(gdb.printing.PrettyPrinter):
+    """Pretty-printer for the data pointers of the SaC arrays in the selected frame
+
+    The data pointer of an array has a plain C pointer type, so it is
+    recognised by being the storage of a SaC variable of the frame.
+    """
+
+    def __init__(self):
+        super(SacArrayPrettyPrinter, self).__init__("sac")
+        gdb.printing.register_pretty_printer(None, self)
+
+    def __call__(self, value):
+        if value.address is None or value.type.strip_typedefs().code != gdb.TYPE_CODE_PTR:
+            return None
+        try:
+            frame = gdb.selected_frame()
+        except gdb.error:
+            return None
+
+        address = int(value.address)
+        for c_name in local_vars(frame, live=False):
+            try:
+                var = frame.read_var(c_name)
+            except ValueError:
+                continue
+            if var.address is not None and int(var.address) == address:
+                return SacArrayPrinter(c_name, frame, value)
+        return None
+
 
 class SacInitCommand(gdb.Command):
     """Initialisation command for SaC debugging facilities"""
@@ -77,17 +929,57 @@ class SacInitCommand(gdb.Command):
         super(SacInitCommand, self).__init__("sacinit", gdb.COMMAND_SUPPORT)
 
     def invoke(self, arg, from_tty):
-        global sac_func_bps
-        # Turn off hardware watchpoints because we use way too many
-        gdb.execute("set can-use-hw-watchpoints 0")
+        global sac_scope_only
+        global sac_scope_exclude
+        global sac_watch_ssa
 
+        try:
+            options = saclib.parse_init_args(gdb.string_to_argv(arg))
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+        sac_scope_only = options["only"]
+        sac_scope_exclude = options["exclude"]
+        sac_watch_ssa = options["watch_ssa"]
+        connect_stop_handler()
+
+        # Hardware watchpoints are handed out by the scheduler, anything over budget goes to software
+        if options["hw_watchpoints"] is not None:
+            watch_scheduler.budget = options["hw_watchpoints"]
+            rebalance_watches()
+
+        armed_before = len(sac_armed_funcs)
         func_list = sac_functions()
 
-        print(func_list)
-        for func in func_list:
-            new_bp = SacFunctionBreakpoint(func)
-            sac_func_bps[new_bp.number] = func
-            new_bp.silent = True
+        # Without --only nothing is armed up front, functions are armed when first inspected
+        if sac_scope_only:
+            for symbol in symbol_index:
+                if saclib.sacfunc_in_scope(symbol.namespace, symbol.name, sac_scope_only, sac_scope_exclude):
+                    arm_function(symbol.c_name)
+        armed = len(sac_armed_funcs) - armed_before
+
+        gdb.write("Indexed %d SaC functions, armed %d breakpoints\n" % (len(func_list), armed))
+
+
+def current_sac_variables(state):
+    """ Returns the SaC variables *sac() blocks of the selected frame resolve against
+
+    These are the variables live at the PC, falling back to the watchpoint
+    history or a core's rebuilt frames when there is no scope information.
+    """
+    try:
+        current_variables = local_vars()
+    except gdb.error:
+        current_variables = saclib.SacVariableFrame()
+    variable_stack = state.variable_stack
+    if not current_variables and core_frames:
+        core_frame = core_frames.get((thread_key(), frame_level(gdb.selected_frame())))
+        if core_frame is not None:
+            current_variables = core_frame[1]
+    elif sac_watch_ssa and variable_stack and variable_stack[-1]:
+        current_variables = variable_stack[-1]
+    elif not current_variables and variable_stack:
+        current_variables = variable_stack[-1]
+    return current_variables
 
 
 class SacCommand(gdb.Command):
@@ -100,18 +992,30 @@ class SacCommand(gdb.Command):
         global execution_state
         global old_execution_state
 
-        if "*sac(" in arg:
-            blocks = saclib.extract_sacblocks(arg)
+        state = thread_state()
 
-            if not variable_stack:
-                current_variables = list()
-            else:
-                current_variables = variable_stack
+        if arg.split(None, 1)[:1] in (["batch"], ["source"]):
+            self.batch(*arg.split(None, 1))
+        elif "*sac(" in arg:
+            arm_selected_function()
+            start = stats.clock()
+            template = saclib.compile_command(arg)
+            translate_time = stats.clock() - start
+            current_variables = current_sac_variables(state)
 
-            gdb_string = saclib.replace_sacblocks(arg, blocks, current_variables)
+            start = stats.clock()
+            gdb_string = template.bind(current_variables)
+            stats.observe("translate", translate_time + stats.clock() - start)
 
             if gdb_string:
-                gdb.execute(gdb_string)
+                if watch_scheduler:
+                    self.touch_watches(template, current_variables, state)
+
+                command = gdb_string.split(None, 1)
+                if command[0] == "watch" and len(command) == 2 and not command[1].startswith("-"):
+                    self.watch(command[1])
+                else:
+                    gdb.execute(gdb_string)
             else:
                 gdb.write("Error with contents of a *sac() block\n")
         else:
@@ -131,22 +1035,541 @@ class SacCommand(gdb.Command):
                 old_execution_state = execution_state
                 execution_state = 1
                 gdb.execute("step", False)
+            elif arg.split(None, 1)[:1] in (["print"], ["summary"]) and len(arg.split(None, 1)) == 2:
+                self.print_array(*arg.split(None, 1))
+            elif arg.split(None, 1)[:1] == ["snapshot"]:
+                self.snapshot(gdb.string_to_argv(arg)[1:])
+            elif arg.split(None, 1)[:1] == ["diff"]:
+                self.diff(gdb.string_to_argv(arg)[1:])
+            elif arg.split(None, 1)[:1] == ["eval"] and len(arg.split(None, 1)) == 2:
+                self.eval_expression(arg.split(None, 1)[1])
+            elif arg.split(None, 1)[:1] == ["break"]:
+                self.break_function(arg.split(None, 1)[1] if len(arg.split(None, 1)) == 2 else "")
+
+    @staticmethod
+    def break_function(text):
+        """Places breakpoints on a SaC function, or every overload of it, with an optional condition"""
+        try:
+            func_name, args, condition_text = saccond.parse_break_args(text)
+            condition = saccond.compile_condition(condition_text) if condition_text else None
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+
+        if args is not None:
+            c_name = saclib.sacfunc_to_c(func_name, args)
+            if c_name is None:
+                raise gdb.GdbError("Unknown argument type in %s" % text.strip())
+            c_names = [c_name]
+        else:
+            if not len(symbol_index):
+                sac_functions()
+            c_names = [symbol.c_name for symbol in symbol_index
+                       if saclib.sacfunc_match(symbol.namespace, symbol.name, [func_name])]
+            # Like GDB's pending breakpoints, modules loaded later may define more overloads
+            sac_pending_breaks.append((func_name, condition, set(c_names)))
+            if not c_names:
+                gdb.write("No SaC function matches %s yet, the breakpoint is pending on future loads\n"
+                          % func_name)
+
+        for c_name in c_names:
+            write_breakpoint(SacBreakpoint(c_name, condition))
+
+    @staticmethod
+    def print_array(command, expression):
+        """Prints a selection of a SaC array, or a summary of it, from bulk reads of its data"""
+        try:
+            name, selection_text = sacarray.parse_array_expression(expression)
+            shape, buffer = sac_array(resolve_var(name))
+            selection = sacarray.parse_selection(selection_text, shape)
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+
+        if command == "summary":
+            summary = sacarray.summarize(sacarray.selected_chunks(buffer, shape, selection), buffer.format)
+            gdb.write("count = %(count)s, min = %(min)s, max = %(max)s, mean = %(mean)s, nan = %(nan)s\n" % summary)
+        else:
+            source_index = sacarray.selection_mapper(shape, selection)
+            text = sacarray.format_array(lambda i: buffer[source_index(i)], sacarray.selected_shape(selection))
+            gdb.write("%s = %s\n" % (expression.strip(), text))
+
+    @staticmethod
+    def eval_expression(expression):
+        """Evaluates a SaC expression over whole arrays, each read from the inferior in a single go"""
+        frame = gdb.selected_frame()
+        backend = saceval.default_backend()
+
+        def read(name):
+            shape, buffer = sac_array(resolve_var(name, frame), frame)
+            return shape, buffer.format, buffer.read(0, len(buffer) * buffer.itemsize)
+
+        start = stats.clock()
+        try:
+            value = saceval.evaluate(expression, read, backend)
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+        stats.observe("eval", stats.clock() - start)
+        gdb.write("%s = %s\n" % (expression.strip(), saceval.format_result(value, backend)))
+
+    @staticmethod
+    def batch(command, text=""):
+        """Runs a batch of commands, or those of a file, against one view of the frame and writes their output at once
+
+        Plain prints are evaluated directly, each distinct expression once
+        until a command other than a print runs, as it may change the
+        frame or the values. A failing command is reported and the batch
+        carries on.
+        """
+        if command == "source":
+            try:
+                with open(text.strip()) as script:
+                    text = script.read()
+            except (IOError, OSError) as e:
+                raise gdb.GdbError("Can't read %s: %s" % (text.strip(), e))
+
+        start = stats.clock()
+        state = thread_state()
+        current_variables = None
+        # Expression -> its value, dashboards print the same expressions many times
+        values = dict()
+        output = list()
+        commands = saclib.split_batch(text)
+        for command in commands:
+            try:
+                gdb_string = command
+                if "*sac(" in command:
+                    if current_variables is None:
+                        arm_selected_function()
+                        current_variables = current_sac_variables(state)
+                    gdb_string = saclib.compile_command(command).bind(current_variables)
+                    if not gdb_string:
+                        output.append("Error with contents of a *sac() block: %s\n" % command)
+                        continue
+
+                expression = saclib.print_expression(gdb_string)
+                if expression is None:
+                    values.clear()
+                    current_variables = None
+                    output.append(gdb.execute(gdb_string, False, True) or "")
+                    continue
+                value = values.get(expression)
+                if value is None:
+                    value = str(gdb.parse_and_eval(expression))
+                    values[expression] = value
+                output.append("%s = %s\n" % (saclib.print_expression(command), value))
+            except (gdb.error, gdb.GdbError) as e:
+                output.append("%s: %s\n" % (command, e))
+
+        stats.count("batch_commands", len(commands))
+        stats.observe("batch", stats.clock() - start)
+        gdb.write("".join(output))
+
+    @staticmethod
+    def live_array(name):
+        """Returns a SaC variable, or a version of one such as x@3, as a sacsnap.LiveArray"""
+        try:
+            c_name = resolve_version(name)
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+        return sacsnap.LiveArray(*sac_array(c_name))
+
+    @staticmethod
+    def snapshot(argv):
+        """Snapshots an array as chunk hashes, and its contents with --keep"""
+        try:
+            options = sacsnap.parse_snapshot_args(argv)
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+        live = SacCommand.live_array(options["variable"])
+
+        start = stats.clock()
+        snapshot = sacsnap.ArraySnapshot.take(live.shape, live.buffer, options["keep"], options["variable"])
+        stats.observe("snapshot", stats.clock() - start)
+        array_snapshots[options["name"]] = snapshot
+        gdb.write("Snapshot %s of %s %s, %d chunks in %d bytes\n" % (
+            options["name"], options["variable"], sacsnap.format_shape(snapshot.shape), snapshot.chunk_count(),
+            snapshot.nbytes()))
+
+    @staticmethod
+    def diff(argv):
+        """Reports the elements that differ between a snapshot and its variable now, or any two of either"""
+        try:
+            options = sacsnap.parse_diff_args(argv)
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+
+        operands = options["operands"]
+        if len(operands) == 1:
+            if operands[0] not in array_snapshots:
+                raise gdb.GdbError("No snapshot named %s, take one with sac snapshot" % operands[0])
+            old = array_snapshots[operands[0]]
+            new = SacCommand.live_array(old.variable)
+        else:
+            old, new = [array_snapshots[name] if name in array_snapshots else SacCommand.live_array(name)
+                        for name in operands]
+
+        start = stats.clock()
+        try:
+            diff = sacsnap.diff_arrays(old, new)
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+        stats.observe("diff", stats.clock() - start)
+        gdb.write("\n".join(sacsnap.format_diff(diff, options["limit"])) + "\n")
+
+    @staticmethod
+    def watch(expression):
+        """Places a user watch through the hardware watchpoint scheduler"""
+        value = gdb.parse_and_eval(expression)
+        key = ("user", expression)
+        if key not in watch_scheduler:
+            add_watch(key, expression, value.type.sizeof)
+        rebalance_watches()
+        new_wp = sac_watch_bps[key]
+        kind = "Hardware watchpoint" if watch_scheduler.is_hardware(key) else "Watchpoint"
+        gdb.write("%s %d: %s\n" % (kind, new_wp.number, expression))
+
+    @staticmethod
+    def touch_watches(template, current_variables, state):
+        """Gives the variables referenced by *sac() blocks priority for hardware watchpoints"""
+        key = thread_key()
+        depth = len(state.variable_stack)
+        for var_name in template.variables:
+            c_name = current_variables.lookup(var_name)
+            if c_name:
+                watch_scheduler.touch((key, depth, c_name))
+                watch_scheduler.touch(("user", c_name))
+
+
+class SacTraceCommand(gdb.Command):
+    """Command for tracing SaC calls into a ring buffer and reporting on them"""
+
+    def __init__(self):
+        super(SacTraceCommand, self).__init__("sactrace", gdb.COMMAND_SUPPORT)
+
+    def invoke(self, arg, from_tty):
+        global call_tracer
+
+        try:
+            options = sactrace.parse_trace_args(gdb.string_to_argv(arg))
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+
+        if options["command"] == "start":
+            if call_tracer is None or call_tracer.buffer.size != options["size"]:
+                call_tracer = sactrace.CallTracer(options["size"])
+            if not len(symbol_index):
+                sac_functions()
+
+            # One persistent breakpoint per function, whatever the depth of recursion
+            connect_stop_handler()
+            traced = set(bp.func_name for bp in sac_trace_bps.values())
+            patterns = options["patterns"] or sac_scope_only
+            for symbol in symbol_index:
+                if symbol.c_name not in traced and \
+                        saclib.sacfunc_in_scope(symbol.namespace, symbol.name, patterns, sac_scope_exclude):
+                    new_bp = SacTraceEntryBreakpoint(symbol.c_name)
+                    sac_trace_bps[new_bp.number] = new_bp
+            gdb.write("Tracing %d SaC functions\n" % len(sac_trace_bps))
+        elif call_tracer is None:
+            raise gdb.GdbError("No trace, use sactrace start")
+        elif options["command"] == "stop":
+            stop_trace()
+            gdb.write("Tracing stopped, %d events recorded\n" % call_tracer.buffer.total)
+        elif options["command"] == "clear":
+            call_tracer.clear()
+        else:
+            self.report(options)
+
+    @staticmethod
+    def report(options):
+        """Writes the call counts and inclusive times, or the call tree, of the recorded events"""
+        counts, inclusive, root = sactrace.profile(call_tracer.buffer)
+        if options["tree"]:
+            lines = sactrace.format_tree(root, options["depth"], options["limit"])
+        else:
+            lines = sactrace.format_profile(counts, inclusive, options["limit"])
+        if call_tracer.buffer.dropped():
+            lines.append("(%d older events overwritten)" % call_tracer.buffer.dropped())
+        gdb.write("\n".join(lines) + "\n")
+
+
+class SacProfCommand(gdb.Command):
+    """Command for profiling a SaC program by sampling the stacks of its threads"""
+
+    def __init__(self):
+        super(SacProfCommand, self).__init__("sacprof", gdb.COMMAND_SUPPORT)
+
+    def invoke(self, arg, from_tty):
+        try:
+            options = sacprof.parse_prof_args(gdb.string_to_argv(arg))
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+
+        if options["command"] == "start":
+            self.sample(options)
+        elif options["command"] == "clear":
+            profile_trie.clear()
+        elif options["command"] == "collapsed":
+            lines = list(profile_trie.collapsed())
+            if options["file"] is None:
+                gdb.write("".join(line + "\n" for line in lines))
+            else:
+                with open(options["file"], "w") as f:
+                    f.write("".join(line + "\n" for line in lines))
+                gdb.write("Wrote %d stacks to %s\n" % (len(lines), options["file"]))
+        else:
+            gdb.write("\n".join(sacprof.format_profile(profile_trie, options["limit"])) + "\n")
+            gdb.write("%d samples\n" % profile_trie.samples)
+
+    @staticmethod
+    def sample(options):
+        """Lets the inferior run, interrupting it at the sampling rate to unwind every thread"""
+        inferior = gdb.selected_inferior()
+        if not inferior.pid:
+            raise gdb.GdbError("The program is not being run.")
+
+        stop_events = list()
+        record_stop = stop_events.append
+        gdb.events.stop.connect(record_stop)
+        interval = 1.0 / options["rate"]
+        deadline = time.time() + options["duration"]
+        samples = 0
+        try:
+            while time.time() < deadline and (options["samples"] is None or samples < options["samples"]):
+                del stop_events[:]
+                timer = threading.Timer(interval, interrupt_inferior, (inferior.pid,))
+                timer.start()
+                try:
+                    gdb.execute("continue", False, True)
+                finally:
+                    timer.cancel()
+
+                # A breakpoint, a signal of the program's own or its exit ends the profile
+                if not is_interrupt(stop_events):
+                    break
+                sample_stacks(options["sac_only"])
+                samples += 1
+        finally:
+            gdb.events.stop.disconnect(record_stop)
+
+        gdb.write("Collected %d samples, %d in total\n" % (samples, profile_trie.samples))
+
+
+class SacVerboseParameter(gdb.Parameter):
+    """Verbosity of sacdebug's debug output
+
+    0 writes nothing, 1 the breakpoints of every stop and 2 also the
+    breakpoint maps and variable stacks, which is slow with large maps.
+    """
+    set_doc = "Set the verbosity of sacdebug's debug output."
+    show_doc = "Show the verbosity of sacdebug's debug output."
+
+    def __init__(self):
+        super(SacVerboseParameter, self).__init__("sac-verbose", gdb.COMMAND_SUPPORT, gdb.PARAM_ZUINTEGER)
+        self.value = 0
+
+    def get_set_string(self):
+        return ""
+
+    def get_show_string(self, svalue):
+        return "SaC debug output verbosity is %s." % svalue
 
 
 class SacInfoCommand(gdb.Command):
-    """Command for retrieving information about sac functions or variables"""
+    """Command for retrieving information about sac functions or variables, or sacdebug's own statistics"""
 
     def __init__(self):
         super(SacInfoCommand, self).__init__("sacinfo", gdb.COMMAND_SUPPORT)
 
     def invoke(self, arg, from_tty):
-        args = arg.strip().split(" ")
-        if args[0] == "functions":
-            pass
-        elif args[0] == "variables":
-            pass
+        global function_search
+
+        try:
+            options = sacsearch.parse_info_args(gdb.string_to_argv(arg))
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+
+        if options["command"] == "stats":
+            self.show_stats(options)
+            return
+
+        if options["command"] == "functions":
+            if not len(symbol_index):
+                sac_functions()
+            if function_search is None:
+                function_search = sacsearch.FunctionSearch(symbol_index)
+            try:
+                total, functions = function_search.search(options["query"], options["limit"])
+            except ValueError as e:
+                raise gdb.GdbError(str(e))
+            rows = [(saclib.cfunc_to_sac(symbol.c_name) or symbol.c_name, symbol.c_name) for symbol in functions]
         else:
-            pass
+            try:
+                matches = sacsearch.search_variables(local_vars(), options["query"])
+            except ValueError as e:
+                raise gdb.GdbError(str(e))
+            total = len(matches)
+            rows = [("%s@%d" % (base, version), c_name) for base, version, c_name in matches[:options["limit"]]]
+
+        width = max([len(row[0]) for row in rows] + [0])
+        for sac_name, c_name in rows:
+            gdb.write("%-*s  %s\n" % (width, sac_name, c_name))
+        if total is None:
+            gdb.write("Showing the best %d matches, --limit N shows more\n" % len(rows))
+        else:
+            gdb.write("Showing %d of %d matches\n" % (len(rows), total))
+
+    @staticmethod
+    def show_stats(options):
+        """Prints or exports the counters and timings with the current size of the breakpoint maps"""
+        sizes = {"sac_func_bps": len(sac_func_bps), "sac_return_bps": len(sac_return_bps),
+                 "sac_var_bps": len(sac_var_bps), "sac_watch_bps": len(sac_watch_bps),
+                 "sac_trace_bps": len(sac_trace_bps) + len(sac_trace_return_bps),
+                 "frame_var_cache": len(frame_var_cache), "thread_states": len(thread_states),
+                 "variable_stack": sum(len(state.variable_stack) for state in thread_states.values()),
+                 "symbol_index": len(symbol_index), "array_snapshots": len(array_snapshots),
+                 "value_history": len(value_history) if value_history is not None else 0}
+        data = stats.as_dict(sizes)
+
+        if not options["json"]:
+            gdb.write("\n".join(sacstats.format_stats(data)) + "\n")
+        elif options["file"] is None:
+            gdb.write(json.dumps(data, indent=2, sort_keys=True) + "\n")
+        else:
+            try:
+                with open(options["file"], "w") as stats_file:
+                    json.dump(data, stats_file, indent=2, sort_keys=True)
+            except (IOError, OSError) as e:
+                raise gdb.GdbError("Can't write %s: %s" % (options["file"], e))
+            gdb.write("Statistics written to %s\n" % options["file"])
+
+        if options["clear"]:
+            stats.clear()
+
+
+class SacCoreCommand(gdb.Command):
+    """Command for debugging SaC programs post-mortem from a core file"""
+
+    def __init__(self):
+        super(SacCoreCommand, self).__init__("saccore", gdb.COMMAND_SUPPORT)
+
+    def invoke(self, arg, from_tty):
+        global core_memory
+
+        try:
+            options = saccore.parse_core_args(gdb.string_to_argv(arg))
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+
+        if options["command"] == "close":
+            self.close()
+            return
+        if options["command"] == "open":
+            path = options["file"] or saccore.core_target_path(gdb.execute("info target", False, True))
+            if path is None:
+                raise gdb.GdbError("No core file, load one with core-file or name it")
+            self.close()
+            try:
+                core_memory = saccore.CoreMemory(path)
+            except (IOError, OSError, ValueError) as e:
+                raise gdb.GdbError(str(e))
+            gdb.write("Mapped %d segments of %s\n" % (len(core_memory), path))
+        elif core_memory is None:
+            raise gdb.GdbError("No core file open, open one with saccore open")
+
+        threads, frames = rebuild_core_frames()
+        gdb.write("Rebuilt %d SaC frames in %d threads\n" % (frames, threads))
+        if options["command"] == "frames":
+            self.write_frames()
+
+    @staticmethod
+    def write_frames():
+        """ Lists the SaC frames of every thread with the C variable of every SaC variable"""
+        for (key, level), (func_name, frame_vars) in sorted(core_frames.items(), key=lambda item: str(item[0])):
+            gdb.write("Thread %s #%d %s\n" % (key, level, saclib.cfunc_to_sac(func_name)))
+            for base, versions in sorted(frame_vars.versions.items()):
+                gdb.write("    %s = %s\n" % (base, versions[-1][1]))
+
+    @staticmethod
+    def close():
+        """ Unmaps the core file and drops the frames rebuilt from it"""
+        global core_memory
+
+        if core_memory is not None:
+            core_memory.close()
+            core_memory = None
+        core_frames.clear()
+
+
+class SacHistoryCommand(gdb.Command):
+    """Command for recording the values SSA variables are written and searching them
+
+    Writes are only seen while sacinit --watch-ssa watches them.
+    """
+
+    def __init__(self):
+        super(SacHistoryCommand, self).__init__("sachistory", gdb.COMMAND_SUPPORT)
+
+    def invoke(self, arg, from_tty):
+        global value_history
+        global history_recording
+
+        try:
+            options = sachistory.parse_history_args(gdb.string_to_argv(arg))
+        except ValueError as e:
+            raise gdb.GdbError(str(e))
+        command = options["command"]
+
+        if command == "start":
+            self.close()
+            try:
+                value_history = sachistory.ValueHistory(options["size"], options["file"])
+            except (IOError, OSError) as e:
+                raise gdb.GdbError("Can't write %s: %s" % (options["file"], e))
+            history_recording = True
+            gdb.write("Recording up to %d SSA writes%s\n" % (
+                options["size"], " to " + options["file"] if options["file"] else ""))
+            if not sac_watch_ssa:
+                gdb.write("SSA writes aren't watched, run sacinit --watch-ssa to record them\n")
+            return
+        if command == "load":
+            self.close()
+            try:
+                value_history = sachistory.ValueHistory.load(options["file"])
+            except (IOError, OSError, ValueError) as e:
+                raise gdb.GdbError(str(e))
+            gdb.write("Loaded %d SSA writes from %s\n" % (len(value_history), options["file"]))
+            return
+
+        if value_history is None:
+            raise gdb.GdbError("No value history, start one with sachistory start")
+        if command == "stop":
+            history_recording = False
+            value_history.flush()
+            gdb.write("Recorded %d SSA writes, %d of them overwritten\n" % (
+                value_history.total, value_history.dropped()))
+        elif command == "clear":
+            value_history.clear()
+        elif command == "show":
+            records = value_history.records(options["variable"])
+            gdb.write("\n".join(sachistory.format_records(records, options["limit"])) + "\n")
+        else:
+            try:
+                record = value_history.find(options["condition"], options["last"])
+            except ValueError as e:
+                raise gdb.GdbError(str(e))
+            if record is None:
+                gdb.write("No recorded write satisfies %s\n" % options["condition"].text)
+            else:
+                gdb.write("\n".join(sachistory.format_records([record])) + "\n")
+
+    @staticmethod
+    def close():
+        """ Stops recording and closes the file of the current history"""
+        global history_recording
+
+        history_recording = False
+        if value_history is not None:
+            value_history.close()
 
 
 def breakpoint_handle(event):
@@ -154,59 +1577,87 @@ def breakpoint_handle(event):
     global sac_func_bps
     global sac_return_bps
     global sac_var_bps
-    global execution_state
 
-    print(sac_return_bps)
+    start = stats.clock()
+    stats.count("stops")
+    debug(2, "Return breakpoints: %s", sac_return_bps)
 
     valid_points = 0
+    # Every thread has its own variable stack, stops are routed to the thread that stopped
+    key = event_thread_key(event)
+    state = thread_state(key)
 
     if type(event) is gdb.BreakpointEvent:
-        print(event.breakpoints)
+        if sac_verbose.value >= 1:
+            debug(1, "Breakpoints hit: %s", ", ".join(str(bp.number) for bp in event.breakpoints))
         # GDB chains BP stop events if they happen sequentially
         for i, bp in enumerate(event.breakpoints):
             # If the BP is one that has been set at the start of a SaC func
             if bp.number in sac_func_bps:
-                var_names = saclib.sac_vars()
-                func_name = sac_func_bps[bp.number]
-
-                # Push a new variable frame onto the stack as we've entered a new function
-                variable_stack.append(list())
-                # Place watchpoints on all local variables
-                for var in var_names:
-                    new_wp = SacVariableWatchpoint(var)
-                    sac_var_bps[new_wp.number] = var
-
-                # Place a breakpoint on the func return statement
-                new_finish_bp = SacFunctionReturnBreakpoint(func_name)
-                sac_return_bps[new_finish_bp.number] = func_name
+                enter_function(key, sac_func_bps[bp.number])
+                stats.count("function_entries")
                 valid_points += 1
             # If the BP is a watchpoint for variable writes
             elif bp.number in sac_var_bps:
-                # Push the variable name onto the top frame
-                variable_stack[len(variable_stack) - 1].append(sac_var_bps[bp.number])
-                print(variable_stack)
+                # Push the variable name onto the top frame of the thread owning the variable
+                watch_key = sac_watch_keys[bp.number]
+                variable_stack = thread_state(watch_key[0]).variable_stack
+                variable_stack[watch_key[1] - 1].append(sac_var_bps[bp.number])
+                if sac_verbose.value >= 2:
+                    debug(2, "Variable stack: %s", [list(frame) for frame in variable_stack])
+                stats.count("ssa_writes")
+                if history_recording:
+                    record_write(watch_key, sac_var_bps[bp.number])
                 valid_points += 1
-                bp.delete()
+                # The write has been seen, free the watch up for another variable
+                forget_watch(watch_key)
+                rebalance_watches()
             # Otherwise if the BP is a function return breakpoint
             elif bp.number in sac_return_bps:
-                # TODO: Place another breakpoint on the function entrance
-                # Pop the current variable frame
-                print("Finish breakpoint")
-                variable_stack.pop()
-                print(variable_stack)
+                leave_function(bp.thread_key, sac_return_bps.pop(bp.number), bp.depth)
+                if sac_verbose.value >= 2:
+                    debug(2, "Variable stack: %s",
+                          [list(frame) for frame in thread_state(bp.thread_key).variable_stack])
+                stats.count("finish_breakpoints_deleted")
+                valid_points += 1
+            # If the BP is a sactrace entry returning to an address without a breakpoint
+            elif bp.number in sac_trace_bps:
+                place_trace_returns()
                 valid_points += 1
 
-            # Skip over the amount of system defined BPs encountered
-            if valid_points == len(event.breakpoints):
-                if execution_state == 0:
-                    gdb.execute("continue " + str(valid_points - 1), False)
-                    gdb.execute("stop ", False)
-                elif execution_state == 1:
-                    gdb.execute("step " + str(valid_points - 1), False)
-                elif execution_state == 2:
-                    gdb.execute("continue " + str(valid_points - 1), False)
+    # Resuming runs the inferior to its next stop, it isn't counted as handling this one
+    stats.observe("breakpoint_handle", stats.clock() - start)
+
+    # Skip over the amount of system defined BPs encountered
+    if type(event) is gdb.BreakpointEvent and valid_points == len(event.breakpoints):
+        if execution_state == 0:
+            gdb.execute("continue " + str(valid_points - 1), False)
+            gdb.execute("stop ", False)
+        elif execution_state == 1:
+            gdb.execute("step " + str(valid_points - 1), False)
+        elif execution_state == 2:
+            gdb.execute("continue " + str(valid_points - 1), False)
 
 # Instantiate commands and setup stop event listener
 SacCommand()
 SacInitCommand()
-gdb.events.stop.connect(breakpoint_handle)
\ No newline at end of file
+SacTraceCommand()
+SacProfCommand()
+SacInfoCommand()
+SacCoreCommand()
+SacHistoryCommand()
+SacFrameFilter()
+SacArrayPrettyPrinter()
+sac_verbose = SacVerboseParameter()
+
+# Objfiles are indexed off GDB's thread as they are loaded, the results are merged back through post_event
+indexer = sacindex.BackgroundIndexer(objfile_indexed, gdb.post_event)
+for loaded_objfile in gdb.objfiles():
+    index_objfile(loaded_objfile)
+gdb.events.new_objfile.connect(objfile_loaded)
+gdb.events.clear_objfiles.connect(objfiles_cleared)
+gdb.events.exited.connect(forget_threads)
+gdb.events.breakpoint_deleted.connect(watch_deleted)
+gdb.events.cont.connect(invalidate_local_vars)
+gdb.events.memory_changed.connect(invalidate_local_vars)
+gdb.events.register_changed.connect(invalidate_local_vars)
\ No newline at end of file
@@ -0,0 +1,567 @@
+import array
+import functools
+import itertools
+import math
+import operator
+import re
+
+import sacarray
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# A number, a name or an operator of an expression
+EVAL_TOKEN = re.compile(r"\s*(?:(\d+\.\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?|\d+(?:[eE][-+]?\d+)?)"
+                        r"|([A-Za-z_]\w*)|(->|&&|\|\||==|!=|<=|>=|[-+*/%<>!()\[\],:{}|]))")
+# Token kinds, the groups of EVAL_TOKEN
+NUMBER = 1
+NAME = 2
+OPERATOR = 3
+
+# Binary operators from the loosest binding to the tightest
+PRECEDENCE = [("||",), ("&&",), ("==", "!=", "<", "<=", ">", ">="), ("+", "-"), ("*", "/", "%")]
+ARITHMETIC = frozenset(["+", "-", "*", "/", "%"])
+LITERALS = {"true": True, "false": False}
+# Functions reducing an array to a scalar
+REDUCTIONS = frozenset(["sum", "prod", "min", "max"])
+FUNCTIONS = REDUCTIONS | frozenset(["shape", "dim", "abs"])
+
+
+class SacArray(object):
+    """An array as a flat row major sequence of its elements and its shape, scalars have the shape ()"""
+    __slots__ = ("data", "shape")
+
+    def __init__(self, data, shape=()):
+        self.data = data
+        self.shape = tuple(shape)
+
+    @property
+    def size(self):
+        size = 1
+        for extent in self.shape:
+            size *= extent
+        return size
+
+
+def c_div(a, b):
+    """Divides like C, integers truncate towards zero and floats follow IEEE 754"""
+    if isinstance(a, float) or isinstance(b, float):
+        if b == 0:
+            return math.nan if a == 0 or a != a else math.copysign(math.inf, a) * math.copysign(1.0, b)
+        return a / b
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def c_mod(a, b):
+    """Takes the remainder like C, it has the sign of the dividend"""
+    if isinstance(a, float) or isinstance(b, float):
+        return math.fmod(a, b) if b != 0 else math.nan
+    return a - b * c_div(a, b)
+
+
+class ArrayBackend(object):
+    """Computes on array.array buffers and lists, element by element in C loops where it can"""
+    name = "array"
+
+    OPERATORS = {"+": operator.add, "-": operator.sub, "*": operator.mul, "/": c_div, "%": c_mod,
+                 "==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+                 ">": operator.gt, ">=": operator.ge,
+                 "&&": lambda a, b: bool(a) and bool(b), "||": lambda a, b: bool(a) or bool(b)}
+
+    @staticmethod
+    def load(fmt, data, shape):
+        view = memoryview(data).cast("B")
+        # array has no bool type code
+        if fmt == "?":
+            return SacArray(view.cast(fmt).tolist(), shape)
+        data = array.array(fmt)
+        data.frombytes(view)
+        return SacArray(data, shape)
+
+    @staticmethod
+    def constant(value, shape=()):
+        return SacArray([value], ()) if not shape else SacArray([value] * SacArray(None, shape).size, shape)
+
+    @staticmethod
+    def item(value, index):
+        return value.data[index]
+
+    def binary(self, op, x, y, shape):
+        function = self.OPERATORS[op]
+        x_data = x.data if x.shape else itertools.repeat(x.data[0])
+        y_data = y.data if y.shape else itertools.repeat(y.data[0])
+        try:
+            return SacArray(list(map(function, x_data, y_data)) if shape else [function(x.data[0], y.data[0])], shape)
+        except ZeroDivisionError:
+            raise ValueError("Division by zero")
+
+    @staticmethod
+    def unary(op, x):
+        function = {"-": operator.neg, "!": operator.not_, "abs": abs}[op]
+        return SacArray(list(map(function, x.data)), x.shape)
+
+    @staticmethod
+    def reduce(name, x):
+        if name == "sum":
+            return SacArray([sum(x.data)])
+        if name == "prod":
+            return SacArray([functools.reduce(operator.mul, x.data, 1)])
+        if not len(x.data):
+            raise ValueError("%s of an empty array" % name)
+        return SacArray([max(x.data) if name == "max" else min(x.data)])
+
+    @staticmethod
+    def select(x, selection):
+        source_index = sacarray.selection_mapper(x.shape, selection)
+        shape = sacarray.selected_shape(selection)
+        data = x.data
+        return SacArray([data[source_index(i)] for i in range(SacArray(None, shape).size)], shape)
+
+    @staticmethod
+    def gather(x, indexes, shape):
+        size = SacArray(None, shape).size
+        axes = [index.data if index.shape else itertools.repeat(index.data[0], size) for index in indexes]
+        axis_strides = sacarray.strides(x.shape)
+        offsets = list()
+        for position in zip(*axes):
+            offset = 0
+            for i, extent, stride in zip(position, x.shape, axis_strides):
+                if not 0 <= i < extent:
+                    raise ValueError("Index %d is out of bounds for an axis of %d" % (i, extent))
+                offset += i * stride
+            offsets.append(offset)
+        data = x.data
+        return SacArray([data[offset] for offset in offsets], shape)
+
+    @staticmethod
+    def index_array(shape, axis):
+        """Returns the index along an axis of every element of an array of a shape"""
+        stride = sacarray.strides(shape)[axis]
+        extent = shape[axis]
+        return SacArray([i // stride % extent for i in range(SacArray(None, shape).size)], shape)
+
+
+class NumpyBackend(object):
+    """Computes on NumPy arrays, a whole array at a time"""
+    name = "numpy"
+
+    def __init__(self):
+        self.operators = {"+": numpy.add, "-": numpy.subtract, "*": numpy.multiply, "/": self.divide,
+                          "%": self.remainder, "==": numpy.equal, "!=": numpy.not_equal, "<": numpy.less,
+                          "<=": numpy.less_equal, ">": numpy.greater, ">=": numpy.greater_equal,
+                          "&&": numpy.logical_and, "||": numpy.logical_or}
+
+    @staticmethod
+    def load(fmt, data, shape):
+        return SacArray(numpy.frombuffer(data, dtype=numpy.dtype(fmt)), shape)
+
+    @staticmethod
+    def constant(value, shape=()):
+        return SacArray(numpy.full(SacArray(None, shape).size, value), shape)
+
+    @staticmethod
+    def item(value, index):
+        return value.data[index].item()
+
+    @staticmethod
+    def is_integer(data):
+        return data.dtype.kind in "iub"
+
+    def divide(self, a, b):
+        if self.is_integer(a) and self.is_integer(b):
+            quotient = numpy.abs(a) // numpy.abs(b)
+            return numpy.where((a < 0) == (b < 0), quotient, -quotient)
+        return numpy.true_divide(a, b)
+
+    def remainder(self, a, b):
+        return numpy.fmod(a, b)
+
+    def binary(self, op, x, y, shape):
+        x_data, y_data = x.data, y.data
+        if op in ARITHMETIC:
+            # Booleans count as numbers
+            if x_data.dtype.kind == "b":
+                x_data = x_data.astype(numpy.int64)
+            if y_data.dtype.kind == "b":
+                y_data = y_data.astype(numpy.int64)
+        if op in ("/", "%") and self.is_integer(y_data) and not numpy.all(y_data):
+            raise ValueError("Division by zero")
+        # Floats divided by zero give infinities and NaNs like they do in C
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return SacArray(self.operators[op](x_data, y_data), shape)
+
+    @staticmethod
+    def unary(op, x):
+        function = {"-": numpy.negative, "!": numpy.logical_not, "abs": numpy.abs}[op]
+        return SacArray(function(x.data), x.shape)
+
+    @staticmethod
+    def reduce(name, x):
+        if name in ("min", "max") and not len(x.data):
+            raise ValueError("%s of an empty array" % name)
+        data = x.data.astype(numpy.int64) if x.data.dtype.kind == "b" else x.data
+        function = {"sum": numpy.sum, "prod": numpy.prod, "min": numpy.min, "max": numpy.max}[name]
+        return SacArray(numpy.asarray(function(data)).reshape(1))
+
+    @staticmethod
+    def select(x, selection):
+        index = list()
+        for axis, keep in selection:
+            if not keep:
+                index.append(axis.start)
+            else:
+                # A negative step runs to the start of the axis
+                index.append(slice(axis.start, axis.stop if axis.stop >= 0 else None, axis.step))
+        data = x.data.reshape(x.shape)[tuple(index)]
+        return SacArray(numpy.ascontiguousarray(data).reshape(-1), sacarray.selected_shape(selection))
+
+    @staticmethod
+    def gather(x, indexes, shape):
+        offset = 0
+        for index, extent, stride in zip(indexes, x.shape, sacarray.strides(x.shape)):
+            outside = (index.data < 0) | (index.data >= extent)
+            if numpy.any(outside):
+                raise ValueError("Index %d is out of bounds for an axis of %d"
+                                 % (index.data[numpy.argmax(outside)], extent))
+            offset = offset + index.data * stride
+        return SacArray(x.data[numpy.broadcast_to(offset, (SacArray(None, shape).size,))], shape)
+
+    @staticmethod
+    def index_array(shape, axis):
+        stride = sacarray.strides(shape)[axis]
+        return SacArray(numpy.arange(SacArray(None, shape).size) // stride % shape[axis], shape)
+
+
+def default_backend():
+    """Returns the NumPy backend if NumPy can be imported, the array one otherwise"""
+    return NumpyBackend() if numpy is not None else ArrayBackend()
+
+
+def tokenize_expression(text):
+    """Splits an expression into (kind, token) pairs, kind being NUMBER, NAME or OPERATOR"""
+    tokens = list()
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = EVAL_TOKEN.match(text, position)
+        if match is None:
+            raise ValueError("Invalid expression at: %s" % text[position:].strip())
+        tokens.append((match.lastindex, match.group(match.lastindex)))
+        position = match.end()
+    return tokens
+
+
+class ExpressionParser(object):
+    """Parses an expression into a tree of tuples, the first item naming the node:
+
+        ("number", value)             ("variable", name)
+        ("binary", op, left, right)   ("unary", op, operand)
+        ("call", function, argument)  ("vector", [items])
+        ("index", array, [axes])      axes are expressions or ("slice", start, stop, step)
+        ("set", [index names], body, bounds or None)
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize_expression(text)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position][1] if self.position < len(self.tokens) else None
+
+    def next(self):
+        if self.position >= len(self.tokens):
+            raise ValueError("Unexpected end of expression: %s" % self.text.strip())
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def expect(self, token):
+        kind, found = self.next()
+        if found != token or kind != OPERATOR:
+            raise ValueError("Expected %s but found %s" % (token, found))
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty expression")
+        tree = self.binary(0)
+        if self.position < len(self.tokens):
+            raise ValueError("Unexpected %s in expression" % self.peek())
+        return tree
+
+    def binary(self, level):
+        if level == len(PRECEDENCE):
+            return self.unary()
+        left = self.binary(level + 1)
+        while self.peek() in PRECEDENCE[level] and self.tokens[self.position][0] == OPERATOR:
+            op = self.next()[1]
+            left = ("binary", op, left, self.binary(level + 1))
+        return left
+
+    def unary(self):
+        if self.peek() in ("-", "!") and self.tokens[self.position][0] == OPERATOR:
+            op = self.next()[1]
+            return ("unary", op, self.unary())
+        return self.postfix()
+
+    def postfix(self):
+        tree = self.primary()
+        while self.peek() == "[":
+            self.next()
+            tree = ("index", tree, self.axes())
+        return tree
+
+    def axes(self):
+        axes = list()
+        while True:
+            axes.append(self.axis())
+            kind, token = self.next()
+            if token == "]":
+                return axes
+            if token != ",":
+                raise ValueError("Expected , or ] but found %s" % token)
+
+    def axis(self):
+        bounds = [None]
+        while True:
+            if self.peek() not in (":", ",", "]"):
+                bounds[-1] = self.binary(0)
+            if self.peek() != ":":
+                break
+            self.next()
+            bounds.append(None)
+        if len(bounds) == 1:
+            if bounds[0] is None:
+                raise ValueError("Missing index")
+            return bounds[0]
+        if len(bounds) > 3:
+            raise ValueError("Invalid slice")
+        return ("slice",) + tuple(bounds + [None] * (3 - len(bounds)))
+
+    def names(self):
+        self.expect("[")
+        names = list()
+        while True:
+            kind, token = self.next()
+            if kind != NAME:
+                raise ValueError("Expected an index variable but found %s" % token)
+            names.append(token)
+            kind, token = self.next()
+            if token == "]":
+                return names
+            if token != ",":
+                raise ValueError("Expected , or ] but found %s" % token)
+
+    def primary(self):
+        kind, token = self.next()
+        if kind == NUMBER:
+            return ("number", float(token) if any(c in token for c in ".eE") else int(token))
+        if kind == NAME and token in LITERALS:
+            return ("number", LITERALS[token])
+        if kind == NAME and token in FUNCTIONS and self.peek() == "(":
+            self.next()
+            argument = self.binary(0)
+            self.expect(")")
+            return ("call", token, argument)
+        if kind == NAME:
+            return ("variable", token)
+        if token == "(":
+            tree = self.binary(0)
+            self.expect(")")
+            return tree
+        if token == "[":
+            items = [self.binary(0)]
+            while self.peek() == ",":
+                self.next()
+                items.append(self.binary(0))
+            self.expect("]")
+            return ("vector", items)
+        if token == "{":
+            # Set notation, { [i, j] -> body | [i, j] < bounds }
+            names = self.names()
+            self.expect("->")
+            body = self.binary(0)
+            bounds = None
+            if self.peek() == "|":
+                self.next()
+                if self.names() != names:
+                    raise ValueError("The bounds must be given for [%s]" % ", ".join(names))
+                self.expect("<")
+                bounds = self.binary(0)
+            self.expect("}")
+            return ("set", names, body, bounds)
+        raise ValueError("Unexpected %s in expression" % token)
+
+
+@functools.lru_cache(maxsize=256)
+def parse_expression(text):
+    """Parses a SaC expression such as sum(a * b) into a tree"""
+    return ExpressionParser(text).parse()
+
+
+def find_bounds_array(tree, names):
+    """Returns the array a set notation body indexes with exactly its index variables, or None"""
+    if tree[0] == "index" and tree[1][0] == "variable" and \
+            tree[2][:len(names)] == [("variable", name) for name in names]:
+        return tree[1][1]
+    for child in tree[1:]:
+        if isinstance(child, tuple):
+            found = find_bounds_array(child, names)
+        elif isinstance(child, list):
+            found = next((result for result in (find_bounds_array(item, names) for item in child
+                                                if isinstance(item, tuple)) if result), None)
+        else:
+            continue
+        if found is not None:
+            return found
+    return None
+
+
+class Evaluator(object):
+    """Evaluates expression trees over arrays read from the inferior
+
+    read(name) returns the shape, memoryview format and raw data of a SaC
+    variable. Every variable is read once, in bulk, whatever the expression.
+    """
+
+    def __init__(self, read, backend=None):
+        self.read = read
+        self.backend = backend or default_backend()
+        self.variables = dict()
+        # Index variables of the set notations being evaluated
+        self.scopes = list()
+
+    def variable(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        value = self.variables.get(name)
+        if value is None:
+            shape, fmt, data = self.read(name)
+            value = self.backend.load(fmt, data, shape)
+            self.variables[name] = value
+        return value
+
+    def scalar(self, tree, what, value=None):
+        """Returns the integer an expression evaluates to, or the already evaluated value"""
+        if value is None:
+            value = self.evaluate(tree)
+        if value.shape:
+            raise ValueError("%s must be a scalar" % what)
+        item = self.backend.item(value, 0)
+        if isinstance(item, float):
+            raise ValueError("%s must be an integer" % what)
+        return int(item)
+
+    def evaluate(self, tree):
+        kind = tree[0]
+        backend = self.backend
+        if kind == "number":
+            return backend.constant(tree[1])
+        if kind == "variable":
+            return self.variable(tree[1])
+        if kind == "binary":
+            left, right = self.evaluate(tree[2]), self.evaluate(tree[3])
+            if left.shape and right.shape and left.shape != right.shape:
+                raise ValueError("Shapes %s and %s don't match" % (list(left.shape), list(right.shape)))
+            return backend.binary(tree[1], left, right, left.shape or right.shape)
+        if kind == "unary":
+            return backend.unary(tree[1], self.evaluate(tree[2]))
+        if kind == "call":
+            return self.call(tree[1], self.evaluate(tree[2]))
+        if kind == "vector":
+            return self.vector([self.scalar(item, "A vector element") for item in tree[1]])
+        if kind == "index":
+            return self.index(self.evaluate(tree[1]), tree[2])
+        if kind == "set":
+            return self.set_notation(*tree[1:])
+        raise ValueError("Unknown expression %s" % kind)
+
+    def vector(self, items):
+        return self.backend.load("q", array.array("q", items), (len(items),))
+
+    def call(self, function, value):
+        backend = self.backend
+        if function in REDUCTIONS:
+            return backend.reduce(function, value)
+        if function == "abs":
+            return backend.unary("abs", value)
+        if function == "shape":
+            return self.vector(list(value.shape))
+        return backend.constant(len(value.shape))
+
+    def index(self, value, axes):
+        if len(axes) > len(value.shape):
+            raise ValueError("Too many indices for an array of rank %d" % len(value.shape))
+
+        selection = list()
+        indexes = list()
+        for axis, extent in zip(axes + [("slice", None, None, None)] * (len(value.shape) - len(axes)), value.shape):
+            if axis[0] == "slice":
+                bounds = [None if bound is None else self.scalar(bound, "A slice bound") for bound in axis[1:]]
+                if bounds[2] == 0:
+                    raise ValueError("Slice step cannot be zero")
+                selection.append((range(*slice(*bounds).indices(extent)), True))
+                continue
+            index = self.evaluate(axis)
+            if index.shape:
+                indexes.append(index)
+                continue
+            i = self.scalar(axis, "An index", index)
+            if i < 0:
+                i += extent
+            if not 0 <= i < extent:
+                raise ValueError("Index %d is out of bounds for an axis of %d" % (i, extent))
+            selection.append((range(i, i + 1), False))
+            indexes.append(self.backend.constant(i))
+
+        if len(indexes) == len(value.shape) and any(index.shape for index in indexes):
+            # Every axis indexed by arrays of indices, as in the body of a set notation
+            shape = next(index.shape for index in indexes if index.shape)
+            if any(index.shape and index.shape != shape for index in indexes):
+                raise ValueError("Index arrays of different shapes")
+            return self.backend.gather(value, indexes, shape)
+        if any(index.shape for index in indexes):
+            raise ValueError("Arrays of indices must index every axis")
+        return self.backend.select(value, selection)
+
+    def set_notation(self, names, body, bounds):
+        if bounds is not None:
+            extents = self.evaluate(bounds)
+            if extents.shape != (len(names),):
+                raise ValueError("The bounds must be a vector of %d extents" % len(names))
+            shape = tuple(int(self.backend.item(extents, i)) for i in range(len(names)))
+        else:
+            name = find_bounds_array(body, names)
+            if name is None:
+                raise ValueError("Give the bounds of [%s] with | [%s] < [...]" % ((", ".join(names),) * 2))
+            array_shape = self.variable(name).shape
+            if len(array_shape) < len(names):
+                raise ValueError("%s has fewer than %d axes" % (name, len(names)))
+            shape = array_shape[:len(names)]
+        if any(extent < 0 for extent in shape):
+            raise ValueError("Negative set notation bounds")
+
+        self.scopes.append(dict((name, self.backend.index_array(shape, axis)) for axis, name in enumerate(names)))
+        try:
+            value = self.evaluate(body)
+        finally:
+            self.scopes.pop()
+        if not value.shape:
+            return self.backend.binary("+", self.backend.constant(0, shape), value, shape)
+        if value.shape != shape:
+            raise ValueError("The set notation body has the shape %s instead of %s" % (list(value.shape), list(shape)))
+        return value
+
+
+def evaluate(text, read, backend=None):
+    """Evaluates a SaC expression over the variables read(name) returns"""
+    return Evaluator(read, backend).evaluate(parse_expression(text))
+
+
+def format_result(value, backend=None):
+    """Formats a result like sac print does, eliding large arrays"""
+    backend = backend or default_backend()
+    return sacarray.format_array(lambda i: backend.item(value, i), value.shape)
@@ -0,0 +1,295 @@
+import array
+import hashlib
+import json
+import os
+import struct
+
+import saccond
+import saclib
+
+# Records kept by default before the oldest are overwritten
+DEFAULT_HISTORY_SIZE = 1 << 20
+# Rows printed by sachistory show by default
+DEFAULT_SHOW_LIMIT = 20
+
+HISTORY_MAGIC = b"SACHIST\0"
+HISTORY_VERSION = 1
+# Magic, version, record size, capacity and number of records ever written
+HEADER = struct.Struct("<8sIIQQ")
+# Sequence, PC, thread, function, C variable, frame depth, value kind and the value
+RECORD = struct.Struct("<QQIIIHBx8s")
+
+# Value kinds, hashes are the first 8 bytes of a BLAKE2b digest of the contents
+INT = 0
+FLOAT = 1
+HASH = 2
+VALUE_FORMATS = {INT: struct.Struct("<q"), FLOAT: struct.Struct("<d")}
+
+
+class HistoryRecord(object):
+    """A write of a SaC variable, with the names of its thread, function and C variable"""
+    __slots__ = ("sequence", "pc", "thread", "function", "variable", "depth", "kind", "value")
+
+    def __init__(self, sequence, pc, thread, function, variable, depth, kind, value):
+        self.sequence = sequence
+        self.pc = pc
+        self.thread = thread
+        self.function = function
+        self.variable = variable
+        self.depth = depth
+        self.kind = kind
+        self.value = value
+
+    @property
+    def name(self):
+        return saclib.cvar_to_sac(self.variable) or self.variable
+
+    def format_value(self):
+        return "hash %s" % self.value.hex() if self.kind == HASH else repr(self.value)
+
+
+def encode_value(value):
+    """Returns the kind and packed 8 bytes of a value, contents that aren't a number are hashed"""
+    if isinstance(value, float):
+        return FLOAT, VALUE_FORMATS[FLOAT].pack(value)
+    if isinstance(value, int) and -(1 << 63) <= value < (1 << 63):
+        return INT, VALUE_FORMATS[INT].pack(value)
+    if not isinstance(value, (bytes, bytearray, memoryview)):
+        value = str(value).encode("utf-8")
+    return HASH, hashlib.blake2b(value, digest_size=8).digest()
+
+
+def decode_value(kind, packed):
+    if kind == HASH:
+        return bytes(packed)
+    return VALUE_FORMATS[kind].unpack(packed)[0]
+
+
+class ValueHistory(object):
+    """Append only log of variable writes in a fixed size ring of packed records
+
+    The ring is a bytearray, or a file of the same layout when a path is
+    given so the history outlives the session: a header followed by
+    capacity records, record n at slot n % capacity. Thread, function and
+    variable names are interned, their table is kept next to the file.
+    Every SaC variable has an array of the sequence numbers of its writes.
+    """
+
+    def __init__(self, capacity=DEFAULT_HISTORY_SIZE, path=None):
+        if capacity < 1:
+            raise ValueError("History size must be positive")
+        self.capacity = capacity
+        self.path = path
+        self.total = 0
+        self.names = list()
+        self.name_ids = dict()
+        # SaC variable -> sequence numbers of its writes, oldest first
+        self.index = dict()
+        self.file = None
+        self.ring = None
+        if path is None:
+            self.ring = bytearray(capacity * RECORD.size)
+        else:
+            self.file = open(path, "w+b")
+            self.file.truncate(HEADER.size + capacity * RECORD.size)
+            self.write_header()
+
+    @classmethod
+    def load(cls, path):
+        """Opens a history written to disk by an earlier session"""
+        history = cls.__new__(cls)
+        history.path = path
+        history.ring = None
+        history.file = open(path, "r+b")
+        try:
+            magic, version, record_size, history.capacity, history.total = HEADER.unpack(
+                history.file.read(HEADER.size))
+            if magic != HISTORY_MAGIC or version != HISTORY_VERSION or record_size != RECORD.size:
+                raise ValueError("%s is not a SaC value history" % path)
+            with open(path + ".names") as names_file:
+                history.names = json.load(names_file)
+        except (struct.error, IOError, OSError, ValueError):
+            history.file.close()
+            raise ValueError("%s is not a SaC value history" % path)
+        history.name_ids = dict((name, i) for i, name in enumerate(history.names))
+        history.index = dict()
+        for sequence in range(history.oldest(), history.total):
+            record = history.read(sequence)
+            history.index.setdefault(saclib.cvar_to_sac(history.names[record[4]]) or history.names[record[4]],
+                                     array.array("Q")).append(sequence)
+        return history
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def dropped(self):
+        """Returns the number of records that have been overwritten"""
+        return self.total - len(self)
+
+    def oldest(self):
+        return self.total - len(self)
+
+    def intern(self, name):
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(name)
+            self.name_ids[name] = name_id
+        return name_id
+
+    def append(self, thread, function, variable, depth, pc, value):
+        """Records a write of a C variable, returns its sequence number"""
+        sequence = self.total
+        kind, packed = encode_value(value)
+        record = RECORD.pack(sequence, pc, self.intern(str(thread)), self.intern(function), self.intern(variable),
+                             min(depth, 0xffff), kind, packed)
+        offset = (sequence % self.capacity) * RECORD.size
+        if self.ring is not None:
+            self.ring[offset:offset + RECORD.size] = record
+        else:
+            self.file.seek(HEADER.size + offset)
+            self.file.write(record)
+
+        sac_name = saclib.cvar_to_sac(variable) or variable
+        sequences = self.index.get(sac_name)
+        if sequences is None:
+            sequences = array.array("Q")
+            self.index[sac_name] = sequences
+        sequences.append(sequence)
+        # Drop the index entries of records overwritten by now, a whole ring's worth at a time
+        if len(sequences) > 2 * self.capacity:
+            del sequences[:len(sequences) - self.capacity]
+        self.total += 1
+        return sequence
+
+    def read(self, sequence):
+        """Returns the raw fields of a record that hasn't been overwritten"""
+        offset = (sequence % self.capacity) * RECORD.size
+        if self.ring is not None:
+            return RECORD.unpack_from(self.ring, offset)
+        self.file.seek(HEADER.size + offset)
+        return RECORD.unpack(self.file.read(RECORD.size))
+
+    def record(self, sequence):
+        """Returns a record by its sequence number, None if it has been overwritten"""
+        if not self.oldest() <= sequence < self.total:
+            return None
+        sequence, pc, thread, function, variable, depth, kind, packed = self.read(sequence)
+        return HistoryRecord(sequence, pc, self.names[thread], self.names[function], self.names[variable], depth,
+                             kind, decode_value(kind, packed))
+
+    def records(self, name=None, reverse=False):
+        """Yields the records still in the ring, of every variable or of a SaC variable, oldest first"""
+        if name is None:
+            sequences = range(self.oldest(), self.total)
+        else:
+            sequences = self.index.get(name, ())
+        for sequence in (reversed(sequences) if reverse else sequences):
+            if sequence >= self.oldest():
+                yield self.record(sequence)
+            elif reverse:
+                return
+
+    def find(self, condition, last=False):
+        """Returns the first record, or the last, of the one SaC variable of a condition that satisfies it
+
+        A condition is written like a sac break condition, e.g. x < 0.
+        Content hashes can only be compared for (in)equality with each other.
+        """
+        names = condition.names
+        if len(names) != 1:
+            raise ValueError("A history condition reads one variable, not %d" % len(names))
+        name = next(iter(names))
+
+        def unsupported(*args):
+            raise ValueError("History conditions can only compare a variable's value")
+
+        for record in self.records(name, reverse=last):
+            if record.kind == HASH:
+                continue
+            try:
+                if condition(lambda n: record.value, unsupported, unsupported, unsupported):
+                    return record
+            except (ArithmeticError, TypeError):
+                continue
+        return None
+
+    def write_header(self):
+        self.file.seek(0)
+        self.file.write(HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, RECORD.size, self.capacity, self.total))
+
+    def flush(self):
+        """Writes the header and name table of a history on disk so it can be loaded later"""
+        if self.file is None:
+            return
+        self.write_header()
+        self.file.flush()
+        tmp_path = "%s.names.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as names_file:
+            json.dump(self.names, names_file)
+        os.replace(tmp_path, self.path + ".names")
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def clear(self):
+        self.total = 0
+        self.index.clear()
+
+
+def format_records(records, limit=DEFAULT_SHOW_LIMIT):
+    """Formats records as a table, the newest limit of them"""
+    records = list(records)[-limit:]
+    lines = ["%10s  %-8s %-24s %5s  %-18s  %s" % ("seq", "thread", "variable", "depth", "pc", "value")]
+    for record in records:
+        lines.append("%10d  %-8s %-24s %5d  0x%016x  %s" % (record.sequence, record.thread, record.variable,
+                                                           record.depth, record.pc, record.format_value()))
+    return lines
+
+
+def parse_history_args(argv):
+    """Parses the options of sachistory into a dict"""
+    options = {"command": argv[0] if argv else "show", "size": DEFAULT_HISTORY_SIZE, "file": None,
+               "limit": DEFAULT_SHOW_LIMIT, "last": False, "variable": None, "condition": None}
+    if options["command"] not in ("start", "stop", "show", "find", "clear", "load"):
+        raise ValueError("Usage: sachistory start [--size N] [--file FILE] | stop | clear | load FILE | "
+                         "show [VARIABLE] [--limit N] | find CONDITION [--last]")
+
+    words = list()
+    i = 1
+    while i < len(argv):
+        if argv[i] in ("--size", "--limit") and options["command"] in ("start", "show"):
+            if i + 1 >= len(argv) or not argv[i + 1].isdigit() or not int(argv[i + 1]):
+                raise ValueError("Option %s requires a positive number" % argv[i])
+            options[argv[i][2:]] = int(argv[i + 1])
+            i += 2
+        elif argv[i] == "--file" and options["command"] == "start":
+            if i + 1 >= len(argv):
+                raise ValueError("Option --file requires a file")
+            options["file"] = argv[i + 1]
+            i += 2
+        elif argv[i] == "--last" and options["command"] == "find":
+            options["last"] = True
+            i += 1
+        elif options["command"] in ("show", "find", "load"):
+            words.append(argv[i])
+            i += 1
+        else:
+            raise ValueError("Unknown argument: %s" % argv[i])
+
+    if options["command"] == "show":
+        if len(words) > 1:
+            raise ValueError("sachistory show takes one variable")
+        options["variable"] = words[0] if words else None
+    elif options["command"] == "find":
+        if not words:
+            raise ValueError("sachistory find takes a condition, e.g. x < 0")
+        options["condition"] = saccond.compile_condition(" ".join(words))
+    elif options["command"] == "load":
+        if len(words) != 1:
+            raise ValueError("sachistory load takes one file")
+        options["file"] = words[0]
+    return options
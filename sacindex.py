@@ -0,0 +1,297 @@
+import functools
+import hashlib
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+from collections import namedtuple
+
+import saclib
+
+# ELF constants used when reading symbol tables
+ELF_MAGIC = b"\x7fELF"
+SHT_SYMTAB = 2
+SHT_NOTE = 7
+SHT_DYNSYM = 11
+STT_FUNC = 2
+SHN_UNDEF = 0
+NT_GNU_BUILD_ID = 3
+
+# Bump whenever the on disk format of the index changes
+INDEX_VERSION = 1
+
+SacFunctionSymbol = namedtuple("SacFunctionSymbol", ["c_name", "namespace", "name", "args"])
+
+
+class ElfFile(object):
+    """Minimal read only view of the section and program headers of an ELF file"""
+
+    def __init__(self, data):
+        if data[:4] != ELF_MAGIC:
+            raise ValueError("Not an ELF file")
+
+        self.data = data
+        self.is_64 = data[4] == 2
+        self.endian = "<" if data[5] == 1 else ">"
+        self.type, = struct.unpack_from(self.endian + "H", data, 0x10)
+
+        if self.is_64:
+            phoff, shoff = struct.unpack_from(self.endian + "QQ", data, 0x20)
+            phentsize, phnum, shentsize, shnum, shstrndx = struct.unpack_from(self.endian + "HHHHH", data, 0x36)
+            section_format = "IIQQQQIIQQ"
+            # Type, offset, virtual address, file size and memory size
+            segment_format, segment_fields = "IIQQQQQQ", (0, 2, 3, 5, 6)
+        else:
+            phoff, shoff = struct.unpack_from(self.endian + "II", data, 0x1C)
+            phentsize, phnum, shentsize, shnum, shstrndx = struct.unpack_from(self.endian + "HHHHH", data, 0x2A)
+            section_format = "IIIIIIIIII"
+            segment_format, segment_fields = "IIIIIIII", (0, 1, 2, 4, 5)
+
+        # Each segment is (type, offset, virtual address, file size, memory size)
+        self.segments = list()
+        for i in range(phnum):
+            fields = struct.unpack_from(self.endian + segment_format, data, phoff + i * phentsize)
+            self.segments.append(tuple(fields[j] for j in segment_fields))
+
+        # Each section is (name offset, type, offset, size, link)
+        self.sections = list()
+        for i in range(shnum):
+            fields = struct.unpack_from(self.endian + section_format, data, shoff + i * shentsize)
+            self.sections.append((fields[0], fields[1], fields[4], fields[5], fields[6]))
+
+        self.shstrndx = shstrndx
+
+    def section_name(self, section):
+        names = self.sections[self.shstrndx]
+        return self.string_at(names[2] + section[0])
+
+    def string_at(self, offset):
+        end = self.data.find(b"\0", offset)
+        return self.data[offset:end]
+
+    def sections_of_type(self, section_type):
+        return [s for s in self.sections if s[1] == section_type]
+
+
+def _open_elf(path):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_elf_symbols(path, prefix=b"SACf__"):
+    """Returns the names of the defined function symbols in an ELF file starting with prefix"""
+    data = _open_elf(path)
+    try:
+        elf = ElfFile(data)
+
+        # Prefer the full symbol table, stripped binaries only have the dynamic one
+        tables = elf.sections_of_type(SHT_SYMTAB) or elf.sections_of_type(SHT_DYNSYM)
+
+        if elf.is_64:
+            symbol_format = struct.Struct(elf.endian + "IBBHQQ")
+            info_field, shndx_field = 1, 3
+        else:
+            symbol_format = struct.Struct(elf.endian + "IIIBBH")
+            info_field, shndx_field = 3, 5
+
+        names = list()
+        for table in tables:
+            strtab_offset = elf.sections[table[4]][2]
+            table_bytes = data[table[2]:table[2] + table[3]]
+            table_bytes = table_bytes[:len(table_bytes) - len(table_bytes) % symbol_format.size]
+            for symbol in symbol_format.iter_unpack(table_bytes):
+                if symbol[info_field] & 0xf != STT_FUNC or symbol[shndx_field] == SHN_UNDEF:
+                    continue
+                start = strtab_offset + symbol[0]
+                if data[start:start + len(prefix)] == prefix:
+                    names.append(elf.string_at(start).decode("ascii", "replace"))
+
+        return names
+    finally:
+        data.close()
+
+
+def read_build_id(path):
+    """Returns the GNU build-id of an ELF file as a hex string or None"""
+    data = _open_elf(path)
+    try:
+        elf = ElfFile(data)
+        for section in elf.sections_of_type(SHT_NOTE):
+            offset = section[2]
+            end = offset + section[3]
+            while offset + 12 <= end:
+                namesz, descsz, note_type = struct.unpack_from(elf.endian + "III", data, offset)
+                name_start = offset + 12
+                desc_start = name_start + ((namesz + 3) & ~3)
+                if note_type == NT_GNU_BUILD_ID and data[name_start:name_start + namesz] == b"GNU\0":
+                    return data[desc_start:desc_start + descsz].hex()
+                offset = desc_start + ((descsz + 3) & ~3)
+        return None
+    finally:
+        data.close()
+
+
+def index_key(path, build_id=None):
+    """Returns the key an index is stored under, the build-id if there is one"""
+    if build_id:
+        return build_id
+
+    # Without a build-id fall back to the identity of the file on disk
+    stat = os.stat(path)
+    identity = "%s:%d:%d" % (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    return "path-" + hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+
+def cache_dir():
+    """Returns the directory persisted symbol indexes are kept in"""
+    if "SACDEBUG_CACHE" in os.environ:
+        return os.environ["SACDEBUG_CACHE"]
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "sacdebug")
+
+
+class SacSymbolIndex(object):
+    """Index of the SaC functions defined in a binary"""
+
+    def __init__(self, c_names=()):
+        self.symbols = dict()
+        for c_name in c_names:
+            self.add(c_name)
+
+    def add(self, c_name):
+        """Adds a C function name to the index, ignoring anything that isn't a SaC function"""
+        if c_name in self.symbols:
+            return self.symbols[c_name]
+
+        parts = saclib.sacfunc_split(c_name)
+        if parts is None:
+            return None
+
+        symbol = SacFunctionSymbol(c_name, parts[0], parts[1], tuple(parts[2]))
+        self.symbols[c_name] = symbol
+        return symbol
+
+    def update(self, other):
+        """Merges another index into this one"""
+        self.symbols.update(other.symbols)
+
+    def lookup(self, c_name):
+        return self.symbols.get(c_name)
+
+    def __contains__(self, c_name):
+        return c_name in self.symbols
+
+    def __iter__(self):
+        return iter(self.symbols.values())
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def save(self, path):
+        """Writes the index to disk, replacing any existing file atomically"""
+        rows = [[s.c_name, s.namespace, s.name, list(s.args)] for s in self.symbols.values()]
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # The indexer thread may be saving the same index
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, "w") as f:
+            json.dump({"version": INDEX_VERSION, "symbols": rows}, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by save, returns None if it is missing or stale"""
+        try:
+            with open(path) as f:
+                content = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if content.get("version") != INDEX_VERSION:
+            return None
+
+        index = cls()
+        for c_name, namespace, name, args in content["symbols"]:
+            index.symbols[c_name] = SacFunctionSymbol(c_name, namespace, name, tuple(args))
+        return index
+
+    @classmethod
+    def from_elf(cls, path):
+        return cls(read_elf_symbols(path))
+
+
+def load_index(path, build_id=None, directory=None):
+    """Returns the symbol index of a binary, loading it from the cache if possible"""
+    if build_id is None:
+        build_id = read_build_id(path)
+
+    cache_path = os.path.join(directory or cache_dir(), index_key(path, build_id) + ".json")
+
+    index = SacSymbolIndex.load(cache_path)
+    if index is None:
+        index = SacSymbolIndex.from_elf(path)
+        try:
+            index.save(cache_path)
+        except (IOError, OSError):
+            # An unwritable cache only costs us the speed up next time
+            pass
+
+    return index
+
+
+class BackgroundIndexer(object):
+    """Indexes binaries one at a time in a worker thread
+
+    Every index, or None if the binary couldn't be read, is handed to
+    done(path, index) through post, which GDB's post_event runs on its own
+    thread. Binaries submitted before the last clear are dropped.
+    """
+
+    def __init__(self, done, post=lambda callback: callback(), load=load_index):
+        self.done = done
+        self.post = post
+        self.load = load
+        self.queue = queue.Queue()
+        self.generation = 0
+        self.worker = None
+        self.lock = threading.Lock()
+
+    def submit(self, path, build_id=None):
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, name="sacdebug-indexer")
+                # Never keep GDB from exiting
+                self.worker.daemon = True
+                self.worker.start()
+        self.queue.put((self.generation, path, build_id))
+
+    def run(self):
+        while True:
+            generation, path, build_id = self.queue.get()
+            try:
+                try:
+                    index = self.load(path, build_id)
+                except (IOError, OSError, ValueError):
+                    index = None
+                self.post(functools.partial(self.finish, generation, path, index))
+            finally:
+                self.queue.task_done()
+
+    def finish(self, generation, path, index):
+        if generation == self.generation:
+            self.done(path, index)
+
+    def pending(self):
+        """Returns the number of binaries waiting to be indexed"""
+        return self.queue.unfinished_tasks
+
+    def wait(self):
+        """Blocks until every submitted binary has been indexed and posted"""
+        self.queue.join()
+
+    def clear(self):
+        self.generation += 1
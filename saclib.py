@@ -1,5 +1,27 @@
+import bisect
+import fnmatch
+import functools
+import re
+
 import globals
 
+SSA_NUMBERS = re.compile(r"\d+")
+# Array shapes of SaC argument types, e.g. [.,6] or [6][7]
+SHAPE_BRACKETS = re.compile(r"(?:\[[^\[\]]*\])+")
+SHAPE_GROUP = re.compile(r"\[([^\[\]]*)\]")
+# Type codes in function identifiers, e.g. i_P_6
+C_TYPE_SHAPE = re.compile(r"(.*?)((?:_(?:\d+|XP|X|P))*)$")
+SAC_TYPE_NAMES = dict((code, name) for name, code in globals.sac_types.items())
+# Command rewriting
+SACBLOCK_OPEN = "*sac("
+BRACKETS = re.compile(r"[()]")
+# What a batch is split on, with the quotes, escapes and brackets a ; within doesn't split
+BATCH_TOKENS = re.compile(r"""\\.|["';()\[\]{}]""")
+# Commas between function arguments, not those between the axes of a shape
+ARG_SEPARATOR = re.compile(r",(?![^\[]*\])")
+# A print without a format or options, which batches evaluate without going through the CLI
+PRINT_COMMAND = re.compile(r"^\s*(?:print|p)\s+([^/\-\s].*?)\s*$")
+
 
 def find_all(a_str, sub):
     start = 0
@@ -10,73 +32,196 @@ def find_all(a_str, sub):
         start += len(sub)
 
 
+def is_sac_var(var_name):
+    """Returns True if a C variable name belongs to a SaC local variable"""
+    if "SACp_emal" not in var_name and "SACl_" not in var_name:
+        return False
+
+    # TODO: remove flat
+
+    # Crude removal of array descriptor variables
+    array_truth = [True for x in globals.sac_array_exclude if x in var_name]
+    return not array_truth
+
+
 def sac_vars(local_vars):
-    """Returns a list of valid SaC local variables"""
+    """Returns a list of valid SaC local variables from info locals text or a list of names"""
+    if isinstance(local_vars, str):
+        var_names = [line.split(" ")[0].strip() for line in local_vars.split("\n")]
+    else:
+        var_names = local_vars
+
+    return [var_name for var_name in var_names if is_sac_var(var_name)]
+
+
+@functools.lru_cache(maxsize=262144)
+def sacvar_parse(c_var_name):
+    """Splits a C variable name into its SaC name and a key that orders its SSA versions"""
+    # Skip the SACp_emal_5_ / SACl_ prefix to get the proper variable name
+    underscore_limit = 3 if c_var_name[:5] == "SACp_" else 1
+    parts = c_var_name.split("_", underscore_limit)
+    signature = parts[-1]
+
+    # Temporaries of the same variable are told apart by their emal number
+    emal_number = int(parts[2]) if len(parts) == 4 and parts[2].isdigit() else 0
+
+    ssa_index = signature.rfind("__SSA")
+    if ssa_index == -1:
+        return signature, ((), emal_number)
+
+    # Compare SSA indexes numerically, so SSA0_10 is newer than SSA0_9
+    ssa_numbers = tuple(int(n) for n in SSA_NUMBERS.findall(signature[ssa_index + len("__SSA"):]))
+    return signature[:ssa_index], (ssa_numbers, emal_number)
 
-    valid_vars = list()
 
-    for line in local_vars.split("\n"):
-        if "SACp_emal" in line or "SACl_" in line:
-            var_name = line.split(" ")[0].strip()
+class SacVariableFrame(object):
+    """The C variables of a SaC function frame, indexed by their SaC name"""
 
-            # TODO: remove flat
+    def __init__(self, c_var_names=()):
+        self.names = list()
+        # SaC name -> list of (SSA key, C name) sorted oldest to newest
+        self.versions = dict()
+        for c_var_name in c_var_names:
+            self.append(c_var_name)
 
-            # Crude removal of array descriptor variables
-            array_truth = [True for x in globals.sac_array_exclude if x in var_name]
-            if not array_truth:
-                valid_vars.append(var_name)
+    def append(self, c_var_name):
+        base, key = sacvar_parse(c_var_name)
+        versions = self.versions.setdefault(base, list())
+        entry = (key, c_var_name)
+        index = bisect.bisect_left(versions, entry)
+        if index < len(versions) and versions[index] == entry:
+            return
+        versions.insert(index, entry)
+        self.names.append(c_var_name)
 
-    return valid_vars
+    def lookup(self, var_name):
+        """Returns the newest C version of a SaC variable or None"""
+        versions = self.versions.get(var_name)
+        return versions[-1][1] if versions else None
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        return self.names[index]
+
+
+def sac_frame(local_vars):
+    """Returns local variables from info locals text or a list of names as a SacVariableFrame"""
+    if isinstance(local_vars, SacVariableFrame):
+        return local_vars
+    return SacVariableFrame(sac_vars(local_vars))
 
 
 def sacvar_to_c(var_name, local_vars):
     """Converts a SaC variable name to the newest C version"""
-    valid_vars = list()
+    if not isinstance(local_vars, SacVariableFrame):
+        local_vars = SacVariableFrame(local_vars)
 
-    for i, var in enumerate(local_vars):
-        if var[:5] == "SACp_":
-            underscore_limit = 3
-        else:
-            underscore_limit = 1
-
-        # Skip the first 2 underscores to get the proper variable name
-        signature = ""
-        underscores = 0
-        for ch in var:
-            if underscores < underscore_limit:
-                if ch == "_":
-                    underscores += 1
-            else:
-                signature += ch
-        valid_vars.append((signature, var))
-
-    # Generate a list of variables that match the var_name
-    matched_vars = list()
-    sig_size = len(var_name)
-    for var in valid_vars:
-        match_string = var[0][:sig_size]
-        if match_string == var_name:
-            matched_vars.append(var[1])
-
-    # If there's more than one variable Single Static Assignment has occurred
-    # Sort the list to make sure the highest index contains the latest SSA var
-
-    if matched_vars:
-        if len(matched_vars) == 1:
-            return matched_vars[0]
-        else:
-            return sorted(matched_vars)[len(matched_vars) - 1]
+    # If there's more than one variable Single Static Assignment has occurred,
+    # the frame keeps the versions ordered so the last one is the latest
+    return local_vars.lookup(var_name)
+
+
+@functools.lru_cache(maxsize=65536)
+def cvar_to_sac(var_name):
+    """Converts a C variable name to its SaC name, None if it isn't a SaC variable"""
+    if not is_sac_var(var_name):
+        return None
+    return sacvar_parse(var_name)[0]
+
+
+def register_user_types(c_types):
+    """Makes the user defined types among function identifier type codes usable without their namespace"""
+    added = False
+    for c_type in c_types:
+        if not c_type.startswith("SACt__"):
+            continue
+        parts = c_type[len("SACt__"):].split("__", 1)
+        if len(parts) != 2:
+            continue
+        type_name = C_TYPE_SHAPE.match(parts[1]).group(1)
+        if globals.sac_user_types.get(type_name) != parts[0]:
+            globals.sac_user_types[type_name] = parts[0]
+            added = True
+
+    # Conversions done so far may have rejected the new types
+    if added:
+        sactype_to_c.cache_clear()
+        sacfunc_to_c_cached.cache_clear()
+        compile_command.cache_clear()
+
+
+@functools.lru_cache(maxsize=4096)
+def sactype_to_c(type_string):
+    """Converts a SaC argument type such as int[.,6] to its function identifier code"""
+    base, bracket, shape = type_string.partition("[")
+    base = base.strip()
+
+    # User defined types are mapped to SACt__NAMESPACE__typename
+    if base in globals.sac_types:
+        c_type = globals.sac_types[base]
+    elif "::" in base:
+        type_namespace, type_name = base.split("::", 1)
+        c_type = "SACt__" + type_namespace.upper() + "__" + type_name
+    elif base in globals.sac_user_types:
+        c_type = "SACt__" + globals.sac_user_types[base] + "__" + base
     else:
         return None
 
+    if not bracket:
+        return c_type
+
+    shape = bracket + shape
+    if not SHAPE_BRACKETS.fullmatch(shape):
+        return None
+
+    axes = [axis.strip() for group in SHAPE_GROUP.findall(shape) for axis in group.split(",")]
+    for axis in axes:
+        if axis.isdigit() and int(axis) > 0:
+            c_type += "_" + axis
+        elif axis in globals.sac_shape_codes and (len(axes) == 1 or axis == "."):
+            c_type += "_" + globals.sac_shape_codes[axis]
+        else:
+            return None
+
+    return c_type
 
-def cvar_to_sac(var_name, local_vars):
-    # Only works if you don't have an _SSA0_ in your variable name
-    pass
+
+@functools.lru_cache(maxsize=4096)
+def ctype_to_sac(c_type):
+    """Converts a function identifier type code such as i_P_6 back to its SaC type"""
+    if c_type.startswith("SACt__"):
+        parts = c_type[len("SACt__"):].split("__", 1)
+        if len(parts) != 2:
+            return None
+        match = C_TYPE_SHAPE.match(parts[1])
+        base = parts[0] + "::" + match.group(1)
+    else:
+        match = C_TYPE_SHAPE.match(c_type)
+        base = SAC_TYPE_NAMES.get(match.group(1))
+        if base is None:
+            return None
+
+    codes = match.group(2).split("_")[1:]
+    if not codes:
+        return base
+
+    shape_names = dict((code, axis) for axis, code in globals.sac_shape_codes.items())
+    axes = [shape_names.get(code, code) for code in codes]
+    return base + "[" + ",".join(axes) + "]"
 
 
 def sacfunc_to_c(func_name, args=list()):
     """Converts a SaC function signature with optional arguments list to it's C version"""
+    return sacfunc_to_c_cached(func_name, tuple(args))
+
+
+@functools.lru_cache(maxsize=16384)
+def sacfunc_to_c_cached(func_name, args):
     sac_namespace = "MAIN"
 
     # Look for a namespace
@@ -87,138 +232,279 @@ def sacfunc_to_c(func_name, args=list()):
 
     c_func_name = "SACf__" + sac_namespace + "__" + func_name
 
-    # TODO: custom types
-    if args:
-        for arg in args:
-            try:
-                arr_starts = find_all(arg, "[")
-                arrays = list()
-                for start in arr_starts:
-                    arg_rest = arg[start + 1:]
-                    brackets = 0
-                    inner_content = ""
-                    for i, ch in enumerate(arg_rest):
-                        if ch == "[":
-                            brackets += 1
-                        elif ch == "]":
-                            brackets -= 1
-                            if brackets < 1:
-                                break
-                        inner_content += ch
-
-                    if inner_content.isdigit():
-                        arrays.append(int(inner_content))
-                    else:
-                        if len(inner_content) < 3:
-                            arrays.append(0)
-                        else:
-                            return None
-
-                is_array = True if arrays else False
-                c_func_name += "__"
-
-                if is_array:
-                    type_string = ""
-                    for ch in arg:
-                        if ch == "[":
-                            break
-                        else:
-                            type_string += ch
-                    arg_type = globals.sac_types[type_string]
-                else:
-                    arg_type = globals.sac_types[arg]
-
-                c_func_name += arg_type
-
-                for arr in arrays:
-                    if arr > 0:
-                        c_func_name += ("_" + str(arr))
-                    else:
-                        c_func_name += "_P"
-            except KeyError:
-                return None
+    for arg in args:
+        c_type = sactype_to_c(arg)
+        if c_type is None:
+            return None
+        c_func_name += "__" + c_type
 
     return c_func_name
 
 
+@functools.lru_cache(maxsize=65536)
+def cfunc_to_sac(c_func_name):
+    """Converts a C function name to its SaC signature, None if it isn't a SaC function"""
+    parts = sacfunc_split(c_func_name)
+    if parts is None:
+        return None
+
+    args = [ctype_to_sac(arg) for arg in parts[2]]
+    if None in args:
+        return None
+
+    return parts[0] + "::" + parts[1] + "(" + ", ".join(args) + ")"
+
+
+def sacfunc_split(c_func_name):
+    """Splits a C function name into its SaC namespace, name and argument type codes"""
+    if not c_func_name.startswith("SACf__"):
+        return None
+
+    parts = c_func_name[len("SACf__"):].split("__")
+    if len(parts) < 2 or not parts[0] or not parts[1]:
+        return None
+
+    # User defined types are spread over three parts (SACt__NAMESPACE__typename)
+    args = list()
+    i = 2
+    while i < len(parts):
+        if parts[i] == "SACt" and i + 2 < len(parts):
+            args.append("__".join(parts[i:i + 3]))
+            i += 3
+        else:
+            args.append(parts[i])
+            i += 1
+
+    return parts[0], parts[1], args
+
+
+def sacfunc_match(namespace, name, patterns):
+    """Returns True if a SaC function matches any of the NAMESPACE::name glob patterns"""
+    for pattern in patterns:
+        # Patterns without a namespace match the function in any namespace
+        if "::" in pattern:
+            ns_pattern, name_pattern = pattern.split("::", 1)
+        else:
+            ns_pattern, name_pattern = "*", pattern
+
+        # Namespaces are upper case in C, the same as in sacfunc_to_c
+        if fnmatch.fnmatchcase(namespace, ns_pattern.upper()) and fnmatch.fnmatchcase(name, name_pattern):
+            return True
+    return False
+
+
+def sacfunc_in_scope(namespace, name, only, exclude):
+    """Returns True if a SaC function is selected by the --only and --exclude patterns"""
+    if only and not sacfunc_match(namespace, name, only):
+        return False
+    return not sacfunc_match(namespace, name, exclude)
+
+
+def parse_init_args(argv):
+    """Parses the options of sacinit into a dict"""
+    options = {"only": list(), "exclude": list(), "watch_ssa": False, "hw_watchpoints": None}
+
+    i = 0
+    while i < len(argv):
+        if argv[i] in ("--only", "--exclude"):
+            if i + 1 >= len(argv):
+                raise ValueError("Option %s requires a pattern" % argv[i])
+            options[argv[i][2:]].append(argv[i + 1])
+            i += 2
+        elif argv[i] == "--watch-ssa":
+            options["watch_ssa"] = True
+            i += 1
+        elif argv[i] == "--hw-watchpoints":
+            if i + 1 >= len(argv) or not argv[i + 1].isdigit():
+                raise ValueError("Option --hw-watchpoints requires a number")
+            options["hw_watchpoints"] = int(argv[i + 1])
+            i += 2
+        else:
+            raise ValueError("Unknown argument: %s" % argv[i])
+
+    return options
+
+
 def extract_sacblocks(arg):
     """ Extracts the *sac() block contents from a string as well as the start & end indexes"""
-    start_indexes = find_all(arg, "*sac(")
-
     commands = list()
-    for s_index in start_indexes:
-        # Pull the inside of the *sac( commands into a string
-        # Includes bracket matching to
-        string_end = arg[s_index + len("*sac("):]
+
+    # Jump from bracket to bracket, the whole string is only scanned once
+    s_index = arg.find(SACBLOCK_OPEN)
+    while s_index != -1:
+        content_start = s_index + len(SACBLOCK_OPEN)
         brackets = 1
-        inner_content = ""
-        end_bracket_index = 0
-        for i, ch in enumerate(string_end):
-            if ch == "(":
+        end_index = len(arg)
+        for match in BRACKETS.finditer(arg, content_start):
+            if match.group() == "(":
                 brackets += 1
-            elif ch == ")":
+            else:
                 brackets -= 1
                 if brackets < 1:
-                    end_bracket_index = i
+                    end_index = match.start()
                     break
-            inner_content += ch
 
-        end_index = s_index + end_bracket_index + len("*sac(")
-        commands.append((s_index, end_index, inner_content))
+        # An unclosed block runs to the end of the string
+        commands.append((s_index, end_index, arg[content_start:end_index]))
+        s_index = arg.find(SACBLOCK_OPEN, end_index + 1)
 
     return commands
 
 
-def replace_sacblocks(arg, sacblocks, local_vars):
-    """ Replace *sac() blocks in a string with their C equivalents """
-    if sacblocks:
-        gdb_command = arg[:sacblocks[0][0]]
+def parse_sacblock(content):
+    """Splits the contents of a *sac() block into a symbol and its argument types, None for variables"""
+    open_index = content.find("(")
+    close_index = content.find(")")
+
+    if open_index == -1:
+        # If there's no opening parenthesis then return error if closing one found
+        if close_index != -1:
+            return None
+        symbol, args = content, None
+    else:
+        if close_index != -1 and close_index < open_index:
+            return None
+        if close_index == -1:
+            close_index = len(content)
+        symbol = content[:open_index]
+        args = tuple(arg.strip() for arg in ARG_SEPARATOR.split(content[open_index + 1:close_index]) if arg.strip())
+
+    # Variables and functions must start with a non-numeric char
+    symbol = symbol.strip()
+    if not symbol or symbol[0].isdigit():
+        return None
+
+    return symbol, args
+
 
-        for i, block in enumerate(sacblocks):
-            if i > 1:
-                gdb_command += arg[sacblocks[i - 1][1]:block[0]]
+class SacCommandTemplate(object):
+    """A command compiled into literal text and the *sac() variables that fill its holes"""
 
-            sac_command = sac_to_c(block[2], local_vars)
-            if sac_command:
-                gdb_command += sac_command
+    def __init__(self, arg, sacblocks):
+        # Functions don't depend on the frame so they are translated into the literal text
+        self.parts = list()
+        self.holes = list()  # (index into parts, SaC variable name)
+        self.valid = True
+
+        position = 0
+        for start, end, content in sacblocks:
+            parsed = parse_sacblock(content) if end < len(arg) else None
+            if parsed is None:
+                self.valid = False
+                return
+
+            symbol, args = parsed
+            literal = arg[position:start]
+            if args is None:
+                self.parts.append(literal)
+                self.holes.append((len(self.parts), symbol))
+                self.parts.append(None)
             else:
-                return None
+                c_func_name = sacfunc_to_c(symbol, args)
+                if c_func_name is None:
+                    self.valid = False
+                    return
+                self.parts.append(literal + c_func_name)
+            position = end + 1
+
+        self.parts.append(arg[position:])
+
+    @property
+    def variables(self):
+        return [var_name for index, var_name in self.holes]
+
+    def bind(self, local_vars):
+        """Fills the variable holes from the local variables, None if one can't be resolved"""
+        if not self.valid:
+            return None
+
+        parts = self.parts
+        if self.holes:
+            local_vars = sac_frame(local_vars)
+            parts = list(parts)
+            for index, var_name in self.holes:
+                parts[index] = local_vars.lookup(var_name)
+                if parts[index] is None:
+                    return None
+
+        return "".join(parts)
+
 
-        return gdb_command
+@functools.lru_cache(maxsize=1024)
+def compile_command(arg):
+    """Returns the cached template of a command containing *sac() blocks"""
+    return SacCommandTemplate(arg, extract_sacblocks(arg))
+
+
+def split_commands(line):
+    """Splits a line on the semicolons outside of quotes and brackets"""
+    commands = list()
+    start = 0
+    depth = 0
+    quote = None
+    for match in BATCH_TOKENS.finditer(line):
+        token = match.group()
+        if quote is not None:
+            if token == quote:
+                quote = None
+        elif token in ("\"", "'"):
+            quote = token
+        elif token in ("(", "[", "{"):
+            depth += 1
+        elif token in (")", "]", "}"):
+            depth = max(depth - 1, 0)
+        elif token == ";" and not depth:
+            commands.append(line[start:match.start()])
+            start = match.end()
+    commands.append(line[start:])
+    return commands
+
+
+def split_batch(text):
+    """Splits a batch of commands, one per line or separated by semicolons, optionally in braces
+
+    Blank lines and # comments are skipped, as is the leading sac of a
+    command with *sac() blocks, which sac runs as if it wasn't there.
+    Semicolons in strings and brackets, print "a;b", don't split.
+    """
+    text = text.strip()
+    if text.startswith("{") and text.endswith("}"):
+        text = text[1:-1]
+    commands = list()
+    for line in text.splitlines():
+        if line.strip().startswith("#"):
+            continue
+        for command in split_commands(line):
+            command = command.strip()
+            if not command:
+                continue
+            words = command.split(None, 1)
+            if words[0] == "sac" and len(words) == 2 and SACBLOCK_OPEN in words[1]:
+                command = words[1]
+            commands.append(command)
+    return commands
+
+
+def print_expression(command):
+    """Returns the expression of a plain print command, None for any other command"""
+    match = PRINT_COMMAND.match(command)
+    return match.group(1) if match else None
+
+
+def replace_sacblocks(arg, sacblocks, local_vars):
+    """ Replace *sac() blocks in a string with their C equivalents """
+    if sacblocks:
+        return SacCommandTemplate(arg, sacblocks).bind(local_vars)
 
 
 def sac_to_c(arg, local_vars):
     """Converts a SaC variable or function to it's C equivalent"""
-    symbol = ""
-    func_args = ""
-    is_function = False
-
-    # Loop over the arg and determine if it's a variable or function
-    for i, ch in enumerate(arg):
-        # Variables and functions must start with a non-numeric char
-        if i == 0 and ch.isdigit():
-            return None
-        # If opening parenthesis found and not the first char then this is a valid function
-        if ch == "(":
-            if i > 0:
-                is_function = True
-            else:
-                return None
-        # If there's no opening parenthesis then return error if closing one found
-        elif ch == ")":
-            if is_function:
-                break
-            else:
-                return None
-        else:
-            if not is_function:
-                symbol += ch
-            else:
-                func_args += ch
-
-    arg_list = [arg.strip() for arg in func_args.split(",") if arg.strip()]
+    parsed = parse_sacblock(arg)
+    if parsed is None:
+        return None
 
-    if not is_function:
-        return sacvar_to_c(symbol, sac_vars(local_vars))
+    symbol, args = parsed
+    if args is None:
+        return sacvar_to_c(symbol, sac_frame(local_vars))
     else:
-        return sacfunc_to_c(symbol, arg_list)
\ No newline at end of file
+        return sacfunc_to_c(symbol, args)
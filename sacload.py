@@ -0,0 +1,100 @@
+import mmap
+import os
+import struct
+import sys
+
+import gdb
+
+# Prefix of the symbols of SaC functions, a binary mentioning it is a SaC program or module library
+SAC_SYMBOL = b"SACf__"
+# Commands sacdebug registers, stubs stand in for them until one is used
+SAC_COMMANDS = ("sacinit", "sac", "sactrace", "sacprof", "sacinfo", "saccore", "sachistory")
+
+# ELF section types of symbol tables
+SHT_SYMTAB = 2
+SHT_DYNSYM = 11
+
+active = False
+
+
+def symbol_strings(data):
+    """Returns the (start, end) offsets of the string tables of the symbol tables of a mapped ELF file"""
+    if data[:4] != b"\x7fELF":
+        return list()
+    endian = "<" if data[5] == 1 else ">"
+    if data[4] == 2:
+        shoff, = struct.unpack_from(endian + "Q", data, 0x28)
+        shentsize, shnum = struct.unpack_from(endian + "HH", data, 0x3A)
+        section_format = endian + "IIQQQQIIQQ"
+    else:
+        shoff, = struct.unpack_from(endian + "I", data, 0x20)
+        shentsize, shnum = struct.unpack_from(endian + "HH", data, 0x2E)
+        section_format = endian + "IIIIIIIIII"
+
+    # Each section is (name, type, flags, address, offset, size, link, ...)
+    sections = [struct.unpack_from(section_format, data, shoff + i * shentsize) for i in range(shnum)]
+    return [(sections[s[6]][4], sections[s[6]][4] + sections[s[6]][5])
+            for s in sections if s[1] in (SHT_SYMTAB, SHT_DYNSYM)]
+
+
+def has_sac_symbols(path):
+    """Returns True if a binary defines or uses SaC functions, only its symbol names are read"""
+    try:
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return False
+    try:
+        return any(data.find(SAC_SYMBOL, start, end) != -1 for start, end in symbol_strings(data))
+    except (struct.error, IndexError):
+        return False
+    finally:
+        data.close()
+
+
+def load_sacdebug():
+    """Imports sacdebug from next to this module, which registers its commands in place of the stubs"""
+    directory = os.path.dirname(os.path.realpath(__file__))
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    import sacdebug
+    return sacdebug
+
+
+class SacCommandStub(gdb.Command):
+    """Stand in for a sacdebug command that loads sacdebug when first used"""
+
+    def __init__(self, name):
+        super(SacCommandStub, self).__init__(name, gdb.COMMAND_SUPPORT)
+        self.name = name
+
+    def invoke(self, arg, from_tty):
+        if "sacdebug" in sys.modules:
+            raise gdb.GdbError("sacdebug is loaded but didn't register %s" % self.name)
+        load_sacdebug()
+        gdb.execute(("%s %s" % (self.name, arg)).strip(), from_tty)
+
+
+def activate():
+    """Registers the command stubs, once a SaC binary is loaded"""
+    global active
+
+    if active or "sacdebug" in sys.modules:
+        return
+    active = True
+    gdb.events.new_objfile.disconnect(objfile_loaded)
+    for name in SAC_COMMANDS:
+        SacCommandStub(name)
+
+
+def objfile_loaded(event):
+    if event.new_objfile.filename and has_sac_symbols(event.new_objfile.filename):
+        activate()
+
+
+# Nothing but this check runs until a SaC binary is loaded
+gdb.events.new_objfile.connect(objfile_loaded)
+for loaded_objfile in gdb.objfiles():
+    if loaded_objfile.filename and has_sac_symbols(loaded_objfile.filename):
+        activate()
+        break
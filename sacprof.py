@@ -0,0 +1,140 @@
+import collections
+
+import saclib
+
+# Samples per second, off the beat of periodic work in the inferior
+DEFAULT_RATE = 99
+# Seconds to profile for when no sample count is given
+DEFAULT_DURATION = 10.0
+# Rows printed by a report by default
+DEFAULT_REPORT_LIMIT = 20
+
+
+class StackTrie(object):
+    """Sample counts of call stacks, stacks sharing a prefix share its nodes
+
+    Frame names are interned. Node i has a dict of name id -> child node and
+    counts[i] samples whose innermost frame it is, node 0 is the root.
+    """
+
+    def __init__(self):
+        self.names = list()
+        self.name_ids = dict()
+        self.children = [dict()]
+        self.labels = [-1]
+        self.counts = [0]
+        self.samples = 0
+
+    def __len__(self):
+        return len(self.counts) - 1
+
+    def add(self, stack, count=1):
+        """Adds a sample of a stack given outermost frame first"""
+        node = 0
+        for name in stack:
+            name_id = self.name_ids.get(name)
+            if name_id is None:
+                name_id = len(self.names)
+                self.names.append(name)
+                self.name_ids[name] = name_id
+            child = self.children[node].get(name_id)
+            if child is None:
+                child = len(self.counts)
+                self.children[node][name_id] = child
+                self.children.append(dict())
+                self.labels.append(name_id)
+                self.counts.append(0)
+            node = child
+        self.counts[node] += count
+        self.samples += count
+
+    def stacks(self):
+        """Yields every sampled stack, outermost frame first, with its sample count"""
+        pending = [(0, ())]
+        while pending:
+            node, stack = pending.pop()
+            if self.counts[node]:
+                yield stack, self.counts[node]
+            for name_id, child in self.children[node].items():
+                pending.append((child, stack + (self.names[name_id],)))
+
+    def collapsed(self):
+        """Yields the stacks in the collapsed format read by flamegraph.pl and speedscope"""
+        for stack, count in sorted(self.stacks()):
+            if stack:
+                yield "%s %d" % (";".join(stack), count)
+
+    def function_counts(self):
+        """Returns the samples each function is the innermost frame of and the samples it is in"""
+        self_counts = collections.Counter()
+        total_counts = collections.Counter()
+        for stack, count in self.stacks():
+            if stack:
+                self_counts[stack[-1]] += count
+            # Recursive functions are counted once per sample
+            for name in set(stack):
+                total_counts[name] += count
+        return self_counts, total_counts
+
+    def clear(self):
+        self.__init__()
+
+
+def frame_label(c_name, sac_only=False):
+    """Returns the SaC signature of a frame's function, the C name or None if only SaC frames are kept"""
+    sac_name = saclib.cfunc_to_sac(c_name)
+    if sac_name is not None:
+        return sac_name
+    return None if sac_only else c_name
+
+
+def stack_labels(names, sac_only=False):
+    """Maps the function names of an unwound stack, innermost first, to an outermost first stack"""
+    labels = [frame_label(name, sac_only) for name in reversed(names)]
+    return tuple(label for label in labels if label is not None)
+
+
+def format_profile(trie, limit=DEFAULT_REPORT_LIMIT):
+    """Formats the self and total samples of the functions, most sampled first"""
+    self_counts, total_counts = trie.function_counts()
+    samples = max(1, trie.samples)
+    lines = ["%8s %7s %7s  %s" % ("samples", "self", "total", "function")]
+    for name in sorted(total_counts, key=lambda n: (self_counts[n], total_counts[n]), reverse=True)[:limit]:
+        lines.append("%8d %6.1f%% %6.1f%%  %s" % (self_counts[name], 100.0 * self_counts[name] / samples,
+                                                 100.0 * total_counts[name] / samples, name))
+    return lines
+
+
+def parse_prof_args(argv):
+    """Parses the options of sacprof into a dict"""
+    options = {"command": argv[0] if argv else "report", "rate": DEFAULT_RATE, "duration": DEFAULT_DURATION,
+               "samples": None, "sac_only": False, "limit": DEFAULT_REPORT_LIMIT, "file": None}
+    if options["command"] not in ("start", "report", "collapsed", "clear"):
+        raise ValueError("Unknown sacprof command: %s" % options["command"])
+
+    i = 1
+    while i < len(argv):
+        if argv[i] in ("--rate", "--duration"):
+            try:
+                value = float(argv[i + 1])
+            except (IndexError, ValueError):
+                value = 0
+            if not value > 0:
+                raise ValueError("Option %s requires a positive number" % argv[i])
+            options[argv[i][2:]] = value
+            i += 2
+        elif argv[i] in ("--samples", "--limit"):
+            if i + 1 >= len(argv) or not argv[i + 1].isdigit() or not int(argv[i + 1]):
+                raise ValueError("Option %s requires a positive number" % argv[i])
+            options[argv[i][2:]] = int(argv[i + 1])
+            i += 2
+        elif argv[i] == "--sac-only":
+            options["sac_only"] = True
+            i += 1
+        elif options["command"] == "collapsed" and options["file"] is None and not argv[i].startswith("-"):
+            options["file"] = argv[i]
+            i += 1
+        else:
+            raise ValueError("Unknown argument: %s" % argv[i])
+
+    return options
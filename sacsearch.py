@@ -0,0 +1,409 @@
+import bisect
+import collections
+import functools
+import itertools
+import re
+
+import saclib
+
+# Rows printed by sacinfo by default
+DEFAULT_LIMIT = 20
+# Functions matching a query's argument types that are scored one by one rather than through the name index
+DIRECT_SCORE_LIMIT = 4096
+
+# Match classes, better matches rank first
+EXACT = 0
+PREFIX = 1
+SUBSTRING = 2
+FUZZY = 3
+
+# A variable query with an optional SSA version, e.g. x@2 or x@-1 for the newest
+VARIABLE_QUERY = re.compile(r"^\s*([^@\s]*)\s*(?:@\s*(-?\d+))?\s*$")
+
+
+@functools.lru_cache(maxsize=1024)
+def fuzzy_pattern(query):
+    """Returns a regex matching the characters of a query in order within one line, each at its first chance
+
+    [^\nc]*c rather than [^\n]*?c keeps the regex from backtracking within a line.
+    """
+    return re.compile(re.escape(query[:1]) + "".join("[^\n%s]*%s" % (re.escape(c), re.escape(c)) for c in query[1:]))
+
+
+def match_score(query, key, start, end):
+    """Scores a lower case query matching a lower case key at key[start:end]
+
+    Scores order exact, prefix, substring and then fuzzy matches, each by how
+    spread out the match is and how much of the key it leaves unmatched.
+    """
+    if end - start > len(query):
+        return (FUZZY, end - start - len(query), len(key))
+    if key == query:
+        return (EXACT, 0, 0)
+    if start == 0:
+        return (PREFIX, 0, len(key))
+    return (SUBSTRING, start, len(key))
+
+
+def key_score(query, key, fuzzy=True):
+    """Returns the score of a lower case query matching one lower case key, None if it doesn't"""
+    start = key.find(query)
+    if start != -1:
+        return match_score(query, key, start, start + len(query))
+    match = fuzzy_pattern(query).search(key) if fuzzy and len(query) > 1 else None
+    return match_score(query, key, match.start(), match.end()) if match else None
+
+
+class FuzzyIndex(object):
+    """Ranks items by how well their key matches a query
+
+    Items are grouped by their lower case key. Prefix matches are looked up
+    in the keys sorted by length and then by key, the other keys are
+    searched as one newline separated string, so a query is a handful of
+    bisections and scans in C rather than a Python loop over every key.
+    """
+
+    def __init__(self, items=(), key=str):
+        self.key = key
+        self.groups = dict()
+        self.keys = list()
+        self.count = 0
+        self.text = None
+        self.offsets = None
+        self.lengths = None
+        self.by_length = None
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, item):
+        key = self.key(item).lower()
+        group = self.groups.get(key)
+        if group is None:
+            group = list()
+            self.groups[key] = group
+            self.keys.append(key)
+            self.text = None
+        group.append(item)
+        self.count += 1
+
+    def build(self):
+        self.text = "\n".join(self.keys) + "\n"
+        # Offset of every key in the text, and of the end of the text
+        self.offsets = list()
+        offset = 0
+        for key in self.keys:
+            self.offsets.append(offset)
+            offset += len(key) + 1
+        self.offsets.append(offset)
+        # Key length -> the sorted keys of that length
+        self.by_length = dict()
+        for key in self.keys:
+            self.by_length.setdefault(len(key), list()).append(key)
+        for keys in self.by_length.values():
+            keys.sort()
+        self.lengths = sorted(self.by_length)
+
+    def prefix_matches(self, query):
+        """Yields the keys starting with but longer than a query, shortest first"""
+        for length in self.lengths[bisect.bisect_right(self.lengths, len(query)):]:
+            keys = self.by_length[length]
+            i = bisect.bisect_left(keys, query)
+            while i < len(keys) and keys[i].startswith(query):
+                yield keys[i]
+                i += 1
+
+    def substring_matches(self, query):
+        """Returns (start, key) of the first occurrence of a query in every key that doesn't start with it"""
+        matches = list()
+        text, offsets = self.text, self.offsets
+        position = text.find(query)
+        while position != -1 and position < len(text):
+            index = bisect.bisect_right(offsets, position) - 1
+            if position != offsets[index]:
+                matches.append((position - offsets[index], self.keys[index]))
+            # Carry on with the next key
+            position = text.find(query, offsets[index + 1])
+        return matches
+
+    def fuzzy_matches(self, query):
+        """Returns (start, end, key) of the first fuzzy match of a query in every key not containing it"""
+        matches = list()
+        text, offsets = self.text, self.offsets
+        pattern = fuzzy_pattern(query)
+        match = pattern.search(text)
+        while match is not None:
+            index = bisect.bisect_right(offsets, match.start()) - 1
+            key = self.keys[index]
+            if query not in key:
+                matches.append((match.start() - offsets[index], match.end() - offsets[index], key))
+            match = pattern.search(text, offsets[index + 1])
+        return matches
+
+    def ranked(self, query, fuzzy=True):
+        """Yields (score, key) of the keys matching a query, best first
+
+        Each class of matches is only looked for once the better ones have
+        all been taken, so a caller wanting the best few stops early. Without
+        fuzzy only exact, prefix and substring matches are yielded, with
+        fuzzy="only" only the fuzzy ones.
+        """
+        query = query.lower()
+        if "\n" in query:
+            return
+        if self.text is None:
+            self.build()
+
+        if fuzzy != "only":
+            if query in self.groups:
+                yield (EXACT, 0, 0), query
+            for key in self.prefix_matches(query):
+                yield (PREFIX, 0, len(key)), key
+            if query:
+                for start, key in sorted(self.substring_matches(query), key=lambda m: (m[0], len(m[1]), m[1])):
+                    yield (SUBSTRING, start, len(key)), key
+        # A single character has no fuzzy matches that aren't substrings
+        if fuzzy and len(query) > 1:
+            scored = sorted((match_score(query, key, start, end), key) for start, end, key in self.fuzzy_matches(query))
+            for score, key in scored:
+                yield score, key
+
+    def search(self, query, fuzzy=True):
+        """Returns (score, items) pairs of the items of every matching key, best first"""
+        return [(score, self.groups[key]) for score, key in self.ranked(query, fuzzy)]
+
+
+def arg_keys(query_args):
+    """Returns the (position, key) pairs of the argument index a query's SaC argument types look up
+
+    * matches any argument and has no key, empty brackets match any array of
+    the base type, int[] matches int[.], int[5,5] and int[*]. Returns None if
+    a type isn't a SaC type.
+    """
+    keys = list()
+    for position, query_arg in enumerate(query_args):
+        query_arg = query_arg.strip()
+        if query_arg == "*":
+            continue
+        if query_arg.endswith("[]"):
+            base = saclib.sactype_to_c(query_arg[:-2])
+            key = base + "_" if base is not None else None
+        else:
+            key = saclib.sactype_to_c(query_arg)
+        if key is None:
+            return None
+        keys.append((position, key))
+    return keys
+
+
+def function_order(function):
+    return len(function.name), function.c_name
+
+
+class FunctionSearch(object):
+    """Search over the SaC functions of a SacSymbolIndex by namespace, name and argument types
+
+    Functions are indexed by their position in name order. Queries with
+    argument types look those up in an index of the functions' argument
+    types first, few enough functions are then scored one by one.
+    """
+
+    def __init__(self, symbols):
+        # Every function, shortest names first
+        self.functions = sorted(symbols, key=function_order)
+        self.names = FuzzyIndex(range(len(self.functions)), key=lambda i: self.functions[i].name)
+        # Lower case namespace -> its functions, shortest names first
+        self.namespaces = dict()
+        for symbol in self.functions:
+            self.namespaces.setdefault(symbol.namespace.lower(), list()).append(symbol)
+        self.namespace_index = FuzzyIndex(self.namespaces)
+        # Number of arguments -> positions of the functions taking them, and
+        # (number of arguments, argument, type code or array base type) -> positions, built when first needed
+        self.arities = None
+        self.arg_index = None
+        # Repeated queries, e.g. while narrowing a search down, are answered from a cache
+        self.search = functools.lru_cache(maxsize=256)(self.search_uncached)
+
+    def __len__(self):
+        return len(self.names)
+
+    def build_arg_index(self):
+        self.arities = dict()
+        self.arg_index = dict()
+        for i, function in enumerate(self.functions):
+            arity = len(function.args)
+            self.arities.setdefault(arity, list()).append(i)
+            for position, c_arg in enumerate(function.args):
+                self.arg_index.setdefault((arity, position, c_arg), list()).append(i)
+                # Arrays are also indexed by their base type, for the empty brackets of int[]
+                base, shape = saclib.C_TYPE_SHAPE.match(c_arg).groups()
+                if shape:
+                    self.arg_index.setdefault((arity, position, base + "_"), list()).append(i)
+
+    def arg_candidates(self, args):
+        """Returns the set of positions of the functions whose arguments match a query's argument types"""
+        if self.arg_index is None:
+            self.build_arg_index()
+        keys = arg_keys(args)
+        if keys is None:
+            return set()
+        lists = sorted((self.arg_index.get((len(args), position, key), ()) for position, key in keys), key=len)
+        if not lists:
+            return set(self.arities.get(len(args), ()))
+        candidates = set(lists[0])
+        for positions in lists[1:]:
+            candidates.intersection_update(positions)
+        return candidates
+
+    def search_uncached(self, query, limit=DEFAULT_LIMIT):
+        """Returns the number of functions matching a query such as Array::sel(int[.], *) and the best limit
+
+        The namespace and name are matched as substrings or fuzzily, a
+        namespace on its own (Array::) lists the functions in it. Fuzzy
+        matches are only looked for when there are fewer than limit others.
+        Names are ranked lazily and the search stops once more than limit
+        functions of the best namespace matched, the number is None then.
+        """
+        parsed = saclib.parse_sacblock(query) if query.strip() else ("", None)
+        if parsed is None:
+            raise ValueError("Invalid function query: %s" % query.strip())
+        symbol, args = parsed
+
+        namespace_scores = None
+        if "::" in symbol:
+            namespace, symbol = symbol.split("::", 1)
+            namespace_scores = {group[0]: score[:1] for score, group in self.namespace_index.search(namespace.strip())}
+        symbol = symbol.strip()
+
+        # Listing whole namespaces doesn't need any name matching
+        if not symbol and args is None:
+            if namespace_scores is None:
+                return len(self.functions), self.functions[:limit]
+            functions = [self.namespaces[key] for key in sorted(namespace_scores, key=namespace_scores.get)]
+            return sum(len(group) for group in functions), \
+                list(itertools.islice((f for group in functions for f in group), limit))
+
+        candidates = self.arg_candidates(args) if args is not None else None
+        if candidates is not None and len(candidates) <= DIRECT_SCORE_LIMIT:
+            total, results = self.score_candidates(symbol.lower(), candidates, namespace_scores, limit)
+        else:
+            total, results = self.rank_names(symbol, candidates, namespace_scores, limit)
+        return total, [self.functions[i] for i in results]
+
+    def score_candidates(self, query, candidates, namespace_scores, limit):
+        """Scores the names of a few functions one by one, returns their number and the best limit"""
+        rows = list()
+        for i in candidates:
+            function = self.functions[i]
+            namespace_score = ()
+            if namespace_scores is not None:
+                namespace_score = namespace_scores.get(function.namespace.lower())
+                if namespace_score is None:
+                    continue
+            key = function.name.lower()
+            score = key_score(query, key)
+            if score is not None:
+                rows.append((namespace_score, score, key, i))
+        if sum(1 for row in rows if row[1][0] != FUZZY) >= limit:
+            rows = [row for row in rows if row[1][0] != FUZZY]
+        rows.sort()
+        return len(rows), [row[3] for row in rows[:limit]]
+
+    def rank_names(self, query, candidates, namespace_scores, limit):
+        """Walks the matching names best first, returns the number of matches and the best limit
+
+        Matches are kept apart by how well their namespace matched. The walk
+        stops once the best namespace has more than limit of them, as no
+        later name can rank before those.
+        """
+        if namespace_scores is not None and not namespace_scores:
+            return 0, list()
+        best = min(namespace_scores.values()) if namespace_scores is not None else ()
+        matches = dict()
+        total = 0
+        complete = True
+        for score, key in self.names.ranked(query):
+            if score[0] == FUZZY and total >= limit:
+                break
+            for i in self.names.groups[key]:
+                if candidates is not None and i not in candidates:
+                    continue
+                namespace_score = ()
+                if namespace_scores is not None:
+                    namespace_score = namespace_scores.get(self.functions[i].namespace.lower())
+                    if namespace_score is None:
+                        continue
+                matches.setdefault(namespace_score, list()).append(i)
+                total += 1
+            if len(matches.get(best, ())) > limit:
+                complete = False
+                break
+        results = list(itertools.islice((i for score in sorted(matches) for i in matches[score]), limit))
+        return total if complete else None, results
+
+
+def variable_rows(frame_vars):
+    """Returns a (SaC name, SSA version, C name) row for every version of every variable of a SacVariableFrame"""
+    return [(base, i, c_name) for base, versions in frame_vars.versions.items()
+            for i, (key, c_name) in enumerate(versions)]
+
+
+def search_variables(frame_vars, query):
+    """Returns the variable rows matching a query such as x or x@1, best first
+
+    The SSA version counts from 0 for the first assignment, negative ones from the newest.
+    """
+    match = VARIABLE_QUERY.match(query)
+    if match is None:
+        raise ValueError("Invalid variable query: %s" % query.strip())
+    name, version = match.group(1), match.group(2)
+
+    rows = variable_rows(frame_vars)
+    counts = collections.Counter(row[0] for row in rows)
+    results = list()
+    for score, group in FuzzyIndex(rows, key=lambda row: row[0]).search(name):
+        for row in group:
+            if version is not None:
+                wanted = int(version)
+                if wanted < 0:
+                    wanted += counts[row[0]]
+                if row[1] != wanted:
+                    continue
+            results.append(row)
+    return results
+
+
+def parse_info_args(argv):
+    """Parses the options of sacinfo into a dict"""
+    options = {"command": argv[0] if argv else None, "limit": DEFAULT_LIMIT, "query": "",
+               "json": False, "file": None, "clear": False}
+    if options["command"] not in ("functions", "variables", "stats"):
+        raise ValueError("Usage: sacinfo functions|variables [--limit N] [PATTERN] | "
+                         "sacinfo stats [--json [FILE]] [--clear]")
+
+    query = list()
+    i = 1
+    while i < len(argv):
+        if argv[i] == "--limit" and options["command"] != "stats":
+            if i + 1 >= len(argv) or not argv[i + 1].isdigit() or not int(argv[i + 1]):
+                raise ValueError("Option --limit requires a positive number")
+            options["limit"] = int(argv[i + 1])
+            i += 2
+        elif argv[i] == "--json" and options["command"] == "stats":
+            options["json"] = True
+            if i + 1 < len(argv) and not argv[i + 1].startswith("-"):
+                options["file"] = argv[i + 1]
+                i += 1
+            i += 1
+        elif argv[i] == "--clear" and options["command"] == "stats":
+            options["clear"] = True
+            i += 1
+        elif options["command"] != "stats":
+            query.append(argv[i])
+            i += 1
+        else:
+            raise ValueError("Unknown argument: %s" % argv[i])
+    options["query"] = " ".join(query)
+    return options
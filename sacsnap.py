@@ -0,0 +1,240 @@
+import hashlib
+
+import sacarray
+
+# Bytes of array data hashed together, a 1 GB array has 16384 chunk hashes
+SNAPSHOT_CHUNK_BYTES = 1 << 16
+# Elements compared in one go when narrowing a changed chunk down to its elements
+COMPARE_ELEMENTS = 256
+# Changed ranges printed by sac diff by default
+DEFAULT_DIFF_RANGES = 20
+
+
+def chunk_hash(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def snapshot_chunk_elements(itemsize):
+    """Returns the number of elements of a size hashed together"""
+    return max(1, SNAPSHOT_CHUNK_BYTES // itemsize)
+
+
+class ArraySnapshot(object):
+    """The contents of a SaC array at one point as hashes of fixed size chunks of its data
+
+    The raw chunks are only kept when asked for, they are needed to tell
+    which elements of a changed chunk changed. The variable, e.g. x or x@3,
+    is the one the snapshot was taken of.
+    """
+
+    def __init__(self, shape, fmt, itemsize, hashes, chunks=None, variable=None):
+        self.variable = variable
+        self.shape = tuple(shape)
+        self.format = fmt
+        self.itemsize = itemsize
+        self.chunk_elements = snapshot_chunk_elements(itemsize)
+        self.hashes = hashes
+        self.chunks = chunks
+
+    @classmethod
+    def take(cls, shape, buffer, keep=False, variable=None):
+        """Snapshots the array in a ChunkedBuffer, reading it one chunk at a time"""
+        live = LiveArray(shape, buffer)
+        hashes = list()
+        chunks = list() if keep else None
+        for i in range(live.chunk_count()):
+            data = live.raw(i)
+            hashes.append(chunk_hash(data))
+            if keep:
+                chunks.append(data)
+        return cls(shape, buffer.format, buffer.itemsize, hashes, chunks, variable)
+
+    def chunk_count(self):
+        return len(self.hashes)
+
+    def hash(self, index):
+        return self.hashes[index]
+
+    def raw(self, index):
+        return self.chunks[index] if self.chunks is not None else None
+
+    def nbytes(self):
+        """Returns the memory taken by the hashes and kept chunks"""
+        return sum(len(h) for h in self.hashes) + sum(len(c) for c in self.chunks or ())
+
+
+class LiveArray(object):
+    """An array still in the inferior, read and hashed in the same chunks as a snapshot"""
+
+    def __init__(self, shape, buffer):
+        self.shape = tuple(shape)
+        self.format = buffer.format
+        self.itemsize = buffer.itemsize
+        self.chunk_elements = snapshot_chunk_elements(buffer.itemsize)
+        self.buffer = buffer
+        # The last chunk read, a diff asks for its hash and contents in turn
+        self.last = (None, None)
+
+    def chunk_count(self):
+        return (len(self.buffer) + self.chunk_elements - 1) // self.chunk_elements
+
+    def raw(self, index):
+        if self.last[0] != index:
+            start = index * self.chunk_elements
+            stop = min(start + self.chunk_elements, len(self.buffer))
+            self.last = (index, bytes(self.buffer.read(start * self.itemsize, (stop - start) * self.itemsize)))
+        return self.last[1]
+
+    def hash(self, index):
+        return chunk_hash(self.raw(index))
+
+
+class ArrayDiff(object):
+    """The flat index ranges in which two arrays differ
+
+    Ranges are whole chunks unless exact, when both sides' contents were
+    there to compare element by element.
+    """
+
+    def __init__(self, shape, ranges, exact, chunks_changed, chunk_count):
+        self.shape = shape
+        self.ranges = ranges
+        self.exact = exact
+        self.chunks_changed = chunks_changed
+        self.chunk_count = chunk_count
+
+    def changed(self):
+        return sum(stop - start for start, stop in self.ranges)
+
+
+def add_range(ranges, start, stop):
+    """Appends a flat index range, merging it with the last one if they touch"""
+    if ranges and ranges[-1][1] == start:
+        ranges[-1] = (ranges[-1][0], stop)
+    else:
+        ranges.append((start, stop))
+
+
+def changed_elements(old, new, itemsize, ranges, base):
+    """Adds the ranges of elements that differ between two equally long byte strings to ranges"""
+    block = COMPARE_ELEMENTS * itemsize
+    for start in range(0, len(new), block):
+        if old[start:start + block] == new[start:start + block]:
+            continue
+        for offset in range(start, min(start + block, len(new)), itemsize):
+            if old[offset:offset + itemsize] != new[offset:offset + itemsize]:
+                add_range(ranges, base + offset // itemsize, base + offset // itemsize + 1)
+
+
+def diff_arrays(old, new):
+    """Returns the ArrayDiff of two ArraySnapshots or LiveArrays of the same shape and type
+
+    Chunks are compared by their contents when both sides have them, by
+    their hashes otherwise, so two snapshots without contents are compared
+    without reading anything and only changed chunks are compared element
+    by element.
+    """
+    if old.shape != new.shape:
+        raise ValueError("Shapes differ: %s and %s" % (format_shape(old.shape), format_shape(new.shape)))
+    if old.format != new.format:
+        raise ValueError("Element types differ: %s and %s" % (old.format, new.format))
+
+    ranges = list()
+    exact = True
+    chunks_changed = 0
+    for i in range(new.chunk_count()):
+        old_data = old.raw(i)
+        new_data = new.raw(i) if old_data is not None else None
+        if new_data is not None:
+            if old_data == new_data:
+                continue
+            chunks_changed += 1
+            changed_elements(old_data, new_data, new.itemsize, ranges, i * new.chunk_elements)
+        elif old.hash(i) != new.hash(i):
+            chunks_changed += 1
+            exact = False
+            start = i * new.chunk_elements
+            add_range(ranges, start, min(start + new.chunk_elements, array_size(new.shape)))
+    return ArrayDiff(new.shape, ranges, exact, chunks_changed, new.chunk_count())
+
+
+def array_size(shape):
+    size = 1
+    for extent in shape:
+        size *= extent
+    return size
+
+
+def format_shape(shape):
+    return "[%s]" % ", ".join(str(extent) for extent in shape)
+
+
+def index_of(flat, shape):
+    """Returns the index in an array of a shape of the element at a flat offset"""
+    index = list()
+    for stride in sacarray.strides(shape):
+        i, flat = divmod(flat, stride)
+        index.append(i)
+    return index
+
+
+def format_diff(diff, limit=DEFAULT_DIFF_RANGES):
+    """Formats the changed ranges of a diff as inclusive SaC indexes, at most limit of them"""
+    if not diff.ranges:
+        return ["No elements changed"]
+    lines = ["%d of %d elements changed in %d ranges, %d of %d chunks differ" % (
+        diff.changed(), array_size(diff.shape), len(diff.ranges), diff.chunks_changed, diff.chunk_count)]
+    for start, stop in diff.ranges[:limit]:
+        first = format_shape(index_of(start, diff.shape))
+        last = format_shape(index_of(stop - 1, diff.shape))
+        lines.append("  " + first if stop - start == 1 else "  %s .. %s" % (first, last))
+    if len(diff.ranges) > limit:
+        lines.append("  ... %d more ranges" % (len(diff.ranges) - limit))
+    if not diff.exact:
+        lines.append("Ranges are whole chunks, snapshot with --keep to compare elements")
+    return lines
+
+
+def parse_snapshot_args(argv):
+    """Parses the options of sac snapshot into a dict"""
+    options = {"variable": None, "keep": False, "name": None}
+    i = 0
+    while i < len(argv):
+        if argv[i] == "--keep":
+            options["keep"] = True
+            i += 1
+        elif argv[i] == "--name":
+            if i + 1 >= len(argv):
+                raise ValueError("Option --name requires a name")
+            options["name"] = argv[i + 1]
+            i += 2
+        elif options["variable"] is None and not argv[i].startswith("-"):
+            options["variable"] = argv[i]
+            i += 1
+        else:
+            raise ValueError("Unknown argument: %s" % argv[i])
+    if options["variable"] is None:
+        raise ValueError("Usage: sac snapshot VARIABLE [--keep] [--name NAME]")
+    if options["name"] is None:
+        options["name"] = options["variable"]
+    return options
+
+
+def parse_diff_args(argv):
+    """Parses the options of sac diff into a dict"""
+    options = {"operands": list(), "limit": DEFAULT_DIFF_RANGES}
+    i = 0
+    while i < len(argv):
+        if argv[i] == "--limit":
+            if i + 1 >= len(argv) or not argv[i + 1].isdigit() or not int(argv[i + 1]):
+                raise ValueError("Option --limit requires a positive number")
+            options["limit"] = int(argv[i + 1])
+            i += 2
+        elif len(options["operands"]) < 2 and not argv[i].startswith("-"):
+            options["operands"].append(argv[i])
+            i += 1
+        else:
+            raise ValueError("Unknown argument: %s" % argv[i])
+    if not options["operands"]:
+        raise ValueError("Usage: sac diff SNAPSHOT|VARIABLE [SNAPSHOT|VARIABLE] [--limit N]")
+    return options
@@ -0,0 +1,92 @@
+import collections
+import time
+
+# Histogram bucket i counts durations under 2**i microseconds, the last one everything longer
+HISTOGRAM_BUCKETS = 24
+
+
+class Histogram(object):
+    """Durations in power of two microsecond buckets, with their count, total and maximum"""
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        microseconds = int(seconds * 1e6)
+        self.buckets[min(microseconds.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """Returns an upper bound in seconds of the given fraction of the durations"""
+        wanted = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                return min((1 << i) * 1e-6, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {"count": self.count, "total": self.total, "max": self.max,
+                "p50": self.percentile(0.5), "p99": self.percentile(0.99),
+                "buckets": dict(("<%dus" % (1 << i), count) for i, count in enumerate(self.buckets) if count)}
+
+
+class Stats(object):
+    """Counters and duration histograms of the work sacdebug does itself
+
+    Timings are taken by the caller with the stats' clock:
+
+        start = stats.clock()
+        ...
+        stats.observe("name", stats.clock() - start)
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.counters = collections.Counter()
+        self.timings = collections.defaultdict(Histogram)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def observe(self, name, seconds):
+        self.timings[name].add(seconds)
+
+    def as_dict(self, sizes=None):
+        """Returns the counters, timings and the given live map sizes as plain, JSON ready data"""
+        return {"counters": dict(self.counters),
+                "timings": dict((name, histogram.as_dict()) for name, histogram in self.timings.items()),
+                "sizes": dict(sizes or ())}
+
+    def clear(self):
+        self.counters.clear()
+        self.timings.clear()
+
+
+def format_stats(data):
+    """Formats the data returned by Stats.as_dict as aligned tables"""
+    lines = list()
+    if data["counters"]:
+        lines.append("%-36s %10s" % ("counter", "count"))
+        for name in sorted(data["counters"]):
+            lines.append("%-36s %10d" % (name, data["counters"][name]))
+    if data["timings"]:
+        lines.append("%-36s %10s %12s %12s %12s %12s" % ("timing", "count", "total ms", "p50 us", "p99 us", "max us"))
+        for name in sorted(data["timings"]):
+            timing = data["timings"][name]
+            lines.append("%-36s %10d %12.3f %12.1f %12.1f %12.1f" % (
+                name, timing["count"], timing["total"] * 1e3, timing["p50"] * 1e6, timing["p99"] * 1e6,
+                timing["max"] * 1e6))
+    if data["sizes"]:
+        lines.append("%-36s %10s" % ("map", "entries"))
+        for name in sorted(data["sizes"]):
+            lines.append("%-36s %10d" % (name, data["sizes"][name]))
+    return lines or ["No statistics recorded"]
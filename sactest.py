@@ -1,6 +1,60 @@
-import saclib
+import array
+import contextlib
+import importlib
+import io
+import json
+import math
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
 import unittest
 
+import fakegdb
+import sacarray
+import saccond
+import saccore
+import saceval
+import sachistory
+import sacindex
+import saclib
+import sacprof
+import sacsearch
+import sacsnap
+import sacstats
+import sactrace
+import sacwatch
+
+
+def build_elf(symbols, build_id=None):
+    """Builds a minimal 64 bit little endian ELF image from (name, type, defined) symbols"""
+    shstrtab = b"\0.text\0.strtab\0.symtab\0.note.gnu.build-id\0.shstrtab\0"
+    strtab = b"\0"
+    symtab = b"\0" * 24
+    for name, sym_type, defined in symbols:
+        symtab += struct.pack("<IBBHQQ", len(strtab), (1 << 4) | sym_type, 0, 1 if defined else 0, 0, 0)
+        strtab += name.encode("ascii") + b"\0"
+
+    note = b""
+    if build_id:
+        desc = bytes.fromhex(build_id)
+        note = struct.pack("<III", 4, len(desc), 3) + b"GNU\0" + desc
+
+    # Lay the section contents out directly after the ELF header
+    contents = [(1, 1, b"\0" * 16, 0, 0), (7, 3, strtab, 0, 0), (15, 2, symtab, 2, 24),
+                (23, 7, note, 0, 0), (42, 3, shstrtab, 0, 0)]
+    body = b""
+    headers = b"\0" * 64
+    for name, sec_type, data, link, entsize in contents:
+        headers += struct.pack("<IIQQQQIIQQ", name, sec_type, 0, 0, 64 + len(body), len(data), link, 0, 1, entsize)
+        body += data
+
+    header = b"\x7fELF" + bytes([2, 1, 1]) + b"\0" * 9
+    header += struct.pack("<HHIQQQIHHHHHH", 2, 62, 1, 0, 0, 64 + len(body), 0, 64, 0, 0, 64, len(contents) + 1, 5)
+    return header + body + headers
+
 
 class TestUtilityFunctions(unittest.TestCase):
     def setUp(self):
@@ -12,9 +66,551 @@ class TestUtilityFunctions(unittest.TestCase):
         self.assertEqual(result_arr, [0, 5, 10])
 
 
-class TestStackFrames(unittest.TestCase):
+def load_sacdebug():
+    """Imports a fresh sacdebug against a reset fake gdb"""
+    fakegdb.install()
+    fakegdb.reset()
+    if "sacdebug" in sys.modules:
+        return importlib.reload(sys.modules["sacdebug"])
+    return importlib.import_module("sacdebug")
+
+
+def build_core(segments):
+    """Builds a minimal 64 bit little endian ELF core file from (address, contents, memory size) segments"""
+    headers = b""
+    body = b""
+    offset = 64 + 56 * len(segments)
+    for address, contents, size in segments:
+        headers += struct.pack("<IIQQQQQQ", 1, 4, offset + len(body), address, 0, len(contents), size, 1)
+        body += contents
+
+    header = b"\x7fELF" + bytes([2, 1, 1]) + b"\0" * 9
+    header += struct.pack("<HHIQQQIHHHHHH", 4, 62, 1, 0, 64, 0, 0, 64, 56, len(segments), 64, 0, 0)
+    return header + headers + body
+
+
+class SacdebugTestCase(unittest.TestCase):
+    """Runs sacdebug against a fresh fake gdb with one SaC function armed, capturing what commands write"""
+
     def setUp(self):
-        pass
+        self.sacdebug = load_sacdebug()
+        self.program = fakegdb.program
+        self.func = "SACf__MAIN__foo__i"
+        self.sacdebug.symbol_index.add(self.func)
+        self.sacdebug.arm_function(self.func)
+        # Commands write their output to stdout
+        self.output = io.StringIO()
+        redirect = contextlib.redirect_stdout(self.output)
+        redirect.__enter__()
+        self.addCleanup(redirect.__exit__, None, None, None)
+
+
+class TestStackFrames(SacdebugTestCase):
+    def test_push_pop(self):
+        state = self.sacdebug.thread_state()
+        self.program.call(self.func, {"SACl_x": 1})
+        self.assertEqual(len(state.variable_stack), 1)
+        self.assertIn(self.func, state.active_funcs)
+
+        self.program.ret()
+        self.assertEqual(state.variable_stack, [])
+        self.assertNotIn(self.func, state.active_funcs)
+        self.assertEqual(self.sacdebug.sac_return_bps, {})
+
+    def test_recursion(self):
+        state = self.sacdebug.thread_state()
+        for i in range(20):
+            self.program.call(self.func, {"SACl_x": i})
+        # Only the outermost call stops
+        self.assertEqual(self.program.stops, 1)
+        self.assertEqual(len(state.variable_stack), 1)
+        for i in range(20):
+            self.program.ret()
+        self.assertEqual(state.variable_stack, [])
+        self.assertEqual(self.program.stops, 2)
+
+    def test_threads(self):
+        gdb = fakegdb.install()
+        main = self.program.thread
+        workers = [self.program.add_thread() for i in range(64)]
+        # Every worker enters the function before any of them returns
+        for i, worker in enumerate(workers):
+            worker.switch()
+            self.program.call(self.func, {"SACl_x": 1, "SACp_emal_%d_x__SSA0_1" % i: 2})
+        self.assertEqual(self.program.stops, 64)
+
+        workers[5].switch()
+        gdb.execute("sac print *sac(x)")
+        self.assertEqual(self.program.executed[-1], "print SACp_emal_5_x__SSA0_1")
+
+        for worker in reversed(workers[1:]):
+            worker.switch()
+            self.program.ret()
+        self.assertEqual([len(self.sacdebug.thread_state(t.ptid).variable_stack) for t in workers[:2]], [1, 0])
+        self.assertEqual(self.sacdebug.thread_state(main.ptid).variable_stack, [])
+        self.assertEqual(len(self.sacdebug.sac_return_bps), 1)
+
+    def test_thread_watch_ssa(self):
+        self.sacdebug.sac_watch_ssa = True
+        self.program.call(self.func, {"SACp_emal_1_x__SSA0_1": 0})
+        worker = self.program.add_thread()
+        worker.switch()
+        self.program.call(self.func, {"SACp_emal_1_x__SSA0_1": 0})
+
+        self.program.assign("SACp_emal_1_x__SSA0_1", 1)
+        self.assertEqual(len(self.sacdebug.thread_state().variable_stack[0]), 1)
+        self.program.ret()
+        # The main thread's watch survives the worker's return
+        self.assertEqual(list(self.sacdebug.sac_var_bps.values()), ["SACp_emal_1_x__SSA0_1"])
+        self.assertEqual(len(self.sacdebug.thread_state(self.program.inferior.thread_list[0].ptid).variable_stack[0]),
+                         0)
+
+    def test_repeated_calls(self):
+        state = self.sacdebug.thread_state()
+        for i in range(20):
+            self.program.call(self.func, {"SACl_x": i})
+            self.assertEqual(len(state.variable_stack), 1)
+            self.program.ret()
+        self.assertEqual(state.variable_stack, [])
+        self.assertEqual(self.program.stops, 40)
+
+    def test_watch_ssa(self):
+        self.sacdebug.sac_watch_ssa = True
+        self.program.call(self.func, {"SACl_x": 1, "SACp_emal_1_x__SSA0_1": 0})
+        self.assertEqual(sorted(self.sacdebug.sac_var_bps.values()), ["SACl_x", "SACp_emal_1_x__SSA0_1"])
+
+        self.program.assign("SACp_emal_1_x__SSA0_1", 5)
+        self.assertEqual(self.sacdebug.thread_state().variable_stack[-1].lookup("x"), "SACp_emal_1_x__SSA0_1")
+        self.assertEqual(list(self.sacdebug.sac_var_bps.values()), ["SACl_x"])
+
+        self.program.ret()
+        self.assertEqual(self.sacdebug.sac_var_bps, {})
+        self.assertEqual(len(self.sacdebug.watch_scheduler), 0)
+
+    def test_software_watchpoints(self):
+        gdb = fakegdb.install()
+        self.sacdebug.sac_watch_specs[("user", "a")] = "*(long *) 4096"
+        self.sacdebug.sac_watch_specs[("user", "b")] = "*(long *) 4104"
+        self.sacdebug.create_watchpoint(("user", "a"), False)
+        self.assertEqual(self.sacdebug.sac_watch_bps[("user", "a")].type, gdb.BP_WATCHPOINT)
+        self.assertEqual(gdb.parameter("can-use-hw-watchpoints"), 1)
+
+        # A user who turned hardware watchpoints off keeps them off
+        gdb.execute("set can-use-hw-watchpoints 0")
+        self.sacdebug.create_watchpoint(("user", "b"), False)
+        self.assertEqual(gdb.parameter("can-use-hw-watchpoints"), 0)
+        self.assertEqual(self.program.executed[-1], "set can-use-hw-watchpoints 0")
+
+    def test_execution_state(self):
+        gdb = fakegdb.install()
+        gdb.execute("sac step")
+        self.assertEqual(self.sacdebug.execution_state, 1)
+        gdb.execute("sac continue")
+        self.assertEqual((self.sacdebug.old_execution_state, self.sacdebug.execution_state), (1, 2))
+
+        self.program.call(self.func, {"SACl_x": 1})
+        self.assertEqual(self.program.executed[-1], "continue 0")
+
+    def test_execution_state_threads(self):
+        gdb = fakegdb.install()
+        worker = self.program.add_thread()
+        gdb.execute("sac step")
+        # In all-stop mode the step resumes every thread, the next stop may be another's
+        worker.switch()
+        self.program.call(self.func, {"SACl_x": 1})
+        self.assertEqual(self.program.executed[-1], "step 0")
+        self.assertEqual(len(self.sacdebug.thread_state(worker.ptid).variable_stack), 1)
+        self.assertEqual(len(self.sacdebug.thread_state(self.program.inferior.thread_list[0].ptid).variable_stack), 0)
+
+    def test_lazy_arming(self):
+        gdb = fakegdb.install()
+        func = "SACf__MAIN__bar__i"
+        self.sacdebug.symbol_index.add(func)
+        self.program.call(func, {"SACl_x": 1})
+        # Arming only pays off when its SSA writes are watched
+        gdb.execute("sac print *sac(x)")
+        gdb.execute("sac batch print *sac(x)")
+        self.assertNotIn(func, self.sacdebug.sac_armed_funcs)
+        self.sacdebug.sac_watch_ssa = True
+        gdb.execute("sac print *sac(x)")
+        self.assertIn(func, self.sacdebug.sac_armed_funcs)
+
+    def test_sac_command(self):
+        gdb = fakegdb.install()
+        self.program.call(self.func, {"SACl_x": 1, "SACp_emal_2_x__SSA0_1": 7})
+        gdb.execute("sac print *sac(x)")
+        self.assertEqual(self.program.executed[-1], "print SACp_emal_2_x__SSA0_1")
+
+
+class TestSactraceCommand(SacdebugTestCase):
+    def test_sactrace(self):
+        gdb = fakegdb.install()
+        self.sacdebug.symbol_index.add("SACf__MAIN__main")
+        self.sacdebug.symbol_index.add("SACf__MAIN__bar__i")
+        gdb.execute("sactrace start bar")
+        self.assertEqual(len(self.sacdebug.sac_trace_bps), 1)
+
+        self.program.call("SACf__MAIN__main", pc=0x100)
+        for i in range(10):
+            self.program.call("SACf__MAIN__bar__i", pc=0x200)
+        for i in range(10):
+            self.program.ret()
+
+        # Only the first call from each call site stops, to place its return breakpoint
+        self.assertEqual(self.program.stops, 2)
+        self.assertEqual(sorted(self.sacdebug.sac_trace_return_bps), [0x100, 0x200])
+        self.assertEqual(self.sacdebug.sac_return_bps, {})
+
+        gdb.execute("sactrace report")
+        self.assertIn("10", self.output.getvalue())
+        self.assertIn("MAIN::bar(int)", self.output.getvalue())
+        gdb.execute("sactrace stop")
+        self.assertEqual(list(self.program.breakpoints.values())[0].location, self.func)
+
+
+class TestSacprofCommand(SacdebugTestCase):
+    def test_sacprof(self):
+        gdb = fakegdb.install()
+        self.sacdebug.interrupt_inferior = lambda pid: None
+        self.program.call("SACf__MAIN__main", pc=0x100)
+        worker = self.program.add_thread()
+        worker.stack.append(gdb.Frame("start_thread"))
+        # Every continue runs into the next sampling interrupt
+        self.program.execute_handlers["continue"] = lambda command: self.program.interrupt()
+
+        gdb.execute("sacprof start --samples 3 --sac-only")
+        self.assertEqual(self.sacdebug.profile_trie.samples, 6)
+        self.assertEqual(list(self.sacdebug.profile_trie.collapsed()), ["MAIN::main() 3"])
+
+        # A breakpoint stop ends the profile
+        def breakpoint_hit(command):
+            del self.program.execute_handlers["continue"]
+            self.program.call(self.func)
+        self.program.execute_handlers["continue"] = breakpoint_hit
+        gdb.execute("sacprof start")
+        self.assertEqual(self.sacdebug.profile_trie.samples, 6)
+        self.assertIn("Collected 0 samples, 6 in total", self.output.getvalue())
+
+
+class TestSacBreakCommand(SacdebugTestCase):
+    def test_conditional_break(self):
+        gdb = fakegdb.install()
+        gdb.execute("sac break bar(int[.]) if x > 100 && shape(a)[0] == 3")
+        self.assertIn("Breakpoint 1 at MAIN::bar(int[.]) if x > 100", self.output.getvalue())
+
+        data = self.program.allocate_array("q", [1, 2, 3])
+        pointer = gdb.Value(data, gdb.lookup_type("long").pointer())
+        for x in (5, 500):
+            self.program.call("SACf__MAIN__bar__i_P", {"SACl_x": x, "SACl_a": pointer, "SACl_a__dim": 1,
+                                                       "SACl_a__shp0": 3})
+        self.assertEqual(self.program.stops, 1)
+        self.assertEqual(self.program.breakpoints[1].hit_count, 2)
+
+        self.sacdebug.symbol_index.add("SACf__MAIN__bar__i_P")
+        gdb.execute("sac break bar if a[3] == 1")
+        self.program.call("SACf__MAIN__bar__i_P", {"SACl_a": pointer, "SACl_a__dim": 1, "SACl_a__shp0": 3})
+        self.assertIn("Error in condition of breakpoint", self.output.getvalue())
+        self.assertEqual(self.program.stops, 2)
+
+
+class TestSacinfoSession(SacdebugTestCase):
+    def test_sacinfo(self):
+        gdb = fakegdb.install()
+        self.sacdebug.symbol_index.add("SACf__MAIN__foobar__d")
+        gdb.execute("sacinfo functions fo")
+        self.assertIn("MAIN::foo(int)        SACf__MAIN__foo__i\nMAIN::foobar(double)  SACf__MAIN__foobar__d\n"
+                      "Showing 2 of 2 matches", self.output.getvalue())
+
+        self.program.call(self.func, ["SACl_x", "SACl_x__SSA0_1", "SACl_y"])
+        gdb.execute("sacinfo variables x@-1")
+        self.assertIn("x@1  SACl_x__SSA0_1\nShowing 1 of 1 matches", self.output.getvalue())
+        self.assertRaises(gdb.GdbError, gdb.execute, "sacinfo types")
+
+    def test_sacinfo_stats(self):
+        gdb = fakegdb.install()
+        for i in range(3):
+            self.program.call(self.func, {"SACl_x": i})
+            self.program.ret()
+        gdb.execute("sacinfo stats --json --clear")
+        data = json.loads(self.output.getvalue())
+        self.assertEqual(data["counters"]["stops"], 6)
+        self.assertEqual(data["counters"]["finish_breakpoints_created"], 3)
+        self.assertEqual(data["counters"]["finish_breakpoints_deleted"], 3)
+        self.assertEqual(data["timings"]["breakpoint_handle"]["count"], 6)
+        self.assertEqual(data["sizes"]["sac_return_bps"], 0)
+        self.assertEqual(self.sacdebug.stats.counters, {})
+
+        # Nothing is written on stops until the verbosity is raised
+        self.program.call(self.func, {"SACl_x": 1})
+        self.assertNotIn("Breakpoints hit", self.output.getvalue())
+        gdb.execute("set sac-verbose 2")
+        self.program.ret()
+        self.assertIn("Breakpoints hit: ", self.output.getvalue())
+        self.assertIn("Variable stack: []", self.output.getvalue())
+        self.assertRaises(gdb.error, gdb.execute, "set sac-verbose -1")
+
+        gdb.execute("sacinfo stats")
+        self.assertIn("breakpoint_handle", self.output.getvalue())
+
+
+class TestObjfileLoading(SacdebugTestCase):
+    def test_objfile_loading(self):
+        gdb = fakegdb.install()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        os.environ["SACDEBUG_CACHE"] = os.path.join(directory, "cache")
+        self.addCleanup(os.environ.pop, "SACDEBUG_CACHE")
+        library = os.path.join(directory, "libArrayMod.so")
+        with open(library, "wb") as f:
+            f.write(build_elf([("SACf__ARRAY__sel__i_P__i_P", 2, True), ("SACf__MAIN__foo__d", 2, True)], "cafe"))
+
+        self.sacdebug.sac_scope_only = ["MAIN::*"]
+        gdb.execute("sac break sel if iv > 0")
+        self.assertIn("No SaC function matches sel yet", self.output.getvalue())
+
+        # The library is indexed off GDB's thread, breakpoints are placed once it's merged
+        self.program.load_objfile(library, "cafe")
+        self.sacdebug.indexer.wait()
+        self.assertIn("SACf__ARRAY__sel__i_P__i_P", self.sacdebug.symbol_index)
+        self.assertIn("Breakpoint 1 at ARRAY::sel(int[.], int[.]) if iv > 0", self.output.getvalue())
+        self.assertIn("SACf__MAIN__foo__d", self.sacdebug.sac_armed_funcs)
+        self.assertNotIn("SACf__ARRAY__sel__i_P__i_P", self.sacdebug.sac_armed_funcs)
+
+        # Reloading the library doesn't place the breakpoint twice
+        self.program.clear_objfiles()
+        self.assertEqual(len(self.sacdebug.symbol_index), 0)
+        self.program.load_objfile(library, "cafe")
+        self.sacdebug.indexer.wait()
+        self.assertEqual(len(self.sacdebug.symbol_index), 2)
+        self.assertNotIn("Breakpoint 2", self.output.getvalue())
+
+    def test_sacinit_before_indexer(self):
+        gdb = fakegdb.install()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        os.environ["SACDEBUG_CACHE"] = os.path.join(directory, "cache")
+        self.addCleanup(os.environ.pop, "SACDEBUG_CACHE")
+        library = os.path.join(directory, "libArrayMod.so")
+        with open(library, "wb") as f:
+            f.write(build_elf([("SACf__ARRAY__sel__i_P__i_P", 2, True), ("SACf__ARRAY__drop__i", 2, True)], "cafe"))
+
+        gdb.execute("sac break sel")
+        # Hold the indexer's result back until sacinit has indexed the library itself
+        posted = list()
+        self.sacdebug.indexer.post = posted.append
+        self.program.load_objfile(library, "cafe")
+        self.sacdebug.indexer.wait()
+        gdb.execute("sacinit --only ARRAY::drop")
+        for callback in posted:
+            callback()
+        self.assertIn("Breakpoint 1 at ARRAY::sel(int[.], int[.])", self.output.getvalue())
+        self.assertIn("SACf__ARRAY__drop__i", self.sacdebug.sac_armed_funcs)
+        self.assertIn("armed 1 breakpoints", self.output.getvalue())
+        self.assertEqual(self.output.getvalue().count("Breakpoint 1 at"), 1)
+
+    def test_unreadable_objfiles(self):
+        gdb = fakegdb.install()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        os.environ["SACDEBUG_CACHE"] = os.path.join(directory, "cache")
+        self.addCleanup(os.environ.pop, "SACDEBUG_CACHE")
+        library = os.path.join(directory, "libArrayMod.so")
+        with open(library, "wb") as f:
+            f.write(build_elf([("SACf__ARRAY__sel__i_P__i_P", 2, True)], "cafe"))
+        broken = os.path.join(directory, "libBroken.so")
+        with open(broken, "wb") as f:
+            f.write(b"not an ELF file")
+        self.program.execute_handlers["info"] = lambda command: "File lib.c:\n1:\tint SACf__MAIN__bar__i(int);\n"
+
+        # The vDSO isn't a file, it is skipped rather than asking GDB for every function
+        self.program.load_objfile("system-supplied DSO at 0x7ffd3a1f2000")
+        self.program.load_objfile(library, "cafe")
+        self.sacdebug.indexer.wait()
+        self.sacdebug.sac_functions()
+        self.assertIn("SACf__ARRAY__sel__i_P__i_P", self.sacdebug.symbol_index)
+        self.assertNotIn("info functions ^SACf__", self.program.executed)
+
+        # A file that isn't ELF is left to GDB
+        self.program.load_objfile(broken)
+        self.sacdebug.indexer.wait()
+        self.assertIn("info functions ^SACf__", self.program.executed)
+        self.assertIn("SACf__MAIN__bar__i", self.sacdebug.symbol_index)
+
+
+class TestSacEvalCommand(SacdebugTestCase):
+    def test_sac_eval(self):
+        gdb = fakegdb.install()
+        data = self.program.allocate_array("q", range(6))
+        pointer = gdb.Value(data, gdb.lookup_type("long").pointer())
+        self.program.call(self.func, {"SACl_a": pointer, "SACl_a__dim": 2, "SACl_a__shp0": 2, "SACl_a__shp1": 3,
+                                      "SACl_n": 2})
+        gdb.execute("sac eval sum(a * a) + n")
+        gdb.execute("sac eval { [i] -> a[i, i] * 10 }")
+        self.assertIn("sum(a * a) + n = 57", self.output.getvalue())
+        self.assertIn("{ [i] -> a[i, i] * 10 } = [0, 40]", self.output.getvalue())
+        self.assertRaises(gdb.GdbError, gdb.execute, "sac eval a + [1, 2]")
+
+
+class TestSacPrintCommand(SacdebugTestCase):
+    def test_sac_print(self):
+        gdb = fakegdb.install()
+        data = self.program.allocate_array("q", range(6))
+        pointer = gdb.Value(data, gdb.lookup_type("long").pointer())
+        self.program.call(self.func, {"SACl_a": pointer, "SACl_a__dim": 2, "SACl_a__shp0": 2, "SACl_a__shp1": 3})
+        gdb.execute("sac print a[1]")
+        gdb.execute("sac summary a")
+        self.assertIn("a[1] = [3, 4, 5]", self.output.getvalue())
+        self.assertIn("count = 6, min = 0, max = 5", self.output.getvalue())
+
+    def test_pretty_printer(self):
+        gdb = fakegdb.install()
+        data = self.program.allocate_array("q", range(6))
+        pointer = gdb.Value(data, gdb.lookup_type("long").pointer())
+        self.program.call(self.func, {"SACl_a": pointer, "SACl_a__dim": 2, "SACl_a__shp0": 2, "SACl_a__shp1": 3,
+                                      "SACl_p": pointer})
+        frame = gdb.selected_frame()
+        self.assertEqual(gdb.default_visualizer(frame.read_var("SACl_a")).to_string(), "[[0, 1, 2],\n [3, 4, 5]]")
+        # A pointer without a shape is shown as one
+        self.assertEqual(gdb.default_visualizer(frame.read_var("SACl_p")).to_string(), "0x%x" % data)
+        self.assertIsNone(gdb.default_visualizer(frame.read_var("SACl_a__dim")))
+        self.assertIsNone(gdb.default_visualizer(pointer))
+
+
+class TestSachistoryCommand(SacdebugTestCase):
+    def test_sachistory(self):
+        gdb = fakegdb.install()
+        self.sacdebug.sac_watch_ssa = True
+        gdb.execute("sachistory start --size 16")
+        self.program.call(self.func, {"SACl_x": 1, "SACp_emal_1_x__SSA0_1": 0, "SACp_emal_2_x__SSA0_2": 0})
+        self.program.assign("SACp_emal_1_x__SSA0_1", 5)
+        self.program.assign("SACp_emal_2_x__SSA0_2", -3)
+        self.program.ret()
+
+        history = self.sacdebug.value_history
+        self.assertEqual([(r.variable, r.value, r.function, r.depth) for r in history.records("x")],
+                         [("SACp_emal_1_x__SSA0_1", 5, self.func, 1), ("SACp_emal_2_x__SSA0_2", -3, self.func, 1)])
+        gdb.execute("sachistory find x < 0")
+        self.assertIn("SACp_emal_2_x__SSA0_2", self.output.getvalue())
+        gdb.execute("sachistory find x > 100")
+        self.assertIn("No recorded write satisfies x > 100", self.output.getvalue())
+        self.assertRaises(gdb.GdbError, gdb.execute, "sachistory find x < y")
+
+        gdb.execute("sachistory stop")
+        self.program.call(self.func, {"SACp_emal_1_x__SSA0_1": 0})
+        self.program.assign("SACp_emal_1_x__SSA0_1", 7)
+        self.assertEqual(len(history), 2)
+
+
+class TestSaccoreCommand(SacdebugTestCase):
+    def test_saccore(self):
+        gdb = fakegdb.install()
+        data = self.program.allocate_array("q", range(4))
+        pointer = gdb.Value(data, gdb.lookup_type("long").pointer())
+        self.program.call("SACf__MAIN__main", {"SACl_n": 3})
+        self.program.call(self.func, {"SACl_a": pointer, "SACl_a__dim": 1, "SACl_a__shp0": 4})
+        omitted = self.program.allocate_array("q", [9, 10])
+        # A core has none of the state collected while the program ran
+        self.sacdebug.thread_states.clear()
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "core")
+        with open(path, "wb") as core_file:
+            # The second array's pages are in the core's segments without their contents
+            core_file.write(build_core([(data, struct.pack("<4q", 5, 6, 7, 8), 32), (omitted, b"", 16)]))
+
+        self.assertRaises(gdb.GdbError, gdb.execute, "saccore open")
+        gdb.execute("saccore open " + path)
+        self.assertIn("Rebuilt 2 SaC frames in 1 threads", self.output.getvalue())
+        self.assertEqual(len(self.sacdebug.thread_state().variable_stack), 2)
+
+        gdb.execute("sac print *sac(a)")
+        self.assertEqual(self.program.executed[-1], "print SACl_a")
+        # Array contents come from the core rather than the inferior
+        gdb.execute("sac eval sum(a)")
+        self.assertIn("sum(a) = 26", self.output.getvalue())
+        # Memory the core left out is read through GDB
+        self.assertEqual(bytes(self.sacdebug.read_memory(omitted, 16)), struct.pack("<2q", 9, 10))
+
+        self.program.newest_frame().older().select()
+        gdb.execute("sac print *sac(n)")
+        self.assertEqual(self.program.executed[-1], "print SACl_n")
+        gdb.execute("saccore frames")
+        self.assertIn("MAIN::foo(int)", self.output.getvalue())
+
+        gdb.execute("saccore close")
+        self.assertEqual(self.sacdebug.core_memory, None)
+        self.assertRaises(gdb.GdbError, gdb.execute, "saccore frames")
+
+
+class TestSnapshotCommand(SacdebugTestCase):
+    def test_sac_snapshot(self):
+        gdb = fakegdb.install()
+        values = list(range(12))
+        first = self.program.allocate_array("q", values)
+        second = self.program.allocate_array("q", values[:5] + [-1] + values[6:])
+        long_pointer = gdb.lookup_type("long").pointer()
+        self.program.call(self.func, {
+            "SACp_emal_1_a__SSA0_1": gdb.Value(first, long_pointer), "SACp_emal_1_a__SSA0_1__dim": 2,
+            "SACp_emal_1_a__SSA0_1__shp0": 3, "SACp_emal_1_a__SSA0_1__shp1": 4,
+            "SACp_emal_2_a__SSA0_2": gdb.Value(second, long_pointer), "SACp_emal_2_a__SSA0_2__dim": 2,
+            "SACp_emal_2_a__SSA0_2__shp0": 3, "SACp_emal_2_a__SSA0_2__shp1": 4})
+
+        gdb.execute("sac diff a@0 a@-1")
+        self.assertIn("1 of 12 elements changed in 1 ranges", self.output.getvalue())
+        self.assertIn("  [1, 1]\n", self.output.getvalue())
+
+        gdb.execute("sac snapshot a --keep")
+        gdb.execute("sac snapshot a --name hashed")
+        self.program.write(second + 8 * 8, struct.pack("<3q", 0, 0, 0))
+        gdb.execute("sac diff a")
+        self.assertIn("  [2, 0] .. [2, 2]\n", self.output.getvalue())
+        # A named snapshot is compared with the variable it was taken of
+        gdb.execute("sac snapshot a@0 --name before --keep")
+        self.program.write(first, struct.pack("<q", 42))
+        gdb.execute("sac diff before")
+        self.assertIn("1 of 12 elements changed in 1 ranges, 1 of 1 chunks differ\n  [0, 0]\n",
+                      self.output.getvalue())
+        gdb.execute("sac diff hashed a@-1")
+        self.assertIn("Ranges are whole chunks", self.output.getvalue())
+        # Two snapshots are compared without reading the inferior
+        gdb.execute("sac diff a hashed")
+        self.assertIn("No elements changed", self.output.getvalue())
+        self.assertRaises(gdb.GdbError, gdb.execute, "sac diff b")
+        self.assertRaises(gdb.GdbError, gdb.execute, "sac diff a@5 a")
+
+
+class TestBatchCommand(SacdebugTestCase):
+    def test_sac_batch(self):
+        gdb = fakegdb.install()
+        self.program.call(self.func, {"SACl_x": 1, "SACp_emal_1_x__SSA0_1": 7, "SACl_n": 3})
+        evaluated = list()
+        parse_and_eval = gdb.parse_and_eval
+        self.addCleanup(setattr, gdb, "parse_and_eval", parse_and_eval)
+        gdb.parse_and_eval = lambda expression: evaluated.append(expression) or parse_and_eval(expression)
+
+        gdb.execute("sac batch { print *sac(x); sac print *sac(x); p *sac(n); print *sac(y); print *sac(x }")
+        self.assertEqual(self.output.getvalue(), "*sac(x) = 7\n*sac(x) = 7\n*sac(n) = 3\n"
+                                                 "Error with contents of a *sac() block: print *sac(y)\n"
+                                                 "Error with contents of a *sac() block: print *sac(x\n")
+        # Repeated expressions are evaluated once and none go through the CLI
+        self.assertEqual(evaluated, ["SACp_emal_1_x__SSA0_1", "SACl_n"])
+        self.assertEqual(self.program.executed[-1], "sac batch { print *sac(x); sac print *sac(x); p *sac(n); "
+                                                    "print *sac(y); print *sac(x }")
+
+        # Other commands may change what the expressions evaluate to
+        self.program.execute_handlers["set"] = lambda command: self.program.assign("SACl_n", 4)
+        gdb.execute("sac batch print *sac(n); set var *sac(n) = 4; print *sac(n)")
+        self.assertIn("*sac(n) = 3\n*sac(n) = 4\n", self.output.getvalue())
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "dashboard.gdb")
+        with open(path, "w") as script:
+            script.write("# Dashboard\nprint *sac(n)\nprint nope\nsac summary x\n")
+        gdb.execute("sac source " + path)
+        self.assertIn("*sac(n) = 4\nprint nope: No symbol \"nope\" in current context.\n", self.output.getvalue())
+        self.assertRaises(gdb.GdbError, gdb.execute, "sac source " + path + ".missing")
 
 
 class TestLocalVars(unittest.TestCase):
@@ -27,6 +623,10 @@ class TestLocalVars(unittest.TestCase):
         result = saclib.sac_vars(input_vars)
         self.assertEqual(expected_result, result)
 
+        # Symbol names from a frame's scope are filtered the same way
+        input_names = ["SACp_emal_5_x", "SACp_emal_5_x__desc", "SACl_foo", "i"]
+        self.assertEqual(saclib.sac_vars(input_names), ["SACp_emal_5_x", "SACl_foo"])
+
 
 class TestVariableConversion(unittest.TestCase):
     def setUp(self):
@@ -47,8 +647,32 @@ class TestVariableConversion(unittest.TestCase):
         input_var = "x"
         self.assertEqual(saclib.sacvar_to_c(input_var, input_locals), "SACp_emal_5_x")
 
+    def test_ssa_ordering(self):
+        # SSA indexes are compared numerically rather than as strings
+        input_locals = ["SACp_emal_5_x__SSA0_9", "SACp_emal_6_x__SSA0_10", "SACp_emal_4_x__SSA0_2"]
+        self.assertEqual(saclib.sacvar_to_c("x", input_locals), "SACp_emal_6_x__SSA0_10")
+
+        # A name is not matched by a longer variable sharing its prefix
+        input_locals = ["SACp_emal_5_x", "SACp_emal_7_xs__SSA0_3"]
+        self.assertEqual(saclib.sacvar_to_c("x", input_locals), "SACp_emal_5_x")
+        self.assertEqual(saclib.sacvar_to_c("y", input_locals), None)
+
+    def test_variable_frame(self):
+        frame = saclib.SacVariableFrame(["SACl_foo", "SACp_emal_5_x"])
+        self.assertEqual(frame.lookup("x"), "SACp_emal_5_x")
+
+        # The index is updated as the frame receives new SSA versions
+        frame.append("SACp_emal_9_x__SSA0_1")
+        frame.append("SACp_emal_9_x__SSA0_1")
+        self.assertEqual(frame.lookup("x"), "SACp_emal_9_x__SSA0_1")
+        self.assertEqual(list(frame), ["SACl_foo", "SACp_emal_5_x", "SACp_emal_9_x__SSA0_1"])
+        self.assertEqual(saclib.sacvar_to_c("foo", frame), "SACl_foo")
+
     def test_c_to_sac(self):
-        pass
+        self.assertEqual(saclib.cvar_to_sac("SACp_emal_5_x__SSA0_1"), "x")
+        self.assertEqual(saclib.cvar_to_sac("SACl_foo"), "foo")
+        self.assertEqual(saclib.cvar_to_sac("SACp_emal_5_x__desc"), None)
+        self.assertEqual(saclib.cvar_to_sac("i"), None)
 
 
 class TestFunctionConversion(unittest.TestCase):
@@ -74,9 +698,661 @@ class TestFunctionConversion(unittest.TestCase):
         # Test invalid argument type
         self.assertEqual(saclib.sacfunc_to_c("foo::bar", ["int", "foo"]), None)
 
+        # Test multidimensional and unknown rank arguments
+        self.assertEqual(saclib.sacfunc_to_c("foo", ["int[.,6]", "double[*]", "bool[+]"]),
+                         "SACf__MAIN__foo__i_P_6__d_X__b_XP")
+        self.assertEqual(saclib.sacfunc_to_c("foo", ["int[*,*]"]), None)
+
+        # Test user defined types, with and without their namespace
+        self.assertEqual(saclib.sacfunc_to_c("foo", ["Complex::complex[.]"]), "SACf__MAIN__foo__SACt__COMPLEX__complex_P")
+        saclib.register_user_types(["SACt__QUAT__quaternion_6"])
+        self.assertEqual(saclib.sacfunc_to_c("foo", ["quaternion"]), "SACf__MAIN__foo__SACt__QUAT__quaternion")
+
     def test_c_to_sac(self):
+        self.assertEqual(saclib.cfunc_to_sac("SACf__MAIN__foo"), "MAIN::foo()")
+        self.assertEqual(saclib.cfunc_to_sac("SACf__FOO__bar__i_P__i"), "FOO::bar(int[.], int)")
+        self.assertEqual(saclib.cfunc_to_sac("SACf__FOO__bar__i_6_P__d_X"), "FOO::bar(int[6,.], double[*])")
+        self.assertEqual(saclib.cfunc_to_sac("SACf__A__f__SACt__B__t_XP"), "A::f(B::t[+])")
+        self.assertEqual(saclib.cfunc_to_sac("SACf__MAIN__foo__q"), None)
+        self.assertEqual(saclib.cfunc_to_sac("main"), None)
+
+        # Demangled names convert back to the same C name
+        for c_name in ["SACf__FOO__bar__i_P__i", "SACf__A__f__SACt__B__t_XP__f_3_4"]:
+            sac_name = saclib.cfunc_to_sac(c_name)
+            func_name, args = sac_name[:-1].split("(")
+            self.assertEqual(saclib.sacfunc_to_c(func_name, [a for a in args.split(", ") if a]), c_name)
+
+
+class TestFunctionScope(unittest.TestCase):
+    def setUp(self):
         pass
 
+    def test_sacfunc_match(self):
+        self.assertTrue(saclib.sacfunc_match("MAIN", "foo", ["MAIN::*"]))
+        self.assertTrue(saclib.sacfunc_match("ARRAY", "sel", ["Array::*"]))
+        self.assertTrue(saclib.sacfunc_match("ARRAY", "sel", ["sel"]))
+        self.assertFalse(saclib.sacfunc_match("ARRAY", "sel", ["MAIN::*", "foo"]))
+
+    def test_sacfunc_in_scope(self):
+        self.assertTrue(saclib.sacfunc_in_scope("MAIN", "foo", [], []))
+        self.assertTrue(saclib.sacfunc_in_scope("MAIN", "foo", ["MAIN::*"], ["Array::*"]))
+        self.assertFalse(saclib.sacfunc_in_scope("ARRAY", "sel", ["*"], ["Array::*"]))
+        self.assertFalse(saclib.sacfunc_in_scope("ARRAY", "sel", ["MAIN::*"], []))
+
+    def test_parse_init_args(self):
+        self.assertEqual(saclib.parse_init_args([]),
+                         {"only": [], "exclude": [], "watch_ssa": False, "hw_watchpoints": None})
+        options = saclib.parse_init_args(["--only", "MAIN::*", "--exclude", "Array::*", "--only", "foo"])
+        self.assertEqual(options["only"], ["MAIN::*", "foo"])
+        self.assertEqual(options["exclude"], ["Array::*"])
+        self.assertTrue(saclib.parse_init_args(["--watch-ssa"])["watch_ssa"])
+        self.assertEqual(saclib.parse_init_args(["--hw-watchpoints", "2"])["hw_watchpoints"], 2)
+        self.assertRaises(ValueError, saclib.parse_init_args, ["--hw-watchpoints", "all"])
+        self.assertRaises(ValueError, saclib.parse_init_args, ["--only"])
+        self.assertRaises(ValueError, saclib.parse_init_args, ["MAIN::*"])
+
+
+class TestSymbolIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.binary = os.path.join(self.directory, "prog")
+        symbols = [("SACf__MAIN__foo__i_P__d", 2, True), ("SACf__MAIN__main", 2, True),
+                   ("SACf__ARRAY__sel__i__SACt__COMPLEX__complex_P", 2, True),
+                   ("SACf__MAIN__imported", 2, False), ("SACf__MAIN__data", 1, True), ("printf", 2, True)]
+        with open(self.binary, "wb") as f:
+            f.write(build_elf(symbols, "deadbeef"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sacfunc_split(self):
+        self.assertEqual(saclib.sacfunc_split("SACf__MAIN__foo__i_P__d"), ("MAIN", "foo", ["i_P", "d"]))
+        self.assertEqual(saclib.sacfunc_split("SACf__MAIN__main"), ("MAIN", "main", []))
+        self.assertEqual(saclib.sacfunc_split("SACf__A__f__SACt__B__t_P__i"), ("A", "f", ["SACt__B__t_P", "i"]))
+        self.assertEqual(saclib.sacfunc_split("printf"), None)
+
+    def test_read_elf(self):
+        self.assertEqual(sacindex.read_elf_symbols(self.binary),
+                         ["SACf__MAIN__foo__i_P__d", "SACf__MAIN__main",
+                          "SACf__ARRAY__sel__i__SACt__COMPLEX__complex_P"])
+        self.assertEqual(sacindex.read_build_id(self.binary), "deadbeef")
+
+    def test_load_index(self):
+        cache = os.path.join(self.directory, "cache")
+        index = sacindex.load_index(self.binary, directory=cache)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.lookup("SACf__MAIN__foo__i_P__d").args, ("i_P", "d"))
+        self.assertTrue(os.path.exists(os.path.join(cache, "deadbeef.json")))
+
+        # The second load must come from the cache rather than the binary
+        os.remove(self.binary)
+        cached = sacindex.load_index(self.binary, "deadbeef", directory=cache)
+        self.assertEqual(sorted(s.c_name for s in cached), sorted(s.c_name for s in index))
+        self.assertEqual(cached.lookup("SACf__MAIN__main"), index.lookup("SACf__MAIN__main"))
+
+    def test_background_indexer(self):
+        indexed = list()
+        indexer = sacindex.BackgroundIndexer(lambda path, index: indexed.append((path, index)),
+                                             load=lambda path, build_id: sacindex.load_index(
+                                                 path, build_id, os.path.join(self.directory, "cache")))
+        indexer.submit(self.binary)
+        indexer.submit(os.path.join(self.directory, "missing"))
+        indexer.wait()
+        self.assertEqual([(path, index is None) for path, index in indexed],
+                         [(self.binary, False), (os.path.join(self.directory, "missing"), True)])
+        self.assertEqual(len(indexed[0][1]), 3)
+        self.assertEqual(indexer.pending(), 0)
+
+        # Anything still being indexed when the objfiles are cleared is dropped
+        loading = threading.Event()
+        release = threading.Event()
+
+        def load(path, build_id):
+            loading.set()
+            release.wait()
+            return sacindex.SacSymbolIndex(["SACf__MAIN__main"])
+        indexer.load = load
+        indexer.submit(self.binary)
+        loading.wait()
+        indexer.clear()
+        release.set()
+        indexer.wait()
+        self.assertEqual(len(indexed), 2)
+
+
+class TestStats(unittest.TestCase):
+    def test_histogram(self):
+        histogram = sacstats.Histogram()
+        for microseconds in [1, 2, 3, 100, 1000]:
+            histogram.add(microseconds * 1e-6)
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.max, 1e-3)
+        self.assertAlmostEqual(histogram.percentile(0.5), 4e-6)
+        self.assertAlmostEqual(histogram.percentile(0.99), 1e-3)
+        self.assertEqual(histogram.as_dict()["buckets"], {"<2us": 1, "<4us": 2, "<128us": 1, "<1024us": 1})
+
+    def test_stats(self):
+        times = iter([1.0, 1.5])
+        stats = sacstats.Stats(clock=lambda: next(times))
+        stats.count("stops")
+        stats.count("stops", 2)
+        start = stats.clock()
+        stats.observe("handler", stats.clock() - start)
+        data = stats.as_dict({"sac_return_bps": 4})
+        self.assertEqual(data["counters"], {"stops": 3})
+        self.assertEqual(data["timings"]["handler"]["total"], 0.5)
+        lines = sacstats.format_stats(data)
+        self.assertTrue(lines[1].startswith("stops"))
+        self.assertTrue(lines[3].startswith("handler"))
+        self.assertTrue(lines[-1].startswith("sac_return_bps"))
+
+        stats.clear()
+        self.assertEqual(sacstats.format_stats(stats.as_dict()), ["No statistics recorded"])
+
+
+class TestValueHistory(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def fill(self, history, values):
+        for i, value in enumerate(values):
+            history.append((1, 2, 0), "SACf__MAIN__foo__i", "SACp_emal_%d_x__SSA0_%d" % (i, i + 1), 1, 0x400 + i,
+                           value)
+
+    def test_ring(self):
+        history = sachistory.ValueHistory(4)
+        self.fill(history, [3, 1, -2, 4, -5, 6])
+        self.assertEqual((len(history), history.dropped()), (4, 2))
+        self.assertEqual([record.value for record in history.records("x")], [-2, 4, -5, 6])
+        self.assertEqual(history.record(0), None)
+        self.assertEqual(history.record(5).pc, 0x405)
+        self.assertEqual(history.record(5).thread, "(1, 2, 0)")
+
+    def test_find(self):
+        history = sachistory.ValueHistory()
+        self.fill(history, [3, 1, -2, 4.5, -5, b"contents"])
+        self.assertEqual(history.find(saccond.compile_condition("x < 0")).sequence, 2)
+        self.assertEqual(history.find(saccond.compile_condition("x < 0"), last=True).sequence, 4)
+        self.assertEqual(history.find(saccond.compile_condition("x > 4")).value, 4.5)
+        self.assertEqual(history.find(saccond.compile_condition("x > 100")), None)
+        self.assertEqual(history.record(5).kind, sachistory.HASH)
+        self.assertEqual(len(history.record(5).value), 8)
+        self.assertRaises(ValueError, history.find, saccond.compile_condition("x < y"))
+        self.assertEqual(list(history.records("y")), [])
+
+    def test_file(self):
+        path = os.path.join(self.directory, "history")
+        history = sachistory.ValueHistory(3, path)
+        self.fill(history, [1, 2, 3, 4])
+        history.close()
+        self.assertEqual(os.path.getsize(path), sachistory.HEADER.size + 3 * sachistory.RECORD.size)
+
+        loaded = sachistory.ValueHistory.load(path)
+        self.assertEqual([record.value for record in loaded.records("x")], [2, 3, 4])
+        self.assertEqual(loaded.find(saccond.compile_condition("x >= 3")).variable, "SACp_emal_2_x__SSA0_3")
+        loaded.close()
+        with open(path, "r+b") as history_file:
+            history_file.write(b"garbage!")
+        self.assertRaises(ValueError, sachistory.ValueHistory.load, path)
+
+    def test_parse_history_args(self):
+        self.assertEqual(sachistory.parse_history_args(["start", "--size", "8", "--file", "h"])["size"], 8)
+        self.assertEqual(sachistory.parse_history_args(["show", "x", "--limit", "3"])["variable"], "x")
+        options = sachistory.parse_history_args(["find", "x", "<", "0", "--last"])
+        self.assertEqual((options["condition"].names, options["last"]), ({"x"}, True))
+        self.assertEqual(sachistory.parse_history_args(["load", "h"])["file"], "h")
+        self.assertRaises(ValueError, sachistory.parse_history_args, ["rewind"])
+        self.assertRaises(ValueError, sachistory.parse_history_args, ["start", "--size", "0"])
+        self.assertRaises(ValueError, sachistory.parse_history_args, ["find"])
+        self.assertRaises(ValueError, sachistory.parse_history_args, ["stop", "x"])
+
+
+class TestCoreMemory(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_read(self):
+        core = saccore.CoreMemory(self.write("core", build_core([(0x2000, b"efgh", 8), (0x1000, b"abcd", 4),
+                                                                 (0x3000, b"", 16)])))
+        self.addCleanup(core.close)
+        # Segments without contents in the core aren't served at all
+        self.assertEqual(len(core), 2)
+        self.assertEqual(core.read(0x1001, 2), b"bc")
+        self.assertEqual(core.read(0x2002, 2), b"gh")
+        # Memory past the contents the core holds isn't in it, however large the segment
+        self.assertRaises(ValueError, core.read, 0x2002, 6)
+        self.assertRaises(ValueError, core.read, 0x3000, 1)
+        self.assertRaises(ValueError, core.read, 0x1002, 4)
+        self.assertRaises(ValueError, core.read, 0x800, 1)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, saccore.CoreMemory, self.write("prog", build_elf([("SACf__MAIN__main", 2, True)])))
+        self.assertRaises(ValueError, saccore.CoreMemory, self.write("text", b"not an ELF file"))
+
+    def test_target(self):
+        info = "Local core dump file:\n\t`/tmp/core.123', file type elf64-x86-64.\n"
+        self.assertEqual(saccore.core_target_path(info), "/tmp/core.123")
+        self.assertEqual(saccore.core_target_path("Local exec file:\n"), None)
+        self.assertEqual(saccore.parse_core_args(["open", "core"])["file"], "core")
+        self.assertEqual(saccore.parse_core_args([])["command"], "open")
+        self.assertRaises(ValueError, saccore.parse_core_args, ["frames", "x"])
+        self.assertRaises(ValueError, saccore.parse_core_args, ["load"])
+
+
+class TestSnapshots(unittest.TestCase):
+    def buffer(self, values):
+        data = array.array("q", values).tobytes()
+        return sacarray.ChunkedBuffer(lambda offset, size: memoryview(data)[offset:offset + size], len(values), "q")
+
+    def test_diff(self):
+        size = 3 * sacsnap.snapshot_chunk_elements(8)
+        values = list(range(size))
+        snapshot = sacsnap.ArraySnapshot.take((3, size // 3), self.buffer(values))
+        kept = sacsnap.ArraySnapshot.take((3, size // 3), self.buffer(values), keep=True)
+        self.assertEqual(snapshot.chunk_count(), 3)
+        self.assertEqual(snapshot.nbytes(), 48)
+
+        values[10:20] = [0] * 10
+        values[-1] = 0
+        live = sacsnap.LiveArray((3, size // 3), self.buffer(values))
+        diff = sacsnap.diff_arrays(kept, live)
+        self.assertEqual(diff.ranges, [(10, 20), (size - 1, size)])
+        self.assertEqual((diff.exact, diff.chunks_changed), (True, 2))
+        lines = sacsnap.format_diff(diff)
+        self.assertEqual(lines[1:], ["  [0, 10] .. [0, 19]", "  [2, %d]" % (size // 3 - 1)])
+
+        # Without the contents only the chunks that changed are known
+        diff = sacsnap.diff_arrays(snapshot, sacsnap.ArraySnapshot.take(live.shape, live.buffer))
+        self.assertEqual(diff.ranges, [(0, size // 3), (2 * size // 3, size)])
+        self.assertFalse(diff.exact)
+        self.assertEqual(sacsnap.format_diff(sacsnap.diff_arrays(snapshot, kept)), ["No elements changed"])
+        self.assertRaises(ValueError, sacsnap.diff_arrays, snapshot, sacsnap.LiveArray((size,), live.buffer))
+        self.assertEqual(sacsnap.format_diff(diff, limit=1)[-2], "  ... 1 more ranges")
+
+    def test_parse_args(self):
+        options = sacsnap.parse_snapshot_args(["x@3", "--keep"])
+        self.assertEqual((options["variable"], options["name"], options["keep"]), ("x@3", "x@3", True))
+        self.assertEqual(sacsnap.parse_snapshot_args(["x", "--name", "before"])["name"], "before")
+        self.assertEqual(sacsnap.parse_diff_args(["x", "y", "--limit", "5"]), {"operands": ["x", "y"], "limit": 5})
+        self.assertRaises(ValueError, sacsnap.parse_snapshot_args, [])
+        self.assertRaises(ValueError, sacsnap.parse_diff_args, ["x", "y", "z"])
+        self.assertRaises(ValueError, sacsnap.parse_diff_args, ["--limit", "0", "x"])
+
+
+class TestAutoLoad(unittest.TestCase):
+    def setUp(self):
+        self.gdb = fakegdb.install()
+        fakegdb.reset()
+        self.program = fakegdb.program
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        # sacload has to find sacdebug not imported yet
+        sacdebug = sys.modules.pop("sacdebug", None)
+        if sacdebug is not None:
+            self.addCleanup(sys.modules.__setitem__, "sacdebug", sacdebug)
+        self.addCleanup(sys.modules.pop, "sacdebug", None)
+        if "sacload" in sys.modules:
+            self.sacload = importlib.reload(sys.modules["sacload"])
+        else:
+            self.sacload = importlib.import_module("sacload")
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_has_sac_symbols(self):
+        self.assertTrue(self.sacload.has_sac_symbols(self.write("prog", build_elf([("SACf__MAIN__main", 2, True)]))))
+        self.assertTrue(self.sacload.has_sac_symbols(self.write("lib", build_elf([("SACf__MAIN__main", 2, False)]))))
+        self.assertFalse(self.sacload.has_sac_symbols(self.write("c", build_elf([("main", 2, True)]))))
+        # Only symbol names count, not strings elsewhere in the binary
+        self.assertFalse(self.sacload.has_sac_symbols(self.write("data", build_elf([("main", 2, True)]) + b"SACf__")))
+        self.assertFalse(self.sacload.has_sac_symbols(self.write("text", b"SACf__")))
+        self.assertFalse(self.sacload.has_sac_symbols(os.path.join(self.directory, "missing")))
+
+    def test_deferred_commands(self):
+        self.program.load_objfile(self.write("libc.so", build_elf([("main", 2, True)])))
+        self.assertEqual(self.program.commands, {})
+
+        self.program.load_objfile(self.write("prog", build_elf([("SACf__MAIN__main", 2, True)])))
+        self.assertEqual(sorted(self.program.commands), sorted(self.sacload.SAC_COMMANDS))
+        self.assertNotIn("sacdebug", sys.modules)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.gdb.execute("sacinfo stats")
+        self.assertIn("sacdebug", sys.modules)
+        self.assertNotIsInstance(self.program.commands["sacinfo"], self.sacload.SacCommandStub)
+        self.assertIn("symbol_index", output.getvalue())
+        # The stop handler is only connected once sacdebug places breakpoints
+        self.assertEqual(fakegdb.events.stop.handlers, [])
+        sys.modules["sacdebug"].arm_function("SACf__MAIN__main")
+        self.assertEqual(fakegdb.events.stop.handlers, [sys.modules["sacdebug"].breakpoint_handle])
+
+
+class TestCallTrace(unittest.TestCase):
+    def setUp(self):
+        self.time = 0.0
+        self.tracer = sactrace.CallTracer(size=100, clock=lambda: self.time)
+
+    def test_ring_buffer(self):
+        buffer = sactrace.TraceBuffer(3)
+        for i in range(5):
+            buffer.append(i)
+        self.assertEqual(list(buffer), [2, 3, 4])
+        self.assertEqual(buffer.dropped(), 2)
+        buffer.clear()
+        self.assertEqual(list(buffer), [])
+
+    def test_recursion(self):
+        self.tracer.enter(1, "SACf__MAIN__main", 0x10)
+        for depth in range(3):
+            self.tracer.enter(1, "SACf__MAIN__fib__i", 0x20 if depth else 0x30)
+            self.time += 1
+        for depth in range(3):
+            self.assertEqual(self.tracer.leave(1, 0x20 if depth < 2 else 0x30), "SACf__MAIN__fib__i")
+            self.time += 1
+        self.assertEqual(self.tracer.depth(1), 1)
+
+        counts, inclusive, root = sactrace.profile(self.tracer.buffer)
+        self.assertEqual(counts["SACf__MAIN__fib__i"], 3)
+        # Only the outermost call of a recursive function counts
+        self.assertEqual(inclusive["SACf__MAIN__fib__i"], 5)
+        self.assertEqual(sactrace.format_tree(root), [
+            "MAIN::main()  calls 1  0.000 ms",
+            "  MAIN::fib(int)  calls 1  5000.000 ms",
+            "    MAIN::fib(int)  calls 1  3000.000 ms",
+            "      MAIN::fib(int)  calls 1  1000.000 ms"])
+
+    def test_unwind(self):
+        self.tracer.enter(1, "SACf__MAIN__a", 0x10)
+        self.tracer.enter(1, "SACf__MAIN__b", 0x20)
+        self.tracer.enter(2, "SACf__MAIN__c", 0x30)
+        self.assertEqual(self.tracer.leave(1, 0x40), None)
+        # Returning past b closes it as well
+        self.assertEqual(self.tracer.leave(1, 0x10), "SACf__MAIN__a")
+        self.assertEqual(self.tracer.depth(1), 0)
+        self.assertEqual(self.tracer.depth(2), 1)
+
+    def test_truncated(self):
+        tracer = sactrace.CallTracer(size=2, clock=lambda: self.time)
+        tracer.enter(1, "SACf__MAIN__a", 0x10)
+        tracer.enter(1, "SACf__MAIN__b", 0x20)
+        tracer.leave(1, 0x20)
+        tracer.leave(1, 0x10)
+        counts, inclusive, root = sactrace.profile(tracer.buffer)
+        self.assertEqual(dict(counts), {})
+        self.assertEqual(len(root.children), 0)
+
+    def test_parse_trace_args(self):
+        self.assertEqual(sactrace.parse_trace_args([])["command"], "report")
+        options = sactrace.parse_trace_args(["start", "--size", "16", "MAIN::*"])
+        self.assertEqual((options["size"], options["patterns"]), (16, ["MAIN::*"]))
+        self.assertTrue(sactrace.parse_trace_args(["report", "--tree"])["tree"])
+        self.assertRaises(ValueError, sactrace.parse_trace_args, ["start", "--size", "0"])
+        self.assertRaises(ValueError, sactrace.parse_trace_args, ["report", "foo"])
+        self.assertRaises(ValueError, sactrace.parse_trace_args, ["restart"])
+
+
+class TestStackProfile(unittest.TestCase):
+    def setUp(self):
+        self.trie = sacprof.StackTrie()
+
+    def test_collapsed(self):
+        self.trie.add(("main", "SACf__MAIN__main"))
+        self.trie.add(("main", "SACf__MAIN__main", "SACf__MAIN__fib__i"), 2)
+        self.trie.add(("main", "SACf__MAIN__main"))
+        self.assertEqual(len(self.trie), 3)
+        self.assertEqual(self.trie.samples, 4)
+        self.assertEqual(list(self.trie.collapsed()), [
+            "main;SACf__MAIN__main 2", "main;SACf__MAIN__main;SACf__MAIN__fib__i 2"])
+
+    def test_function_counts(self):
+        self.trie.add(("a", "b", "b"), 3)
+        self.trie.add(("a",))
+        self_counts, total_counts = self.trie.function_counts()
+        self.assertEqual(self_counts, {"b": 3, "a": 1})
+        self.assertEqual(total_counts, {"a": 4, "b": 3})
+        self.assertEqual(sacprof.format_profile(self.trie)[1], "       3   75.0%   75.0%  b")
+
+    def test_stack_labels(self):
+        names = ["SACf__MAIN__fib__i", "SAC_runtime_spmd", "SACf__MAIN__main", "main"]
+        self.assertEqual(sacprof.stack_labels(names),
+                         ("main", "MAIN::main()", "SAC_runtime_spmd", "MAIN::fib(int)"))
+        self.assertEqual(sacprof.stack_labels(names, sac_only=True), ("MAIN::main()", "MAIN::fib(int)"))
+
+    def test_parse_prof_args(self):
+        options = sacprof.parse_prof_args(["start", "--rate", "49.5", "--samples", "10", "--sac-only"])
+        self.assertEqual((options["rate"], options["samples"], options["sac_only"]), (49.5, 10, True))
+        self.assertEqual(sacprof.parse_prof_args(["collapsed", "out.txt"])["file"], "out.txt")
+        self.assertRaises(ValueError, sacprof.parse_prof_args, ["start", "--rate", "0"])
+        self.assertRaises(ValueError, sacprof.parse_prof_args, ["start", "--duration"])
+        self.assertRaises(ValueError, sacprof.parse_prof_args, ["report", "out.txt"])
+
+
+class TestEval(unittest.TestCase):
+    def setUp(self):
+        self.arrays = {"a": ((3, 4), "d", array.array("d", [float(i) for i in range(12)])),
+                       "b": ((3, 4), "i", array.array("i", range(12))),
+                       "v": ((4,), "q", array.array("q", [4, -3, 2, 1])),
+                       "flags": ((2,), "?", bytes([1, 0]))}
+        self.backends = [saceval.ArrayBackend()]
+        if saceval.numpy is not None:
+            self.backends.append(saceval.NumpyBackend())
+
+    def evaluate(self, text):
+        results = set()
+        for backend in self.backends:
+            value = saceval.evaluate(text, self.arrays.__getitem__, backend)
+            results.add(saceval.format_result(value, backend))
+        # Every backend computes the same
+        self.assertEqual(len(results), 1)
+        return results.pop()
+
+    def test_arithmetic(self):
+        self.assertEqual(self.evaluate("sum(a * b)"), "506.0")
+        self.assertEqual(self.evaluate("b[:, 1:3] + 1"), "[[2, 3],\n [6, 7],\n [10, 11]]")
+        self.assertEqual(self.evaluate("max(b) - min(v)"), "14")
+        self.assertEqual(self.evaluate("b / 5 - -7 / 2 + -7 % 3"), self.evaluate("b / 5 + 2"))
+        self.assertEqual(self.evaluate("sum(b > 5 && b < 9) + sum(flags)"), "4")
+        self.assertEqual(self.evaluate("abs(v) * 2.5"), "[10.0, 7.5, 5.0, 2.5]")
+        self.assertEqual(self.evaluate("1.0 / 0"), "inf")
+
+    def test_selection(self):
+        self.assertEqual(self.evaluate("a[1, ::2]"), "[4.0, 6.0]")
+        self.assertEqual(self.evaluate("b[::-1, 0]"), "[8, 4, 0]")
+        self.assertEqual(self.evaluate("a[2][3] + v[-1]"), "12.0")
+        self.assertEqual(self.evaluate("shape(a[1:3])"), "[2, 4]")
+        self.assertEqual(self.evaluate("dim(b[0])"), "1")
+        self.assertEqual(self.evaluate("sum(a[1:1])"), "0")
+
+    def test_set_notation(self):
+        self.assertEqual(self.evaluate("{ [i] -> v[i] * 2 }"), "[8, -6, 4, 2]")
+        self.assertEqual(self.evaluate("{ [i, j] -> i * 10 + j | [i, j] < [2, 3] }"), "[[0, 1, 2],\n [10, 11, 12]]")
+        self.assertEqual(self.evaluate("sum({ [i] -> a[i, i] | [i] < [3] })"), "15.0")
+        self.assertEqual(self.evaluate("{ [i] -> 7 | [i] < shape(v) }"), "[7, 7, 7, 7]")
+
+    def test_invalid(self):
+        for text in ["a + v", "b / 0", "a[3]", "x +", "{ [i] -> i }", "a[1.5]", "sum(a", "a[v]", "a[::0]",
+                     "{ [i] -> b[i] | [j] < [2] }", "{ [i] -> v | [i] < [2] }", "max(a[1:1])", ""]:
+            for backend in self.backends:
+                self.assertRaises(ValueError, saceval.evaluate, text, self.arrays.__getitem__, backend)
+
+    def test_reads(self):
+        reads = list()
+
+        def read(name):
+            reads.append(name)
+            return self.arrays[name]
+        saceval.evaluate("sum(a * a) + a[0, 0] + { [i] -> a[i, 0] }[1]", read)
+        self.assertEqual(reads, ["a"])
+
+
+class TestConditions(unittest.TestCase):
+    def evaluate(self, text, variables, shapes=dict()):
+        def element(name, index):
+            value = variables[name]
+            for i in index:
+                value = value[i]
+            return value
+        return saccond.compile_condition(text)(variables.__getitem__, element, shapes.__getitem__,
+                                               lambda name: len(shapes[name]))
+
+    def test_compile(self):
+        condition = saccond.compile_condition("x > 100 && shape(a)[0] == 512")
+        self.assertEqual(condition.source, '((value("x") > 100) and (shape("a")[0] == 512))')
+        self.assertEqual(condition.names, frozenset(["x", "a"]))
+        self.assertIs(saccond.compile_condition("x > 100 && shape(a)[0] == 512"), condition)
+
+    def test_evaluate(self):
+        self.assertTrue(self.evaluate("x > 100 && shape(a)[0] == 512", {"x": 101}, {"a": (512,)}))
+        self.assertFalse(self.evaluate("x > 100 && shape(a)[0] == 512", {"x": 100}, {"a": (512,)}))
+        self.assertTrue(self.evaluate("!(dim(a) == 2) || a[1, 0] == 0.5", {"a": [[0, 0], [0.5, 1]]}, {"a": (2, 2)}))
+        self.assertTrue(self.evaluate("a[i] + 1.5e1 >= 16 && flag == true", {"a": [0, 1], "i": 1, "flag": True}))
+
+    def test_c_arithmetic(self):
+        self.assertTrue(self.evaluate("x / 2 == 3", {"x": 7}))
+        self.assertTrue(self.evaluate("x / 2 == -3", {"x": -7}))
+        self.assertTrue(self.evaluate("x / 2 == 3.5", {"x": 7.0}))
+        self.assertTrue(self.evaluate("-7 % 4 == -3", {}))
+        self.assertTrue(self.evaluate("x % -4 == 3", {"x": 7}))
+        self.assertTrue(self.evaluate("a[x / 2] == 5", {"a": [0, 0, 0, 5], "x": 7}))
+        self.assertRaises(ZeroDivisionError, self.evaluate, "x / 0 == 1", {"x": 1})
+
+    def test_not_binds_tightly(self):
+        # ! negates x alone, (!x) == 1, as in C and not !(x == 1)
+        self.assertTrue(self.evaluate("!x == 1", {"x": 0}))
+        self.assertFalse(self.evaluate("!x == 1", {"x": 1}))
+        self.assertTrue(self.evaluate("!x == 0", {"x": 5}))
+        self.assertTrue(self.evaluate("!(x == 1) && -x < 0", {"x": 2}))
+        # Comparisons don't chain like Python's, (3 > 2) > 1 is 1 > 1
+        self.assertFalse(self.evaluate("3 > 2 > 1", {}))
+
+    def test_invalid(self):
+        for text in ["", "x >", "x = 1", "shape(1)", "dim(a + b)", "(x", "a[1))", "x)", "__import__('os')"]:
+            self.assertRaises(ValueError, saccond.compile_condition, text)
+
+    def test_parse_break_args(self):
+        self.assertEqual(saccond.parse_break_args("foo(int[]) if x > 100"), ("foo", ("int[]",), "x > 100"))
+        self.assertEqual(saccond.parse_break_args("Array::sel(int[.], int[*])"),
+                         ("Array::sel", ("int[.]", "int[*]"), None))
+        self.assertEqual(saccond.parse_break_args("foo if(x)"), ("foo", None, "(x)"))
+        self.assertRaises(ValueError, saccond.parse_break_args, "foo(int")
+        self.assertRaises(ValueError, saccond.parse_break_args, "foo(int) when x")
+        self.assertRaises(ValueError, saccond.parse_break_args, "foo if")
+
+
+class TestWatchScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = sacwatch.WatchScheduler(budget=2)
+
+    def test_overflow_to_software(self):
+        for var in ["a", "b", "c"]:
+            self.scheduler.add((1, var), depth=1)
+        plan = self.scheduler.rebalance()
+        # The oldest watch overflows and software watches are placed first
+        self.assertEqual(plan, [((1, "a"), False), ((1, "c"), True), ((1, "b"), True)])
+        self.assertEqual(self.scheduler.rebalance(), [])
+
+    def test_touch_and_pop(self):
+        self.scheduler.add((1, "a"), depth=1)
+        self.scheduler.add((1, "b"), depth=1)
+        self.scheduler.rebalance()
+
+        # A new frame takes the registers from the frame below
+        self.scheduler.add((2, "x"), depth=2)
+        self.scheduler.add((2, "y"), depth=2)
+        self.assertEqual(sorted(self.scheduler.rebalance()),
+                         [((1, "a"), False), ((1, "b"), False), ((2, "x"), True), ((2, "y"), True)])
+
+        # Referencing a variable moves it back onto a register
+        self.scheduler.touch((1, "a"))
+        self.assertEqual(self.scheduler.rebalance(), [((2, "x"), False), ((1, "a"), True)])
+
+        # Popping the frame frees its registers for the frame below
+        self.assertEqual(sorted(self.scheduler.pop_depth(2)), [(2, "x"), (2, "y")])
+        self.assertEqual(self.scheduler.rebalance(), [((1, "b"), True)])
+
+    def test_pinned_and_cost(self):
+        self.scheduler.add((1, "a"), depth=1)
+        self.scheduler.add(("user", "big"), pinned=True, cost=sacwatch.hw_slots(16))
+        self.assertEqual(self.scheduler.rebalance(), [((1, "a"), False), (("user", "big"), True)])
+        self.assertEqual(self.scheduler.pop_depth(0), [(1, "a")])
+        self.assertTrue(self.scheduler.is_hardware(("user", "big")))
+
+    def test_owners(self):
+        self.scheduler.add((1, 1, "a"), depth=1, owner=1)
+        self.scheduler.add((2, 1, "a"), depth=1, owner=2)
+        self.scheduler.add((2, 2, "b"), depth=2, owner=2)
+        # Popping a frame of one thread leaves the frames of other threads alone
+        self.assertEqual(self.scheduler.pop_depth(1, owner=2), [(2, 1, "a"), (2, 2, "b")])
+        self.assertIn((1, 1, "a"), self.scheduler)
+
+
+class TestArrayPrinting(unittest.TestCase):
+    def setUp(self):
+        self.data = array.array("d", [float(i) for i in range(24)])
+        self.reads = list()
+
+    def read(self, offset, size):
+        self.reads.append((offset, size))
+        return memoryview(self.data).cast("B")[offset:offset + size]
+
+    def test_parse_selection(self):
+        self.assertEqual(sacarray.parse_array_expression("x[10:20, ::4]"), ("x", "10:20, ::4"))
+        self.assertEqual(sacarray.parse_array_expression(" x "), ("x", ""))
+        self.assertRaises(ValueError, sacarray.parse_array_expression, "x + 1")
+
+        selection = sacarray.parse_selection("1, ::2", (2, 3, 4))
+        self.assertEqual(selection, [(range(1, 2), False), (range(0, 3, 2), True), (range(0, 4), True)])
+        self.assertEqual(sacarray.selected_shape(selection), (2, 4))
+        self.assertEqual(sacarray.parse_selection("-1", (5,)), [(range(4, 5), False)])
+        self.assertRaises(ValueError, sacarray.parse_selection, "5", (5,))
+        self.assertRaises(ValueError, sacarray.parse_selection, "::0", (5,))
+        self.assertRaises(ValueError, sacarray.parse_selection, "1, 1", (5,))
+
+    def test_format_selection(self):
+        shape = (2, 3, 4)
+        buffer = sacarray.ChunkedBuffer(self.read, 24, "d", chunk_elements=8)
+        selection = sacarray.parse_selection("1, ::2, 1:3", shape)
+        source_index = sacarray.selection_mapper(shape, selection)
+        self.assertEqual(sacarray.format_array(lambda i: buffer[source_index(i)], sacarray.selected_shape(selection)),
+                         "[[13.0, 14.0],\n [21.0, 22.0]]")
+        # Only the chunks holding selected elements are read
+        self.assertEqual(sorted(self.reads), [(64, 64), (128, 64)])
+
+    def test_elided_format(self):
+        self.assertEqual(sacarray.format_array(lambda i: i, (10,), threshold=5), "[0, 1, 2, ..., 7, 8, 9]")
+        self.assertEqual(sacarray.format_array(lambda i: i == 1, (2,)), "[false, true]")
+
+        # Elided arrays only read the elements that are shown
+        read = list()
+        text = sacarray.format_array(lambda i: read.append(i) or i, (1000, 1000))
+        self.assertEqual(len(read), 36)
+        self.assertTrue(text.startswith("[[0, 1, 2, ..., 997, 998, 999],"))
+
+    def test_summarize(self):
+        self.data[3] = float("nan")
+        buffer = sacarray.ChunkedBuffer(self.read, 24, "d", chunk_elements=5)
+        summary = sacarray.summarize(buffer.chunks(), "d")
+        self.assertEqual(summary["count"], 23)
+        self.assertEqual(summary["nan"], 1)
+        self.assertEqual((summary["min"], summary["max"]), (0.0, 23.0))
+        self.assertTrue(math.isclose(summary["mean"], (276 - 3) / 23.0))
+
+        selection = sacarray.parse_selection("0, 1", (2, 12))
+        summary = sacarray.summarize(sacarray.selected_chunks(buffer, (2, 12), selection), "d")
+        self.assertEqual((summary["count"], summary["min"], summary["max"]), (1, 1.0, 1.0))
+
 
 class TestSacToC(unittest.TestCase):
     def setUp(self):
@@ -85,6 +1361,7 @@ class TestSacToC(unittest.TestCase):
     def test_sac_to_c(self):
         self.assertEqual(saclib.sac_to_c("foo()", []), "SACf__MAIN__foo")
         self.assertEqual(saclib.sac_to_c("foo::bar(int[], int)", []), "SACf__FOO__bar__i_P__i")
+        self.assertEqual(saclib.sac_to_c("foo(int[.,6], double[2,2])", []), "SACf__MAIN__foo__i_P_6__d_2_2")
 
         input_vars = "SACp_emal_5_x\nSACp_emal_5_x__SSA01\nSACl_foo\nSACf__MAIN__foo"
         self.assertEqual(saclib.sac_to_c("x", input_vars), "SACp_emal_5_x__SSA01")
@@ -95,7 +1372,73 @@ class TestSacToC(unittest.TestCase):
 
 class TestSacinfoCommand(unittest.TestCase):
     def setUp(self):
-        pass
+        self.search = sacsearch.FunctionSearch(sacindex.SacSymbolIndex([
+            "SACf__MAIN__foo__i", "SACf__MAIN__foobar__d", "SACf__MAIN__main",
+            "SACf__ARRAY__sel__i_1__i_P", "SACf__ARRAY__sel__i_1__i_X", "SACf__ARRAY__shape__i_P",
+            "SACf__COMPLEX__conj__SACt__COMPLEX__complex_P", "SACf__COMPLEX__conj__SACt__COMPLEX__complex"]))
+
+    def names(self, query, limit=sacsearch.DEFAULT_LIMIT):
+        return [saclib.cfunc_to_sac(symbol.c_name) for symbol in self.search.search(query, limit)[1]]
+
+    def test_ranking(self):
+        # Exact matches before prefixes, substrings and fuzzy matches
+        self.assertEqual(self.names("foo"), ["MAIN::foo(int)", "MAIN::foobar(double)"])
+        self.assertEqual(self.names("bar"), ["MAIN::foobar(double)"])
+        self.assertEqual(self.names("sl"), ["ARRAY::sel(int[1], int[.])", "ARRAY::sel(int[1], int[*])"])
+        self.assertEqual(self.names("fbr"), ["MAIN::foobar(double)"])
+        self.assertEqual(self.names("xyz"), [])
+
+    def test_filters(self):
+        self.assertEqual(self.search.search("array::", 1)[0], 3)
+        self.assertEqual(len(self.names("array::", 1)), 1)
+        self.assertEqual(self.names("arr::sel(*, int[*])"), ["ARRAY::sel(int[1], int[*])"])
+        self.assertEqual(self.names("s(int[], int[])"), ["ARRAY::sel(int[1], int[.])", "ARRAY::sel(int[1], int[*])"])
+        self.assertEqual(self.names("conj(Complex::complex[])"), ["COMPLEX::conj(COMPLEX::complex[.])"])
+        self.assertEqual(self.names("conj(Complex::complex)"), ["COMPLEX::conj(COMPLEX::complex)"])
+        self.assertEqual(self.names("MAIN::s"), [])
+        self.assertEqual(self.search.search("", 2)[0], 8)
+        self.assertRaises(ValueError, self.search.search, "foo)(int")
+
+    def test_early_exit(self):
+        search = sacsearch.FunctionSearch(sacindex.SacSymbolIndex(
+            ["SACf__MAIN__f%d__i" % i for i in range(200)] + ["SACf__MAIN__g%d__d" % i for i in range(200)] +
+            ["SACf__MATH__xf__i", "SACf__MATH__f__i"]))
+        # More matches than asked for aren't counted
+        total, functions = search.search("f", 3)
+        self.assertEqual(total, None)
+        self.assertEqual([f.name for f in functions], ["f", "f0", "f1"])
+        self.assertEqual([f.namespace for f in search.search("math::f", 3)[1]], ["MATH", "MATH"])
+        self.assertEqual(search.search("math::f", 3)[0], 2)
+        self.assertEqual(search.search("nothing::f", 3), (0, []))
+        # Argument types are looked up before names are scored, either way ranks the same
+        expected = ["f", "f0", "f1", "f2", "f3"]
+        self.assertEqual([f.name for f in search.search("f(int)", 5)[1]], expected)
+        try:
+            sacsearch.DIRECT_SCORE_LIMIT = 0
+            self.assertEqual([f.name for f in search.search_uncached("f(int)", 5)[1]], expected)
+        finally:
+            sacsearch.DIRECT_SCORE_LIMIT = 4096
+        self.assertEqual(search.search("f1(double)"), (0, []))
+        self.assertEqual(search.search("g19(*)", 11)[0], 11)
+        self.assertEqual([f.name for f in search.search("xf")[1]], ["xf"])
+
+    def test_variables(self):
+        frame_vars = saclib.SacVariableFrame(["SACl_x", "SACl_x__SSA0_1", "SACl_x__SSA0_2", "SACp_emal_1_xs"])
+        self.assertEqual([row[:2] for row in sacsearch.search_variables(frame_vars, "x")],
+                         [("x", 0), ("x", 1), ("x", 2), ("xs", 0)])
+        self.assertEqual(sacsearch.search_variables(frame_vars, "x@-1"),
+                         [("x", 2, "SACl_x__SSA0_2"), ("xs", 0, "SACp_emal_1_xs")])
+        self.assertEqual(sacsearch.search_variables(frame_vars, "x@1"), [("x", 1, "SACl_x__SSA0_1")])
+
+    def test_parse_info_args(self):
+        self.assertEqual(sacsearch.parse_info_args(["functions", "--limit", "5", "sel(int[],", "*)"]),
+                         {"command": "functions", "limit": 5, "query": "sel(int[], *)", "json": False, "file": None,
+                          "clear": False})
+        self.assertEqual(sacsearch.parse_info_args(["stats", "--json", "stats.json"])["file"], "stats.json")
+        self.assertTrue(sacsearch.parse_info_args(["stats", "--json", "--clear"])["clear"])
+        for argv in [[], ["types"], ["variables", "--limit"], ["variables", "--limit", "0"], ["stats", "x"],
+                     ["stats", "--limit", "5"]]:
+            self.assertRaises(ValueError, sacsearch.parse_info_args, argv)
 
 
 class TestCommandConversion(unittest.TestCase):
@@ -147,17 +1490,54 @@ class TestCommandConversion(unittest.TestCase):
         self.assertEqual(saclib.replace_sacblocks(input_text, output, input_vars),
                          "breakpoint SACf__MAIN__foo__i__f__i_P SACp_emal_5_x__SSA01")
 
-        input_text = "watchpoint *sac(x))"
+        input_text = "watchpoint *sac(x)"
         output = saclib.extract_sacblocks(input_text)
         self.assertEqual(saclib.replace_sacblocks(input_text, output, input_vars),
                          "watchpoint SACp_emal_5_x__SSA01")
 
         input_vars = "SACp_emal_5_x\nSACl_foo\nSACf__MAIN__foo"
-        input_text = "watchpoint *sac(x))"
+        input_text = "watchpoint *sac(x)"
         output = saclib.extract_sacblocks(input_text)
         self.assertEqual(saclib.replace_sacblocks(input_text, output, input_vars),
                          "watchpoint SACp_emal_5_x")
 
+        # Test the text between and after blocks is kept
+        input_text = "print *sac(x) + *sac(foo) * 2"
+        output = saclib.extract_sacblocks(input_text)
+        self.assertEqual(saclib.replace_sacblocks(input_text, output, input_vars),
+                         "print SACp_emal_5_x + SACl_foo * 2")
+
+        # Test unresolvable and unclosed blocks
+        input_text = "print *sac(y)"
+        self.assertEqual(saclib.replace_sacblocks(input_text, saclib.extract_sacblocks(input_text), input_vars), None)
+        input_text = "print *sac(x"
+        self.assertEqual(saclib.replace_sacblocks(input_text, saclib.extract_sacblocks(input_text), input_vars), None)
+
+    def test_split_batch(self):
+        self.assertEqual(saclib.split_batch("{ print *sac(x); sac print *sac(y)\n# comment\n p/x *sac(z) ;; sac summary a }"),
+                         ["print *sac(x)", "print *sac(y)", "p/x *sac(z)", "sac summary a"])
+        self.assertEqual(saclib.split_batch(""), [])
+        self.assertEqual(saclib.split_batch('print "a;b"; print \'\\\'\'; print "\\";"'),
+                         ['print "a;b"', "print '\\''", 'print "\\";"'])
+        self.assertEqual(saclib.split_batch("print f(x; y) ; print a[1;2]; print {1; 2}; echo x"),
+                         ["print f(x; y)", "print a[1;2]", "print {1; 2}", "echo x"])
+        self.assertEqual(saclib.print_expression("print *sac(x) + 1"), "*sac(x) + 1")
+        self.assertEqual(saclib.print_expression("p x"), "x")
+        self.assertEqual(saclib.print_expression("p/x x"), None)
+        self.assertEqual(saclib.print_expression("print -pretty -- x"), None)
+        self.assertEqual(saclib.print_expression("ptype x"), None)
+
+    def test_compile_command(self):
+        template = saclib.compile_command("print *sac(x) + *sac(foo(int[.]))")
+        self.assertEqual(template.variables, ["x"])
+        self.assertIs(saclib.compile_command("print *sac(x) + *sac(foo(int[.]))"), template)
+
+        # Re-binding only resolves the variable holes against the new locals
+        self.assertEqual(template.bind(["SACp_emal_5_x"]), "print SACp_emal_5_x + SACf__MAIN__foo__i_P")
+        self.assertEqual(template.bind(["SACp_emal_5_x", "SACp_emal_6_x__SSA0_1"]),
+                         "print SACp_emal_6_x__SSA0_1 + SACf__MAIN__foo__i_P")
+        self.assertEqual(saclib.compile_command("print *sac(foo(nope))").bind([]), None)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,200 @@
+import collections
+import itertools
+import time
+
+import saclib
+
+# Events kept by default before the oldest are overwritten
+DEFAULT_TRACE_SIZE = 1 << 16
+# Rows printed by a report by default
+DEFAULT_REPORT_LIMIT = 20
+
+ENTER = 0
+LEAVE = 1
+
+
+class TraceBuffer(object):
+    """Fixed size ring buffer of trace events, the oldest are overwritten once it is full"""
+
+    def __init__(self, size=DEFAULT_TRACE_SIZE):
+        if size < 1:
+            raise ValueError("Trace buffer size must be positive")
+        self.size = size
+        self.events = [None] * size
+        self.next = 0
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.size)
+
+    def __iter__(self):
+        # Oldest first
+        if self.total <= self.size:
+            return iter(self.events[:self.total])
+        return itertools.chain(self.events[self.next:], self.events[:self.next])
+
+    def append(self, event):
+        self.events[self.next] = event
+        self.next += 1
+        if self.next == self.size:
+            self.next = 0
+        self.total += 1
+
+    def dropped(self):
+        """Returns the number of events that have been overwritten"""
+        return self.total - len(self)
+
+    def clear(self):
+        self.events = [None] * self.size
+        self.next = 0
+        self.total = 0
+
+
+class CallTracer(object):
+    """Records SaC calls and returns as (kind, thread, function, time) events
+
+    Every thread has a shadow stack of (function, return address) pairs, a
+    return is matched to its call by the address execution returns to.
+    """
+
+    def __init__(self, size=DEFAULT_TRACE_SIZE, clock=time.perf_counter):
+        self.buffer = TraceBuffer(size)
+        self.clock = clock
+        self.stacks = dict()
+
+    def enter(self, thread, function, return_address):
+        self.stacks.setdefault(thread, list()).append((function, return_address))
+        self.buffer.append((ENTER, thread, function, self.clock()))
+
+    def leave(self, thread, return_address):
+        """Records the return of the innermost call returning to return_address, returns its function
+
+        Calls above it on the shadow stack were unwound without returning
+        normally (longjmp) and are closed at the same time.
+        """
+        stack = self.stacks.get(thread)
+        if not stack:
+            return None
+
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][1] == return_address:
+                break
+        else:
+            return None
+
+        now = self.clock()
+        while len(stack) > i:
+            function = stack.pop()[0]
+            self.buffer.append((LEAVE, thread, function, now))
+        return function
+
+    def depth(self, thread):
+        return len(self.stacks.get(thread, ()))
+
+    def clear(self):
+        self.buffer.clear()
+        self.stacks.clear()
+
+
+class TraceNode(object):
+    """A call path in a call tree with its call count and inclusive time"""
+    __slots__ = ("function", "calls", "time", "children")
+
+    def __init__(self, function=None):
+        self.function = function
+        self.calls = 0
+        self.time = 0.0
+        self.children = collections.OrderedDict()
+
+    def child(self, function):
+        node = self.children.get(function)
+        if node is None:
+            node = TraceNode(function)
+            self.children[function] = node
+        return node
+
+
+def profile(events):
+    """Returns the call counts, inclusive times and call tree of a stream of trace events
+
+    A recursive function's time is only counted for its outermost call.
+    Returns whose call has been overwritten in the ring buffer are skipped
+    and calls that haven't returned yet have no time.
+    """
+    counts = collections.Counter()
+    inclusive = collections.defaultdict(float)
+    root = TraceNode()
+    stacks = dict()
+    active = collections.Counter()
+
+    for kind, thread, function, timestamp in events:
+        stack = stacks.setdefault(thread, list())
+        if kind == ENTER:
+            node = (stack[-1][1] if stack else root).child(function)
+            node.calls += 1
+            counts[function] += 1
+            active[function] += 1
+            stack.append((function, node, timestamp))
+        elif stack and stack[-1][0] == function:
+            function, node, start = stack.pop()
+            node.time += timestamp - start
+            active[function] -= 1
+            if not active[function]:
+                inclusive[function] += timestamp - start
+
+    return counts, inclusive, root
+
+
+def sac_name(c_name):
+    return saclib.cfunc_to_sac(c_name) or c_name
+
+
+def format_profile(counts, inclusive, limit=DEFAULT_REPORT_LIMIT, name=sac_name):
+    """Formats the call counts and inclusive times, most time consuming functions first"""
+    lines = ["%8s %14s  %s" % ("calls", "inclusive ms", "function")]
+    ranked = sorted(counts, key=lambda f: (inclusive.get(f, 0.0), counts[f]), reverse=True)
+    for function in ranked[:limit]:
+        lines.append("%8d %14.3f  %s" % (counts[function], inclusive.get(function, 0.0) * 1e3, name(function)))
+    return lines
+
+
+def format_tree(root, max_depth=None, limit=DEFAULT_REPORT_LIMIT, name=sac_name):
+    """Formats a call tree, children indented under their callers"""
+    lines = list()
+
+    def format_node(node, depth):
+        for child in node.children.values():
+            if len(lines) >= limit:
+                return
+            lines.append("%s%s  calls %d  %.3f ms" % ("  " * depth, name(child.function), child.calls, child.time * 1e3))
+            if max_depth is None or depth + 1 < max_depth:
+                format_node(child, depth + 1)
+
+    format_node(root, 0)
+    return lines
+
+
+def parse_trace_args(argv):
+    """Parses the options of sactrace into a dict"""
+    options = {"command": argv[0] if argv else "report", "size": DEFAULT_TRACE_SIZE, "patterns": list(),
+               "tree": False, "depth": None, "limit": DEFAULT_REPORT_LIMIT}
+    if options["command"] not in ("start", "stop", "report", "clear"):
+        raise ValueError("Unknown sactrace command: %s" % options["command"])
+
+    i = 1
+    while i < len(argv):
+        if argv[i] in ("--size", "--depth", "--limit"):
+            if i + 1 >= len(argv) or not argv[i + 1].isdigit() or not int(argv[i + 1]):
+                raise ValueError("Option %s requires a positive number" % argv[i])
+            options[argv[i][2:]] = int(argv[i + 1])
+            i += 2
+        elif argv[i] == "--tree":
+            options["tree"] = True
+            i += 1
+        elif options["command"] == "start" and not argv[i].startswith("-"):
+            options["patterns"].append(argv[i])
+            i += 1
+        else:
+            raise ValueError("Unknown argument: %s" % argv[i])
+
+    return options
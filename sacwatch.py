@@ -0,0 +1,95 @@
+import itertools
+
+# Debug registers available for hardware watchpoints on x86
+DEFAULT_HW_BUDGET = 4
+# Bytes a single debug register can watch
+HW_SLOT_SIZE = 8
+
+
+def hw_slots(size):
+    """Returns the number of debug registers needed to watch size bytes"""
+    return max(1, (size + HW_SLOT_SIZE - 1) // HW_SLOT_SIZE)
+
+
+class Watch(object):
+    """A watched SaC variable as seen by the scheduler"""
+    __slots__ = ("key", "depth", "owner", "pinned", "cost", "last_ref", "hardware")
+
+    def __init__(self, key, depth, pinned, cost, last_ref, owner=None):
+        self.key = key
+        self.depth = depth
+        # Thread whose stack the frame at depth is on
+        self.owner = owner
+        self.pinned = pinned
+        self.cost = cost
+        self.last_ref = last_ref
+        # None until the watch has been placed for the first time
+        self.hardware = None
+
+    def priority(self):
+        # User watches first, then the most recently referenced or pushed
+        return self.pinned, self.last_ref
+
+
+class WatchScheduler(object):
+    """Shares the hardware debug registers between SaC variable watches
+
+    Changes are batched up and applied by rebalance, which returns a plan of
+    (key, hardware) pairs for the watches that have to be (re)created.
+    Software watches come first so registers are free before they are used.
+    """
+
+    def __init__(self, budget=DEFAULT_HW_BUDGET):
+        self.budget = budget
+        self.watches = dict()
+        self.clock = itertools.count()
+
+    def __contains__(self, key):
+        return key in self.watches
+
+    def __len__(self):
+        return len(self.watches)
+
+    def is_hardware(self, key):
+        return self.watches[key].hardware
+
+    def add(self, key, depth=0, pinned=False, cost=1, owner=None):
+        """Adds a watch for a variable of the frame at depth, pinned watches always rank first"""
+        self.watches[key] = Watch(key, depth, pinned, cost, next(self.clock), owner)
+
+    def remove(self, key):
+        """Forgets a watch that has been deleted"""
+        self.watches.pop(key, None)
+
+    def touch(self, key):
+        """Marks a watch as the most recently referenced"""
+        if key in self.watches:
+            self.watches[key].last_ref = next(self.clock)
+
+    def pop_depth(self, depth, owner=None):
+        """Forgets the watches of every frame of owner at or above depth and returns their keys"""
+        keys = [w.key for w in self.watches.values() if not w.pinned and w.depth >= depth and w.owner == owner]
+        for key in keys:
+            del self.watches[key]
+        return keys
+
+    def rebalance(self):
+        """Hands the budget to the highest priority watches and returns the changes"""
+        ranked = sorted(self.watches.values(), key=Watch.priority, reverse=True)
+
+        wanted = set()
+        free = self.budget
+        for watch in ranked:
+            if watch.cost <= free:
+                wanted.add(watch.key)
+                free -= watch.cost
+
+        software = list()
+        hardware = list()
+        for watch in ranked:
+            use_hardware = watch.key in wanted
+            if watch.hardware is not use_hardware:
+                watch.hardware = use_hardware
+                (hardware if use_hardware else software).append((watch.key, use_hardware))
+
+        return software + hardware